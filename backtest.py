@@ -0,0 +1,355 @@
+# backtest.py
+import argparse
+import csv
+import json
+import os
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date as calendar_date
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from match_stats import Dataset, load_dataset
+from predictor import P_ABC_batch, half_life_days, kelly_fraction, match_format_for
+
+# (tourney_date, winner, loser, winner stats, loser stats, tourney_level)
+Match = Tuple[int, str, str, List[int], List[int], str]
+# (tourney_date, player_A, player_B, probability of A winning, A won, common opponents)
+Prediction = Tuple[int, str, str, float, bool, int]
+
+CALIBRATION_BUCKETS = 10
+
+
+class RollingAggregates:
+    """Per-(player, opponent) stat totals that grow one match at a time, so a prediction
+    only ever sees the matches added before it.
+
+    With a half_life (in days) the totals are time-decayed: each pair's totals are kept
+    weighted as of its latest match and scaled down by the days since whenever another
+    match is added. The margins are ratios of one pair's totals, so they don't depend on
+    the date the weights are anchored to."""
+
+    def __init__(self, half_life: Optional[float] = None):
+        if half_life is not None and not half_life > 0:
+            raise ValueError("half_life must be a positive number of days")
+        self.half_life = half_life
+        self.stats = {}
+        self.last_days = {}
+        self.opponents = defaultdict(set)
+
+    def _add(self, player: str, adversary: str, values: List[int], day: int):
+        key = (player, adversary)
+        aggregate = self.stats.get(key)
+        if aggregate is None:
+            self.stats[key] = list(values)
+            self.opponents[player].add(adversary)
+        elif self.half_life is None:
+            for i, value in enumerate(values):
+                aggregate[i] += value
+        else:
+            scale = 2.0 ** ((self.last_days[key] - day) / self.half_life)
+            for i, value in enumerate(values):
+                aggregate[i] = aggregate[i] * scale + value
+        self.last_days[key] = day
+
+    def add(self, match: Match):
+        date, winner, loser, winner_stats, loser_stats, _ = match
+        day = calendar_date(date // 10000, date // 100 % 100, date % 100).toordinal()
+        self._add(winner, loser, winner_stats + loser_stats, day)
+        self._add(loser, winner, loser_stats + winner_stats, day)
+
+    def margin(self, player: str, adversary: str) -> Optional[float]:
+        # spw - (1 - rpw), as in Dataset.player_margin; None without serve/return points
+        stats = self.stats[(player, adversary)]
+        if stats[2] == 0 or stats[8] == 0:
+            return None
+        spw = (stats[4] + stats[5]) / float(stats[2])
+        rpw = (stats[8] - stats[10] - stats[11]) / float(stats[8])
+        return spw - (1 - rpw)
+
+    def deltas(self, player_A: str, player_B: str) -> List[float]:
+        common = self.opponents.get(player_A, set()) & self.opponents.get(player_B, set())
+        deltas = []
+        for adversary in sorted(common - {player_A, player_B}):
+            margin_A = self.margin(player_A, adversary)
+            margin_B = self.margin(player_B, adversary)
+            if margin_A is not None and margin_B is not None:
+                deltas.append(margin_A - margin_B)
+        return deltas
+
+
+def project_matches(dataset: Dataset) -> List[Match]:
+    table = dataset.table
+    names = dataset.names
+    levels = dataset.levels
+    matches = [
+        (date, names[winner], names[loser], stats[:6], stats[6:], levels[level])
+        for date, winner, loser, stats, level in zip(
+            table.date.tolist(),
+            table.winner.tolist(),
+            table.loser.tolist(),
+            table.stats.tolist(),
+            table.level.tolist(),
+        )
+    ]
+    # Stable, so matches of the same date keep their dataset order
+    matches.sort(key=lambda match: match[0])
+    return matches
+
+
+def shard_bounds(matches: List[Match], shards: int) -> List[Tuple[int, int]]:
+    # Contiguous, roughly equal slices that never split the matches of one date
+    bounds = []
+    start = 0
+    for shard in range(1, shards + 1):
+        end = min(len(matches), round(len(matches) * shard / shards))
+        while 0 < end < len(matches) and matches[end][0] == matches[end - 1][0]:
+            end += 1
+        if end > start:
+            bounds.append((start, end))
+            start = end
+    return bounds
+
+
+def backtest_matches(
+    matches: List[Match],
+    start: int,
+    end: int,
+    gender: str,
+    start_date: int = 0,
+    tabulated: bool = False,
+    half_life: Optional[float] = None,
+) -> List[Prediction]:
+    # Every match in matches[start:end] is predicted from the matches of earlier dates only;
+    # those of the same date are scored together and only then added to the aggregates.
+    # Each match is played in the format of its tournament level
+    aggregates = RollingAggregates(half_life)
+    for match in matches[:start]:
+        aggregates.add(match)
+
+    predictions = []
+    group_start = start
+    while group_start < end:
+        date = matches[group_start][0]
+        group_end = group_start
+        while group_end < end and matches[group_end][0] == date:
+            group_end += 1
+        group = matches[group_start:group_end]
+
+        if date >= start_date:
+            pairs = []
+            deltas = []
+            offsets = []
+            # The match format of every delta, numbered in order of appearance
+            formats = []
+            format_ids = {}
+            for _, winner, loser, _, _, level in group:
+                player_A, player_B = sorted((winner, loser))
+                pair_deltas = aggregates.deltas(player_A, player_B)
+                if pair_deltas:
+                    pairs.append((player_A, player_B, player_A == winner, len(pair_deltas)))
+                    offsets.append(len(deltas))
+                    deltas.extend(pair_deltas)
+                    format_id = format_ids.setdefault(match_format_for(gender, level), len(format_ids))
+                    formats.extend([format_id] * len(pair_deltas))
+            if pairs:
+                # One batch per match format among the group's matches
+                deltas = np.array(deltas)
+                formats = np.array(formats)
+                pABCs = np.empty(len(deltas))
+                for match_format, format_id in format_ids.items():
+                    selected = formats == format_id
+                    pABCs[selected] = P_ABC_batch(deltas[selected], match_format, tabulated)
+                counts = np.array([pair[3] for pair in pairs])
+                probabilities = np.add.reduceat(pABCs, offsets) / counts
+                for (player_A, player_B, a_won, common), probability in zip(pairs, probabilities):
+                    predictions.append((date, player_A, player_B, float(probability), a_won, common))
+
+        for match in group:
+            aggregates.add(match)
+        group_start = group_end
+    return predictions
+
+
+_worker_matches: List[Match] = []
+
+
+def _init_worker(matches: List[Match]):
+    global _worker_matches
+    _worker_matches = matches
+
+
+def _backtest_shard(
+    bounds: Tuple[int, int], gender: str, start_date: int, tabulated: bool, half_life: Optional[float]
+):
+    return backtest_matches(_worker_matches, *bounds, gender, start_date, tabulated, half_life)
+
+
+def run_backtest(
+    dataset: Dataset,
+    gender: str,
+    start_date: int = 0,
+    workers: Optional[int] = None,
+    tabulated: bool = False,
+    half_life: Optional[float] = None,
+) -> List[Prediction]:
+    matches = project_matches(dataset)
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        return backtest_matches(matches, 0, len(matches), gender, start_date, tabulated, half_life)
+
+    # Each shard rebuilds the aggregates of everything before it, which is cheap next to
+    # scoring its own matches
+    bounds = shard_bounds(matches, workers)
+    with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(matches,)) as executor:
+        shards = executor.map(
+            _backtest_shard,
+            bounds,
+            [gender] * len(bounds),
+            [start_date] * len(bounds),
+            [tabulated] * len(bounds),
+            [half_life] * len(bounds),
+        )
+        return [prediction for shard in shards for prediction in shard]
+
+
+def load_odds(odds_file_path: str) -> Dict[Tuple[int, str, str], Tuple[float, float]]:
+    # CSV with tourney_date, winner_name, loser_name, winner_odds and loser_odds columns,
+    # using the names and tournament dates of the match results
+    odds = {}
+    with open(odds_file_path, newline="") as odds_file:
+        for row in csv.DictReader(odds_file):
+            try:
+                odds[(int(row["tourney_date"]), row["winner_name"], row["loser_name"])] = (
+                    float(row["winner_odds"]),
+                    float(row["loser_odds"]),
+                )
+            except (KeyError, ValueError):
+                continue
+    return odds
+
+
+def evaluate(
+    predictions: List[Prediction],
+    odds: Optional[Dict[Tuple[int, str, str], Tuple[float, float]]] = None,
+    kelly_multiplier: float = 1.0,
+) -> Dict[str, object]:
+    if not predictions:
+        return {"predictions": 0}
+
+    probabilities = np.array([prediction[3] for prediction in predictions])
+    outcomes = np.array([prediction[4] for prediction in predictions], dtype=float)
+    clipped = np.clip(probabilities, 1e-12, 1 - 1e-12)
+
+    buckets = np.minimum((probabilities * CALIBRATION_BUCKETS).astype(int), CALIBRATION_BUCKETS - 1)
+    calibration = []
+    for bucket in range(CALIBRATION_BUCKETS):
+        in_bucket = buckets == bucket
+        if in_bucket.any():
+            calibration.append({
+                "bucket": [bucket / CALIBRATION_BUCKETS, (bucket + 1) / CALIBRATION_BUCKETS],
+                "count": int(in_bucket.sum()),
+                "mean_probability": float(probabilities[in_bucket].mean()),
+                "observed_frequency": float(outcomes[in_bucket].mean()),
+            })
+
+    summary = {
+        "predictions": len(predictions),
+        "accuracy": float(((probabilities > 0.5) == (outcomes == 1)).mean()),
+        "brier_score": float(((probabilities - outcomes) ** 2).mean()),
+        "log_loss": float(-(outcomes * np.log(clipped) + (1 - outcomes) * np.log(1 - clipped)).mean()),
+        "calibration": calibration,
+    }
+
+    if odds is not None:
+        # Flat-bankroll Kelly staking: each bet risks its Kelly share of one unit
+        bets = 0
+        staked = 0.0
+        profit = 0.0
+        for date, player_A, player_B, probability, a_won, _ in predictions:
+            winner, loser = (player_A, player_B) if a_won else (player_B, player_A)
+            match_odds = odds.get((date, winner, loser))
+            if match_odds is None:
+                continue
+            odds_A, odds_B = match_odds if a_won else match_odds[::-1]
+            for side_probability, side_odds, side_won in (
+                (probability, odds_A, a_won),
+                (1 - probability, odds_B, not a_won),
+            ):
+                stake = kelly_multiplier * kelly_fraction(side_probability, side_odds)
+                if stake > 0:
+                    bets += 1
+                    staked += stake
+                    profit += stake * (side_odds - 1) if side_won else -stake
+        summary.update({
+            "bets": bets,
+            "staked": staked,
+            "profit": profit,
+            "roi": profit / staked if staked else None,
+        })
+    return summary
+
+
+def write_predictions_csv(output_file_path: str, predictions: List[Prediction]):
+    with open(output_file_path, "w", newline="") as output:
+        writer = csv.writer(output)
+        writer.writerow(["tourney_date", "player_A", "player_B", "probability", "player_A_won", "common_opponents"])
+        writer.writerows(predictions)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Point-in-time backtest of the common-opponent model over historical matches"
+    )
+    parser.add_argument(
+        "gender",
+        choices=("men", "women"),
+        help="Specify gender of players so as to select from atp or wta statistics",
+    )
+    parser.add_argument(
+        "--years",
+        type=int,
+        default=[2021, 2023],
+        nargs=2,
+        help="Range of years of matches to walk through",
+    )
+    parser.add_argument(
+        "--start-date",
+        type=int,
+        default=0,
+        help="Only score matches from this tourney_date on (YYYYMMDD); earlier ones only feed the statistics",
+    )
+    parser.add_argument("--odds", help="CSV of bookmaker odds used to compute the Kelly ROI")
+    parser.add_argument(
+        "--kelly-multiplier", type=float, default=1.0, help="Fraction of the full Kelly stake to bet"
+    )
+    parser.add_argument(
+        "--half-life",
+        type=half_life_days,
+        help="Weight earlier matches down by age, halving their weight every this many days",
+    )
+    parser.add_argument("--workers", type=int, help="Number of processes, defaults to the CPU count")
+    parser.add_argument("--predictions", help="Write every prediction as CSV to this file")
+    parser.add_argument(
+        "--tabulated",
+        action="store_true",
+        help="Use precomputed M3/M5 lookup tables instead of the exact formulas",
+    )
+    parser.add_argument(
+        "-v", "--verbosity", action="count", default=0, help="increase output verbosity"
+    )
+    args = parser.parse_args()
+
+    dataset = load_dataset(args.years, args.gender, args.verbosity)
+    predictions = run_backtest(
+        dataset, args.gender, args.start_date, args.workers, args.tabulated, args.half_life
+    )
+    if args.predictions:
+        write_predictions_csv(args.predictions, predictions)
+    odds = load_odds(args.odds) if args.odds else None
+    print(json.dumps(evaluate(predictions, odds, args.kelly_multiplier), indent=2))
+
+
+if __name__ == "__main__":
+    main()
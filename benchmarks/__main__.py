@@ -0,0 +1,4 @@
+# benchmarks/__main__.py
+from benchmarks.suite import main
+
+main()
@@ -0,0 +1,261 @@
+# benchmarks/generator.py
+import argparse
+import csv
+import os
+import random
+from typing import Dict, List, Sequence, Tuple
+
+HEADER = [
+    "tourney_id", "tourney_name", "surface", "draw_size", "tourney_level", "tourney_date", "match_num",
+    "winner_id", "winner_seed", "winner_entry", "winner_name", "winner_hand", "winner_ht", "winner_ioc",
+    "winner_age", "loser_id", "loser_seed", "loser_entry", "loser_name", "loser_hand", "loser_ht",
+    "loser_ioc", "loser_age", "score", "best_of", "round", "minutes", "w_ace", "w_df", "w_svpt",
+    "w_1stIn", "w_1stWon", "w_2ndWon", "w_SvGms", "w_bpSaved", "w_bpFaced", "l_ace", "l_df", "l_svpt",
+    "l_1stIn", "l_1stWon", "l_2ndWon", "l_SvGms", "l_bpSaved", "l_bpFaced", "winner_rank",
+    "winner_rank_points", "loser_rank", "loser_rank_points",
+]
+TOURS = {"men": "atp", "women": "wta"}
+# (level, draw size, tournaments a year, best of) of each tour's calendar, scaled by
+# the tournaments argument; the remaining tournaments are of the last level
+CALENDARS = {
+    "men": [("G", 128, 4, 5), ("M", 64, 9, 3), ("A", 32, None, 3)],
+    "women": [("G", 128, 4, 3), ("PM", 64, 10, 3), ("P", 32, None, 3)],
+}
+SURFACES = (("Hard", 0.55), ("Clay", 0.3), ("Grass", 0.1), ("Carpet", 0.05))
+COUNTRIES = ("ESP", "FRA", "USA", "ITA", "GER", "ARG", "AUS", "SRB", "RUS", "GBR", "CZE", "JPN")
+# Mean serve point win probability of each tour, the spread of the players' serve and
+# return strengths around it, and the chances of the rows the loader has to drop
+SERVE_MEANS = {"men": 0.64, "women": 0.56}
+SKILL_SPREAD = 0.035
+FIRST_SERVE_IN = 0.62
+DOUBLE_FAULT = 0.08
+WALKOVER_RATE = 0.01
+RETIREMENT_RATE = 0.02
+MISSING_STATS_RATE = 0.03
+
+
+class Player:
+    def __init__(self, rnd: random.Random, tour: str, number: int, serve_mean: float):
+        self.id = str(100000 + number)
+        self.name = f"Player {tour} {number}"
+        self.hand = rnd.choice("RRRRL")
+        self.height = str(rnd.randint(165, 205))
+        self.country = rnd.choice(COUNTRIES)
+        self.age = rnd.uniform(0, 17)
+        self.serve = rnd.gauss(serve_mean, SKILL_SPREAD)
+        self.ret = rnd.gauss(1 - serve_mean, SKILL_SPREAD)
+
+
+class Side:
+    # Serve statistics of one player in a match, in the order of the w_/l_ columns
+    def __init__(self):
+        self.ace = self.df = self.svpt = self.first_in = self.first_won = self.second_won = 0
+        self.service_games = self.bp_saved = self.bp_faced = 0
+
+    def columns(self) -> List[str]:
+        return [str(value) for value in (
+            self.ace, self.df, self.svpt, self.first_in, self.first_won, self.second_won,
+            self.service_games, self.bp_saved, self.bp_faced,
+        )]
+
+
+def play_point(rnd: random.Random, p: float, side: Side) -> bool:
+    # Serves one point won with probability p, split into first and second serves
+    first_won = min(0.95, p + 0.1)
+    second_won = (p - FIRST_SERVE_IN * first_won) / ((1 - FIRST_SERVE_IN) * (1 - DOUBLE_FAULT))
+    side.svpt += 1
+    if rnd.random() < FIRST_SERVE_IN:
+        side.first_in += 1
+        if rnd.random() < first_won:
+            side.first_won += 1
+            side.ace += rnd.random() < 0.2
+            return True
+        return False
+    if rnd.random() < DOUBLE_FAULT:
+        side.df += 1
+        return False
+    if rnd.random() < second_won:
+        side.second_won += 1
+        return True
+    return False
+
+
+def play_game(rnd: random.Random, p: float, side: Side) -> bool:
+    side.service_games += 1
+    won = lost = 0
+    while True:
+        if lost >= 3 and lost > won:
+            side.bp_faced += 1
+            break_point = True
+        else:
+            break_point = False
+        if play_point(rnd, p, side):
+            won += 1
+            side.bp_saved += break_point
+        else:
+            lost += 1
+        if won >= 4 and won - lost >= 2:
+            return True
+        if lost >= 4 and lost - won >= 2:
+            return False
+
+
+def play_tiebreak(rnd: random.Random, p: Tuple[float, float], sides: Tuple[Side, Side], server: int, target: int):
+    points = [0, 0]
+    while max(points) < target or abs(points[0] - points[1]) < 2:
+        won = play_point(rnd, p[server], sides[server])
+        points[server if won else 1 - server] += 1
+        if sum(points) % 2 == 1:
+            server = 1 - server
+    return points
+
+
+def play_match(rnd: random.Random, players: Tuple[Player, Player], best_of: int, retirement: bool):
+    # Plays a match between two players game by game, returning the index of the winner,
+    # the score and both sides' serve statistics
+    p = tuple(
+        min(0.9, max(0.3, (server.serve + 1 - returner.ret) / 2))
+        for server, returner in (players, players[::-1])
+    )
+    sides = (Side(), Side())
+    sets_won = [0, 0]
+    score = []
+    server = 0
+    final_set = best_of - 1
+    while max(sets_won) <= best_of // 2:
+        games = [0, 0]
+        tiebreak = None
+        while True:
+            if games == [6, 6]:
+                target = 10 if len(score) == final_set else 7
+                tiebreak = play_tiebreak(rnd, p, sides, server, target)
+                games[0 if tiebreak[0] > tiebreak[1] else 1] += 1
+                server = 1 - server
+                break
+            holder = server
+            won = play_game(rnd, p[holder], sides[holder])
+            games[holder if won else 1 - holder] += 1
+            server = 1 - server
+            if max(games) >= 6 and abs(games[0] - games[1]) >= 2:
+                break
+        winner = 0 if games[0] > games[1] else 1
+        sets_won[winner] += 1
+        score.append((games, tiebreak))
+        if retirement and rnd.random() < 0.5:
+            break
+        if sets_won[winner] > best_of // 2:
+            break
+    winner = 0 if sets_won[0] >= sets_won[1] else 1
+    if retirement:
+        winner = rnd.randint(0, 1)
+    # Tiebreak sets carry the points of the tiebreak's loser, as in 7-6(5)
+    text = " ".join(
+        f"{games[winner]}-{games[1 - winner]}" + (f"({min(tiebreak)})" if tiebreak is not None else "")
+        for games, tiebreak in score
+    )
+    if retirement:
+        text += " RET"
+    return winner, text, sides
+
+
+def round_name(remaining: int) -> str:
+    return {2: "F", 4: "SF", 8: "QF"}.get(remaining, f"R{remaining}")
+
+
+def calendar(gender: str, tournaments: int) -> List[Tuple[str, int, int]]:
+    # (level, draw size, best of) of each tournament of a year
+    events = []
+    for level, draw_size, count, best_of in CALENDARS[gender]:
+        count = tournaments - len(events) if count is None else min(count, tournaments - len(events))
+        events.extend([(level, draw_size, best_of)] * max(0, count))
+    return events
+
+
+def generate_year(
+    rnd: random.Random, writer, gender: str, year: int, players: List[Player], tournaments: int
+):
+    tour = TOURS[gender]
+    events = calendar(gender, tournaments)
+    rnd.shuffle(events)
+    weeks = sorted(rnd.choices(range(48), k=tournaments))
+    for number, ((level, draw_size, best_of), week) in enumerate(zip(events, weeks)):
+        draw_size = min(draw_size, 1 << (len(players).bit_length() - 1))
+        surface = rnd.choices([name for name, _ in SURFACES], [weight for _, weight in SURFACES])[0]
+        monday = year * 10000 + (week // 4 + 1) * 100 + week % 4 * 7 + 1
+        tourney_id = f"{year}-{tour}-{number:03d}"
+        # Stronger players enter more often
+        entrants = sorted(
+            rnd.sample(players, min(len(players), draw_size * 2)), key=lambda player: -player.serve - player.ret
+        )[:draw_size]
+        rnd.shuffle(entrants)
+        match_number = 0
+        while len(entrants) > 1:
+            winners = []
+            for i in range(0, len(entrants), 2):
+                pair = (entrants[i], entrants[i + 1])
+                match_number += 1
+                row = [""] * len(HEADER)
+                row[:7] = [tourney_id, f"{tour.upper()} {number}", surface, str(draw_size), level, str(monday), str(match_number)]
+                u = rnd.random()
+                if u < WALKOVER_RATE:
+                    winner, score, sides = rnd.randint(0, 1), "W/O", None
+                else:
+                    winner, score, sides = play_match(rnd, pair, best_of, u < WALKOVER_RATE + RETIREMENT_RATE)
+                for offset, index in ((7, winner), (15, 1 - winner)):
+                    player = pair[index]
+                    row[offset:offset + 8] = [
+                        player.id, "", "", player.name, player.hand, player.height, player.country,
+                        f"{18 + (player.age + year + week / 52) % 17:.1f}",
+                    ]
+                row[23:27] = [score, str(best_of), round_name(len(entrants)), ""]
+                if sides is not None and rnd.random() >= MISSING_STATS_RATE:
+                    row[27:36] = sides[winner].columns()
+                    row[36:45] = sides[1 - winner].columns()
+                writer.writerow(row)
+                winners.append(pair[winner])
+            entrants = winners
+
+
+def generate(
+    root: str,
+    gender: str,
+    years: Sequence[int],
+    players: int = 400,
+    tournaments: int = 60,
+    seed: int = 0,
+) -> Dict[int, str]:
+    """Writes a year of synthetic results per year in the atp/ or wta/ layout of the
+    downloaded files under root, and returns their paths. Each player has fixed serve
+    and return strengths, and every tournament is a knockout draw played point by
+    point, so the statistics and results are consistent with each other."""
+    rnd = random.Random(f"{seed}-{gender}")
+    tour = TOURS[gender]
+    roster = [Player(rnd, tour, number, SERVE_MEANS[gender]) for number in range(players)]
+    os.makedirs(os.path.join(root, tour), exist_ok=True)
+    paths = {}
+    for year in years:
+        path = os.path.join(root, tour, f"{year}.csv")
+        with open(path, "w", newline="") as results_file:
+            writer = csv.writer(results_file)
+            writer.writerow(HEADER)
+            generate_year(rnd, writer, gender, year, roster, tournaments)
+        paths[year] = path
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write synthetic match results in the Sackmann format")
+    parser.add_argument("root", help="Directory to write the atp/ and wta/ yearly files into")
+    parser.add_argument("--genders", nargs="+", choices=tuple(TOURS), default=list(TOURS))
+    parser.add_argument("--years", type=int, nargs=2, default=[2010, 2019], help="First and last year")
+    parser.add_argument("--players", type=int, default=400, help="Number of players per tour")
+    parser.add_argument("--tournaments", type=int, default=60, help="Tournaments per year, the match density")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    for gender in args.genders:
+        generate(args.root, gender, range(args.years[0], args.years[1] + 1), args.players, args.tournaments, args.seed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,289 @@
+# benchmarks/suite.py
+import argparse
+import contextlib
+import glob
+import io
+import json
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from benchmarks.generator import TOURS, generate
+from detailed_analysis import analyse_common_opponents
+from malleys import BEST_OF_5, M3_array, M5_array, match_probability_array
+from match_stats import Dataset, cache_filepath, load_dataset
+from predictor import P_matrix
+
+# Timed runs of each scenario; the reported wall time is their median
+REPEATS = 3
+# A scenario is slower than its baseline when its wall time or peak memory grows by
+# more than this fraction
+REGRESSION_THRESHOLD = 0.2
+# Calls timed by the per-call scenarios
+PREDICTIONS = 200
+ANALYSES = 100
+DRAW_SIZE = 64
+MALLEYS_POINTS = 100_000
+
+
+class Context:
+    """The generated data a run works on, loaded once for the scenarios that need a
+    dataset rather than measure loading it."""
+
+    def __init__(self, root: str, gender: str, years: Tuple[int, int], seed: int):
+        self.root = root
+        self.gender = gender
+        self.years = years
+        self.seed = seed
+        self._dataset = None
+
+    def clear_caches(self):
+        for results_file_path in glob.glob(os.path.join(self.root, TOURS[self.gender], "*.csv")):
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(cache_filepath(results_file_path))
+
+    def load(self) -> Dataset:
+        return load_dataset(self.years, self.gender)
+
+    def load_once(self) -> int:
+        self.load()
+        return 1
+
+    @property
+    def dataset(self) -> Dataset:
+        if self._dataset is None:
+            self._dataset = self.load()
+        return self._dataset
+
+    def pairs(self, count: int) -> List[Tuple[str, str]]:
+        # Random pairs of regular players, the same ones for every run with the same seed
+        players = self.dataset.list_players(match_min=10)
+        rnd = random.Random(self.seed)
+        return [tuple(rnd.sample(players, 2)) for _ in range(count)]
+
+
+# Each scenario prepares its inputs from a context and returns the function to time,
+# which returns the number of calls it made
+def cold_load(context: Context) -> Callable[[], int]:
+    context.clear_caches()
+    return context.load_once
+
+
+def warm_load(context: Context) -> Callable[[], int]:
+    context.load()
+    return context.load_once
+
+
+def single_prediction(context: Context) -> Callable[[], int]:
+    dataset = context.dataset
+    pairs = context.pairs(PREDICTIONS)
+
+    def run():
+        with contextlib.redirect_stdout(io.StringIO()):
+            for player_A, player_B in pairs:
+                dataset.P(player_A, player_B)
+        return len(pairs)
+
+    return run
+
+
+def draw(context: Context) -> Callable[[], int]:
+    dataset = context.dataset
+    players = dataset.list_players(match_min=10)[:DRAW_SIZE]
+
+    def run():
+        P_matrix(players, context.gender, dataset=dataset)
+        return len(players) * (len(players) - 1) // 2
+
+    return run
+
+
+def detailed_analysis(context: Context) -> Callable[[], int]:
+    dataset = context.dataset
+    pairs = context.pairs(ANALYSES)
+
+    def run():
+        for player_A, player_B in pairs:
+            analyse_common_opponents(player_A, player_B, dataset)
+        return len(pairs)
+
+    return run
+
+
+def malleys(context: Context) -> Callable[[], int]:
+    rng = np.random.default_rng(0)
+    p = rng.uniform(0.4, 0.8, MALLEYS_POINTS)
+    q = rng.uniform(0.2, 0.6, MALLEYS_POINTS)
+
+    def run():
+        M3_array(p, q)
+        M5_array(p, q)
+        match_probability_array(p, q, BEST_OF_5)
+        return 3 * MALLEYS_POINTS
+
+    return run
+
+
+SCENARIOS = {
+    "cold_load": cold_load,
+    "warm_load": warm_load,
+    "single_prediction": single_prediction,
+    "draw": draw,
+    "detailed_analysis": detailed_analysis,
+    "malleys": malleys,
+}
+
+
+def measure(scenario: Callable[[Context], Callable[[], int]], context: Context, repeats: int = REPEATS) -> Dict[str, Any]:
+    # Wall times come from runs without tracing, the peak memory from one more traced run
+    times = []
+    for _ in range(repeats):
+        run = scenario(context)
+        start = time.perf_counter()
+        calls = run()
+        times.append(time.perf_counter() - start)
+
+    run = scenario(context)
+    tracemalloc.start()
+    try:
+        run()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    wall_time = statistics.median(times)
+    return {
+        "wall_time": wall_time,
+        "peak_memory": peak,
+        "calls": calls,
+        "throughput": calls / wall_time if wall_time else None,
+    }
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], threshold: float = REGRESSION_THRESHOLD) -> List[str]:
+    # Descriptions of the measures that grew by more than threshold over the baseline
+    regressions = []
+    for name, result in results["scenarios"].items():
+        base = baseline.get("scenarios", {}).get(name)
+        if base is None:
+            continue
+        for measure_name in ("wall_time", "peak_memory"):
+            if base[measure_name] and result[measure_name] > base[measure_name] * (1 + threshold):
+                regressions.append(
+                    f"{name} {measure_name}: {result[measure_name]:.6g} against {base[measure_name]:.6g} "
+                    f"(+{result[measure_name] / base[measure_name] - 1:.0%})"
+                )
+    return regressions
+
+
+def run_suite(
+    names: List[str],
+    gender: str = "men",
+    years: Tuple[int, int] = (2010, 2019),
+    players: int = 400,
+    tournaments: int = 60,
+    seed: int = 0,
+    repeats: int = REPEATS,
+    root: Optional[str] = None,
+) -> Dict[str, Any]:
+    """Generates the data (in a temporary directory unless root is given) and measures
+    the named scenarios on it."""
+    temporary = root is None
+    # Absolute, since the scenarios run from within it
+    root = tempfile.mkdtemp(prefix="tennis-benchmarks-") if temporary else os.path.abspath(root)
+    working_directory = os.getcwd()
+    try:
+        generate(root, gender, range(years[0], years[1] + 1), players, tournaments, seed)
+        # The datasets read the yearly files relative to the working directory
+        os.chdir(root)
+        context = Context(root, gender, years, seed)
+        scenarios = {name: measure(SCENARIOS[name], context, repeats) for name in names}
+    finally:
+        os.chdir(working_directory)
+        if temporary:
+            shutil.rmtree(root, ignore_errors=True)
+
+    return {
+        "parameters": {
+            "gender": gender,
+            "years": list(years),
+            "players": players,
+            "tournaments": tournaments,
+            "seed": seed,
+        },
+        "repeats": repeats,
+        "scenarios": scenarios,
+    }
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks",
+        description="Time loading, predictions and analyses on a generated Sackmann-format dataset",
+    )
+    parser.add_argument(
+        "scenarios", nargs="*", metavar="scenario", help=f"Scenarios to run, all by default: {', '.join(SCENARIOS)}"
+    )
+    parser.add_argument("--gender", choices=tuple(TOURS), default="men")
+    parser.add_argument("--years", type=int, nargs=2, default=[2010, 2019], help="First and last generated year")
+    parser.add_argument("--players", type=int, default=400, help="Number of generated players")
+    parser.add_argument("--tournaments", type=int, default=60, help="Tournaments per year, the match density")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeats", type=int, default=REPEATS, help="Timed runs of each scenario")
+    parser.add_argument("--data", help="Directory to generate the data into and keep, a temporary one by default")
+    parser.add_argument("--output", help="Write the results as JSON to this file instead of stdout")
+    parser.add_argument("--baseline", help="Results JSON to compare against; regressions exit with status 1")
+    parser.add_argument("--save-baseline", help="Also write the results to this file as the new baseline")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=REGRESSION_THRESHOLD,
+        help="Fraction by which a wall time or peak memory may exceed the baseline",
+    )
+    args = parser.parse_args(argv)
+    unknown = [name for name in args.scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenarios {', '.join(unknown)}, choose from {', '.join(SCENARIOS)}")
+
+    results = run_suite(
+        args.scenarios or list(SCENARIOS),
+        args.gender,
+        tuple(args.years),
+        args.players,
+        args.tournaments,
+        args.seed,
+        args.repeats,
+        args.data,
+    )
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        if baseline.get("parameters") != results["parameters"]:
+            print("The baseline was measured with other parameters", file=sys.stderr)
+        regressions = compare(results, baseline, args.threshold)
+        results["regressions"] = regressions
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            output_file.write(output + "\n")
+    else:
+        print(output)
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as baseline_file:
+            baseline_file.write(output + "\n")
+
+    for regression in regressions:
+        print(f"Regression: {regression}", file=sys.stderr)
+    if regressions:
+        sys.exit(1)
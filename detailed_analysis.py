@@ -1,58 +1,32 @@
 # detailed_analysis.py  
-from match_stats import player_wins, player_losses, WINNER_NAME, LOSER_NAME  
-from typing import List, Dict, Any  
-  
-DATE_INDEX = 5  # Index for tourney_date  
-# SCORE_INDEX = 23  # Index for score  
-  
-def get_common_opponents(player_A: str, player_B: str) -> List[str]:  
-    wins_A = set(match_result[LOSER_NAME] for match_result in player_wins(player_A))  
-    losses_A = set(match_result[WINNER_NAME] for match_result in player_losses(player_A))  
-    opponents_A = wins_A.union(losses_A)  
-  
-    wins_B = set(match_result[LOSER_NAME] for match_result in player_wins(player_B))  
-    losses_B = set(match_result[WINNER_NAME] for match_result in player_losses(player_B))  
-    opponents_B = wins_B.union(losses_B)  
-  
-    common_opponents = list(opponents_A.intersection(opponents_B))  
-    return common_opponents  
-  
-def get_match_details(player_A: str, player_B: str, common_opponents: List[str]) -> List[Dict[str, Any]]:  
-    details = []  
-    for opponent in common_opponents:  
-        # Retrieve matches for player A and B against each common opponent  
-        matches_A = list(player_wins(player_A, opponent)) + list(player_losses(player_A, opponent))  
-        matches_B = list(player_wins(player_B, opponent)) + list(player_losses(player_B, opponent))  
-  
-        # Details for Player A  
-        for match_A in matches_A:  
-            player_A_won = match_A[WINNER_NAME] == player_A  
-            result_A = "won" if player_A_won else "lost"  
-            detail_A = {  
-                'player': player_A,  
-                'opponent': opponent,  
-                'date': match_A[DATE_INDEX],  
-                'result': result_A,  
-                # 'score': match_A[SCORE_INDEX],  
-            }  
-            details.append(detail_A)  
-  
-        # Details for Player B  
-        for match_B in matches_B:  
-            player_B_won = match_B[WINNER_NAME] == player_B  
-            result_B = "won" if player_B_won else "lost"  
-            detail_B = {  
-                'player': player_B,  
-                'opponent': opponent,  
-                'date': match_B[DATE_INDEX],  
-                'result': result_B,  
-                # 'score': match_B[SCORE_INDEX],  
-            }  
-            details.append(detail_B)  
-    return details  
+from collections import defaultdict
+from match_stats import Dataset, Filter, Window, current_dataset  
+from typing import List, Dict, Any, Optional  
 
 
-def get_summary_statistics(player_A: str, player_B: str, common_opponents: List[str]) -> Dict[str, Any]:  
+def _matches_by_opponent(player: str, dataset: Dataset, window: Window = None, surface: Filter = None, level: Filter = None) -> Dict[str, List[Dict[str, Any]]]:  
+    # One pass over the player's own matches, grouped per adversary as match details  
+    matches = defaultdict(list)  
+    for match in dataset.player_matches(player, window, surface, level):  
+        player_won = match.winner_name == player  
+        opponent = match.loser_name if player_won else match.winner_name  
+        matches[opponent].append({  
+            'player': player,  
+            'opponent': opponent,  
+            'date': str(match.tourney_date),  
+            'result': "won" if player_won else "lost",  
+            'score': match.score,  
+        })  
+    return matches  
+
+
+def analyse_common_opponents(player_A: str, player_B: str, dataset: Optional[Dataset] = None, window: Window = None, surface: Filter = None, level: Filter = None) -> Dict[str, Any]:  
+    dataset = dataset or current_dataset()  
+    matches_A = _matches_by_opponent(player_A, dataset, window, surface, level)  
+    matches_B = _matches_by_opponent(player_B, dataset, window, surface, level)  
+    common_opponents = sorted((matches_A.keys() & matches_B.keys()) - {player_A, player_B})  
+  
+    details = []  
     summary = {  
         'total_games': 0,  
         'common_opponents': len(common_opponents),  
@@ -61,24 +35,48 @@ def get_summary_statistics(player_A: str, player_B: str, common_opponents: List[
         'player_B_wins': 0,  
         'player_B_losses': 0,  
     }  
-  
     for opponent in common_opponents:  
-        matches_A = list(player_wins(player_A, opponent)) + list(player_losses(player_A, opponent))  
-        matches_B = list(player_wins(player_B, opponent)) + list(player_losses(player_B, opponent))  
-          
-        summary['total_games'] += len(matches_A) + len(matches_B)  
-        summary['player_A_wins'] += sum(1 for match in matches_A if match[WINNER_NAME] == player_A)  
-        summary['player_A_losses'] += sum(1 for match in matches_A if match[LOSER_NAME] == player_A)  
-        summary['player_B_wins'] += sum(1 for match in matches_B if match[WINNER_NAME] == player_B)  
-        summary['player_B_losses'] += sum(1 for match in matches_B if match[LOSER_NAME] == player_B)  
+        for side, matches in (('player_A', matches_A[opponent]), ('player_B', matches_B[opponent])):  
+            details.extend(matches)  
+            wins = sum(1 for match in matches if match['result'] == "won")  
+            summary['total_games'] += len(matches)  
+            summary[f'{side}_wins'] += wins  
+            summary[f'{side}_losses'] += len(matches) - wins  
+  
+    return {  
+        'common_opponents': common_opponents,  
+        'match_details': details,  
+        'summary': summary,  
+    }  
+  
+def get_common_opponents(player_A: str, player_B: str, dataset: Optional[Dataset] = None, window: Window = None, surface: Filter = None, level: Filter = None) -> List[str]:  
+    return (dataset or current_dataset()).common_opponents(player_A, player_B, window, surface, level)  
   
-    return summary  
+def get_match_details(player_A: str, player_B: str, common_opponents: List[str], dataset: Optional[Dataset] = None, window: Window = None, surface: Filter = None, level: Filter = None) -> List[Dict[str, Any]]:  
+    dataset = dataset or current_dataset()  
+    matches_A = _matches_by_opponent(player_A, dataset, window, surface, level)  
+    matches_B = _matches_by_opponent(player_B, dataset, window, surface, level)  
+    details = []  
+    for opponent in common_opponents:  
+        details.extend(matches_A.get(opponent, []))  
+        details.extend(matches_B.get(opponent, []))  
+    return details  
+
+
+def get_summary_statistics(player_A: str, player_B: str, common_opponents: List[str], dataset: Optional[Dataset] = None, window: Window = None, surface: Filter = None, level: Filter = None) -> Dict[str, Any]:  
+    details = get_match_details(player_A, player_B, common_opponents, dataset, window, surface, level)  
+    return {  
+        'total_games': len(details),  
+        'common_opponents': len(common_opponents),  
+        'player_A_wins': sum(1 for d in details if d['player'] == player_A and d['result'] == "won"),  
+        'player_A_losses': sum(1 for d in details if d['player'] == player_A and d['result'] == "lost"),  
+        'player_B_wins': sum(1 for d in details if d['player'] == player_B and d['result'] == "won"),  
+        'player_B_losses': sum(1 for d in details if d['player'] == player_B and d['result'] == "lost"),  
+    }  
 
   
 def format_match_details(match_details: List[Dict[str, Any]]) -> str:  
-    formatted_details = ""  
-    for detail in match_details:  
-        formatted_details += (  
-            f"{detail['player']} {detail['result']} against {detail['opponent']} on {detail['date']}, score: {detail['score']}\n"  
-        )  
-    return formatted_details  
+    return "".join(  
+        f"{detail['player']} {detail['result']} against {detail['opponent']} on {detail['date']}, score: {detail['score']}\n"  
+        for detail in match_details  
+    )  
@@ -0,0 +1,192 @@
+# instrumentation.py
+import inspect
+import json
+import threading
+from collections import Counter
+from functools import wraps
+from time import perf_counter
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+# Off by default: instrumented functions then only pay for a couple of flag checks per call
+enabled = False
+
+# Time the current thread spent in stages nested inside the one being timed, and the
+# thread's own Recording if it has one
+_local = threading.local()
+
+
+class Recording:
+    """Timings and counters of instrumented calls."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # Per stage: [calls, total seconds, seconds outside other stages, slowest call in seconds]
+        self.timings: Dict[str, list] = {}
+        self.counters: Counter = Counter()
+
+    def record(self, stage: str, seconds: float, own_seconds: Optional[float] = None):
+        with self.lock:
+            timing = self.timings.setdefault(stage, [0, 0.0, 0.0, 0.0])
+            timing[0] += 1
+            timing[1] += seconds
+            timing[2] += seconds if own_seconds is None else own_seconds
+            timing[3] = max(timing[3], seconds)
+
+    def count(self, counter: str, amount: int = 1):
+        with self.lock:
+            self.counters[counter] += amount
+
+    def reset(self):
+        with self.lock:
+            self.timings.clear()
+            self.counters.clear()
+
+    def summary(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                "timings": {
+                    stage: {"calls": calls, "total": total, "own": own, "mean": total / calls, "max": slowest}
+                    for stage, (calls, total, own, slowest) in self.timings.items()
+                },
+                "counters": dict(self.counters),
+            }
+
+
+# Where the calls of threads without a Recording of their own go while enabled
+_process_recording = Recording()
+
+
+def enable(on: bool = True):
+    global enabled
+    enabled = on
+
+
+def reset():
+    _process_recording.reset()
+
+
+def start_recording() -> Recording:
+    """Records the calls made by the current thread into a new Recording, apart from the
+    process-wide one and whether or not it is enabled, until stop_recording. Calls made
+    from other threads, such as a pool of downloads, are not part of it."""
+    _local.recording = Recording()
+    return _local.recording
+
+
+def stop_recording():
+    _local.recording = None
+
+
+def _recording() -> Optional[Recording]:
+    # The current thread's own Recording, else the process-wide one while enabled
+    recording = getattr(_local, "recording", None)
+    if recording is None and enabled:
+        return _process_recording
+    return recording
+
+
+def record(stage: str, seconds: float, own_seconds: Optional[float] = None):
+    recording = _recording()
+    if recording is not None:
+        recording.record(stage, seconds, own_seconds)
+
+
+def _start() -> Tuple[float, float]:
+    outer = getattr(_local, "nested", 0.0)
+    _local.nested = 0.0
+    return outer, perf_counter()
+
+
+def _stop(outer: float, start: float) -> Tuple[float, float]:
+    # The time since _start, and the part of it not spent in nested stages
+    seconds = perf_counter() - start
+    own_seconds = seconds - _local.nested
+    _local.nested = outer + seconds
+    return seconds, own_seconds
+
+
+def count(counter: str, amount: int = 1):
+    recording = _recording()
+    if recording is not None:
+        recording.count(counter, amount)
+
+
+def _timed_rows(stage: str, rows: Iterable):
+    # Times producing each row of an iterable, recorded as one call once it is exhausted
+    # or closed, and counts the rows
+    rows = iter(rows)
+    seconds = own_seconds = 0.0
+    produced = 0
+    try:
+        while True:
+            outer, start = _start()
+            try:
+                row = next(rows)
+            except StopIteration:
+                return
+            finally:
+                row_seconds, row_own_seconds = _stop(outer, start)
+                seconds += row_seconds
+                own_seconds += row_own_seconds
+            produced += 1
+            yield row
+    finally:
+        record(stage, seconds, own_seconds)
+        count(f"{stage} rows", produced)
+
+
+def timed(stage: str, rows: bool = False):
+    """Decorator recording the latency of each call under stage while enabled, or while
+    the calling thread is recording. For generator functions, and functions returning an
+    iterator of rows when rows is set, the stage covers producing all the rows instead,
+    and counts them."""
+
+    def decorate(function):
+        if rows or inspect.isgeneratorfunction(function):
+
+            @wraps(function)
+            def rows_wrapper(*args, **kwargs):
+                if not enabled and getattr(_local, "recording", None) is None:
+                    return function(*args, **kwargs)
+                return _timed_rows(stage, function(*args, **kwargs))
+
+            return rows_wrapper
+
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if not enabled and getattr(_local, "recording", None) is None:
+                return function(*args, **kwargs)
+            outer, start = _start()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                record(stage, *_stop(outer, start))
+
+        return wrapper
+
+    return decorate
+
+
+def summary() -> Dict[str, Any]:
+    return _process_recording.summary()
+
+
+def format_summary(report: Dict[str, Any]) -> str:
+    # The summary as a table of stages, the most time outside nested stages first, then
+    # the counters
+    lines = [f"{'stage':<32} {'calls':>8} {'total ms':>10} {'own ms':>10} {'mean ms':>10} {'max ms':>10}"]
+    for stage, timing in sorted(report["timings"].items(), key=lambda item: -item[1]["own"]):
+        lines.append(
+            f"{stage:<32} {timing['calls']:>8} {timing['total'] * 1e3:>10.2f} {timing['own'] * 1e3:>10.2f} "
+            f"{timing['mean'] * 1e3:>10.3f} {timing['max'] * 1e3:>10.3f}"
+        )
+    if report["counters"]:
+        lines.append("")
+        lines.append(f"{'counter':<32} {'value':>8}")
+        lines.extend(f"{counter:<32} {value:>8}" for counter, value in sorted(report["counters"].items()))
+    return "\n".join(lines)
+
+
+def write_summary(path: str, report: Dict[str, Any]):
+    with open(path, "w") as summary_file:
+        json.dump(report, summary_file, indent=2)
@@ -1,4 +1,11 @@
 # malleys.py
+import os
+from functools import lru_cache
+from typing import NamedTuple, Optional
+
+import numpy as np
+
+import instrumentation
 
 A = [[1, 3, 0, 4, 0, 0],
      [3, 3, 1, 4, 0, 0],
@@ -13,6 +20,7 @@ A = [[1, 3, 0, 4, 0, 0],
      [5, 1, 4, 6, 0, 0],
      [50, 2, 3, 5, 1, 0],
      [100, 3, 2, 4, 2, 0],
+     [50, 4, 1, 3, 3, 0],
      [5, 5, 0, 2, 4, 0],
      [1, 1, 5, 6, 0, 0],
      [30, 2, 4, 5, 1, 0],
@@ -54,7 +62,7 @@ B = [[1, 3, 0, 3, 0, 0],
 
 
 def d(p, q):
-    return p * q / (1 - p*(1-q) + (1-p)*q)
+    return p * q / (1 - p*(1-q) - (1-p)*q)
 
 
 def G(p):
@@ -75,9 +83,247 @@ def S(p, q):
     return result
 
 
+@instrumentation.timed("M3")
 def M3(p, q):
     return S(p, q)**2 * (1 + 2*(1 - S(p, q)))
 
 
+@instrumentation.timed("M5")
 def M5(p, q):
-    return S(p,q)**3 * (1 + 3*(1-S(p,q)) + 6*(1-S(p,q))**2)
\ No newline at end of file
+    return S(p,q)**3 * (1 + 3*(1-S(p,q)) + 6*(1-S(p,q))**2)
+
+
+# Coefficient and exponent matrices of A and B, used by the array versions below
+_A = np.array(A, dtype=float)
+_B = np.array(B, dtype=float)
+
+
+def TB_array(p, q):
+    p = np.asarray(p, dtype=float)[..., None]
+    q = np.asarray(q, dtype=float)[..., None]
+    terms = _A[:, 0] * p**_A[:, 1] * (1 - p)**_A[:, 2] * q**_A[:, 3] * (1 - q)**_A[:, 4] * d(p, q)**_A[:, 5]
+    return terms.sum(axis=-1)
+
+
+def S_array(p, q):
+    p = np.asarray(p, dtype=float)
+    q = np.asarray(q, dtype=float)
+    gp = G(p)[..., None]
+    gq = G(q)[..., None]
+    tb = TB_array(p, q)[..., None]
+    terms = _B[:, 0] * gp**_B[:, 1] * (1 - gp)**_B[:, 2] * gq**_B[:, 3] * (1 - gq)**_B[:, 4] * (gp*gq + (gp*(1 - gq) + (1 - gp)*gq)*tb)**_B[:, 5]
+    return terms.sum(axis=-1)
+
+
+@instrumentation.timed("M3_array")
+def M3_array(p, q):
+    s = S_array(p, q)
+    return s**2 * (1 + 2*(1 - s))
+
+
+@instrumentation.timed("M5_array")
+def M5_array(p, q):
+    s = S_array(p, q)
+    return s**3 * (1 + 3*(1 - s) + 6*(1 - s)**2)
+
+
+class MatchFormat(NamedTuple):
+    """Scoring format of a match. Sets are first to set_games games, decided at set_games
+    all by a tiebreak to tiebreak_points (None plays advantage sets), and the final set by
+    one to final_set_tiebreak_points. With match_tiebreak the final set is that tiebreak
+    alone, and no_ad games are decided by a single point at deuce."""
+
+    best_of: int = 3
+    set_games: int = 6
+    tiebreak_points: Optional[int] = 7
+    final_set_tiebreak_points: Optional[int] = 7
+    match_tiebreak: bool = False
+    no_ad: bool = False
+
+
+BEST_OF_3 = MatchFormat(3)
+BEST_OF_5 = MatchFormat(5)
+BEST_OF = {3: BEST_OF_3, 5: BEST_OF_5}
+MATCH_FORMATS = {
+    "best_of_3": BEST_OF_3,
+    "best_of_5": BEST_OF_5,
+    # Grand Slam final sets since 2022
+    "best_of_3_final_tiebreak_10": MatchFormat(3, final_set_tiebreak_points=10),
+    "best_of_5_final_tiebreak_10": MatchFormat(5, final_set_tiebreak_points=10),
+    "best_of_3_advantage_final_set": MatchFormat(3, final_set_tiebreak_points=None),
+    "best_of_5_advantage_final_set": MatchFormat(5, final_set_tiebreak_points=None),
+    "match_tiebreak": MatchFormat(3, final_set_tiebreak_points=10, match_tiebreak=True),
+    "match_tiebreak_no_ad": MatchFormat(3, final_set_tiebreak_points=10, match_tiebreak=True, no_ad=True),
+}
+MATCH_CACHE_SIZE = 1 << 16
+
+
+# The general engine below works through the same hierarchy as M3/M5 by dynamic
+# programming: a game, tiebreak, set or match is a race to a number of units (points,
+# games or sets), memoized over the score, with the win-by-two phase from target - 1 all
+# in closed form. As in the formulas, A serves first in every set and tiebreak, p is A's
+# probability of winning a point on serve and q on return. The arithmetic works on
+# floats and NumPy arrays alike.
+def _race(target, unit, decider):
+    # A's probability of reaching target units first from 0-0, where unit(a, b) is A's
+    # probability of winning the unit played at a-b and decider that of winning from
+    # target - 1 all
+    @lru_cache(maxsize=None)
+    def win(a, b):
+        if a == target:
+            return 1.0
+        if b == target:
+            return 0.0
+        if a == b == target - 1:
+            return decider
+        x = unit(a, b)
+        return x * win(a + 1, b) + (1 - x) * win(a, b + 1)
+
+    return win(0, 0)
+
+
+def _game(p, no_ad=False):
+    return _race(4, lambda a, b: p, p if no_ad else d(p, p))
+
+
+def _tiebreak(p, q, points):
+    # A serves the first point, then the serve changes every two points
+    return _race(points, lambda a, b: p if (a + b + 1) // 2 % 2 == 0 else q, d(p, q))
+
+
+def _set(p, q, games, tiebreak_points, no_ad):
+    gp = _game(p, no_ad)
+    gq = _game(q, no_ad)
+    if tiebreak_points is None:
+        decider = d(gp, gq)
+    else:
+        decider = gp*gq + (gp*(1 - gq) + (1 - gp)*gq) * _tiebreak(p, q, tiebreak_points)
+    return _race(games, lambda a, b: gp if (a + b) % 2 == 0 else gq, decider)
+
+
+def _match(p, q, match_format):
+    s = _set(p, q, match_format.set_games, match_format.tiebreak_points, match_format.no_ad)
+    if match_format.match_tiebreak:
+        final = _tiebreak(p, q, match_format.final_set_tiebreak_points)
+    elif match_format.final_set_tiebreak_points == match_format.tiebreak_points:
+        final = s
+    else:
+        final = _set(p, q, match_format.set_games, match_format.final_set_tiebreak_points, match_format.no_ad)
+    return _race(match_format.best_of // 2 + 1, lambda a, b: s, final)
+
+
+@lru_cache(maxsize=MATCH_CACHE_SIZE)
+def match_probability(p, q, match_format: MatchFormat = BEST_OF_3):
+    return float(_match(float(p), float(q), match_format))
+
+
+@instrumentation.timed("match_probability_array")
+def match_probability_array(p, q, match_format: MatchFormat = BEST_OF_3):
+    p, q = np.broadcast_arrays(np.asarray(p, dtype=float), np.asarray(q, dtype=float))
+    return np.asarray(_match(p, q, match_format), dtype=float)
+
+
+# Tabulated M3/M5: both formulas are evaluated once on a TABLE_SIZE x TABLE_SIZE grid
+# over [TABLE_MIN, TABLE_MAX]^2 and answered by bilinear interpolation. The grid stays
+# clear of the corners, where d(p, q) is singular. With the defaults the maximum
+# absolute error against the exact formulas is below TABLE_MAX_ERROR (measured at
+# the cell midpoints, where bilinear error peaks: ~8.5e-6 for M3, ~1.4e-5 for M5).
+# Points outside the grid fall back to the exact formulas. The tables are stored next
+# to this module, whatever the working directory.
+TABLE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "malleys_tables.npz")
+TABLE_SIZE = 1025
+TABLE_MIN = 0.05
+TABLE_MAX = 0.95
+TABLE_MAX_ERROR = 2e-5
+# Bump when the formulas change, so stored tables are rebuilt
+TABLE_VERSION = 2
+# Rows of the grid evaluated at a time when building the tables, which keeps the
+# temporaries of M3/M5 to a few MB rather than several hundred for the whole grid
+TABLE_CHUNK_ROWS = 32
+
+_tables = {}
+
+
+def build_tables(size: int = TABLE_SIZE):
+    grid = np.linspace(TABLE_MIN, TABLE_MAX, size)
+    tables = {"M3": np.empty((size, size), dtype=np.float32), "M5": np.empty((size, size), dtype=np.float32)}
+    for start in range(0, size, TABLE_CHUNK_ROWS):
+        rows = grid[start : start + TABLE_CHUNK_ROWS, None]
+        tables["M3"][start : start + TABLE_CHUNK_ROWS] = M3_array(rows, grid[None, :])
+        tables["M5"][start : start + TABLE_CHUNK_ROWS] = M5_array(rows, grid[None, :])
+    return tables
+
+
+def load_tables(path: Optional[str] = None, size: Optional[int] = None):
+    path = path or TABLE_FILE
+    size = size or TABLE_SIZE
+    tables = _tables.get((path, size))
+    if tables is not None:
+        return tables
+    if os.path.exists(path):
+        with np.load(path) as stored:
+            if "version" in stored and int(stored["version"]) == TABLE_VERSION:
+                tables = {name: stored[name] for name in ("M3", "M5")}
+        if tables is not None and any(table.shape != (size, size) for table in tables.values()):
+            tables = None
+    if tables is None:
+        tables = build_tables(size)
+        # Where the tables cannot be stored, e.g. a read-only install, they are kept in
+        # memory and built again by the next process
+        temporary_path = f"{path}.tmp.npz"
+        try:
+            np.savez(temporary_path, version=TABLE_VERSION, **tables)
+            os.replace(temporary_path, path)
+        except OSError:
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+    _tables[(path, size)] = tables
+    return tables
+
+
+def interpolate(table, p, q):
+    p = np.asarray(p, dtype=float)
+    q = np.asarray(q, dtype=float)
+    cells = table.shape[0] - 1
+    x = (p - TABLE_MIN) / (TABLE_MAX - TABLE_MIN) * cells
+    y = (q - TABLE_MIN) / (TABLE_MAX - TABLE_MIN) * cells
+    i = np.clip(np.floor(x).astype(int), 0, cells - 1)
+    j = np.clip(np.floor(y).astype(int), 0, cells - 1)
+    fx = x - i
+    fy = y - j
+    return (
+        table[i, j] * (1 - fx) * (1 - fy)
+        + table[i + 1, j] * fx * (1 - fy)
+        + table[i, j + 1] * (1 - fx) * fy
+        + table[i + 1, j + 1] * fx * fy
+    )
+
+
+def _tabulated(name, exact, p, q):
+    p, q = np.broadcast_arrays(np.asarray(p, dtype=float), np.asarray(q, dtype=float))
+    result = interpolate(load_tables()[name], p, q)
+    outside = (p < TABLE_MIN) | (p > TABLE_MAX) | (q < TABLE_MIN) | (q > TABLE_MAX)
+    if outside.any():
+        result = np.where(outside, exact(p, q), result)
+    return result
+
+
+@instrumentation.timed("M3_table")
+def M3_table(p, q):
+    return _tabulated("M3", M3_array, p, q)
+
+
+@instrumentation.timed("M5_table")
+def M5_table(p, q):
+    return _tabulated("M5", M5_array, p, q)
+
+
+def table_max_error(size: int = TABLE_SIZE):
+    tables = build_tables(size)
+    cells = size - 1
+    midpoints = TABLE_MIN + (np.arange(cells) + 0.5) / cells * (TABLE_MAX - TABLE_MIN)
+    p, q = midpoints[:, None], midpoints[None, :]
+    return {
+        "M3": float(np.abs(interpolate(tables["M3"], p, q) - M3_array(p, q)).max()),
+        "M5": float(np.abs(interpolate(tables["M5"], p, q) - M5_array(p, q)).max()),
+    }
@@ -1,24 +1,45 @@
 # match_stats.py
 import csv
-from dataclasses import dataclass
+import json
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, fields
 
 import os
+from array import array
 from collections import Counter
-from datetime import datetime
-from typing import List, Optional, Tuple
+from datetime import datetime, timedelta
+from functools import lru_cache
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Set, Tuple, Union
 
+import numpy as np
 import requests as requests
+from requests.adapters import HTTPAdapter
 
+import instrumentation
+from malleys import (
+    BEST_OF,
+    BEST_OF_3,
+    BEST_OF_5,
+    M3_array,
+    M3_table,
+    M5_array,
+    M5_table,
+    MatchFormat,
+    match_probability_array,
+)
+
+SURFACE = 2
+TOURNEY_LEVEL = 4
+TOURNEY_DATE = 5
 WINNER_NAME = 10
 LOSER_NAME = 18
+SCORE = 23
 
 WINNER_STATS_START = 27
 WINNER_STATS_END = 32
 LOSER_STATS_START = 36
 LOSER_STATS_END = 41
 
-# This is a global variable that will store the match results
-match_results = []
 
 
 @dataclass
@@ -41,143 +62,1188 @@ class NoAdversaryMatches(Exception):
     pass
 
 
+class UnknownPlayer(ValueError):
+    pass
+
+
 def results_filepath(url: str):
     tournament, _, year = url.split("/")[-1].split("_")
     return f"{tournament}/{year}"
 
 
-def download_match_results(url: str, verbosity: int = 0):
-    if verbosity >= 1:
-        print(f"Downloading {url}")
-    request = requests.get(url)
+# Where the yearly results are downloaded from, "<base url><year>.csv"; point these (or
+# the base_url argument of prepare_match_results) elsewhere to use a mirror
+BASE_URLS = {
+    "men": "https://raw.githubusercontent.com/JeffSackmann/tennis_atp/master/atp_matches_",
+    "women": "https://raw.githubusercontent.com/JeffSackmann/tennis_wta/master/wta_matches_",
+}
+# Maximum number of years downloaded at the same time
+DOWNLOAD_WORKERS = 8
+DOWNLOAD_TIMEOUT = 60
+
+# Score tokens of matches that were not played to completion
+INCOMPLETE_SCORE_MARKERS = frozenset(["W/O", "RET", "DEF", "Def.", "ABD", "Walkover", "unfinished"])
+# Filter stages of filter_match_results, in order
+DROP_STAGES = ("malformed", "incomplete", "missing_stats")
+
+# tourney_date values are YYYYMMDD numbers, all below DATE_SPAN
+DATE_SPAN = 10**8
+# An inclusive (start_date, end_date) range of tourney dates, open-ended on a None side;
+# None on its own stands for every match
+Window = Optional[Tuple[Optional[int], Optional[int]]]
+# A surface or tournament level (e.g. "Clay", "G"), several of them, or None for all
+Filter = Optional[Union[str, Iterable[str]]]
+
+# Bump when the layout or the parsing of the binary cache files changes
+CACHE_VERSION = 5
+
+# The bootstrap reads P_ABC off a curve sampled on DELTA_GRID, which spans the deltas
+# for which both serve probabilities of P_ABC stay within [0, 1]; linear interpolation
+# on it is within 1e-6 of the exact values
+BOOTSTRAP_SAMPLES = 2000
+DELTA_GRID = np.linspace(-0.4, 0.4, 4097)
+
+
+def cache_filepath(results_file_path: str):
+    return f"{os.path.splitext(results_file_path)[0]}.npz"
+
+
+def validators_filepath(results_file_path: str):
+    return f"{results_file_path}.http.json"
+
+
+def download_session(workers: int = DOWNLOAD_WORKERS) -> requests.Session:
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+@instrumentation.timed("download_match_results")
+def download_match_results(url: str, verbosity: int = 0, session: Optional[requests.Session] = None):
+    # Revalidates with the ETag/Last-Modified of the previous download, so an unchanged
+    # file is not transferred again, and replaces the file atomically when it changed
     output_file = results_filepath(url)
     output_directory = "".join(output_file.split("/")[:-1])
-    if not os.path.exists(output_directory):
-        os.makedirs(output_directory)
-    open(output_file, "wb").write(request.content)
-    reader = csv.reader(request.content.decode("utf-8").splitlines(), delimiter=",")
-    next(reader)
-    return reader
-
-
-def load_match_results(results_file_path: str):
-    if os.path.exists(results_file_path):
-        results_file = open(results_file_path)
-        next(results_file)
-        match_results = [row for row in csv.reader(results_file)]
-    else:
-        raise FileNotFoundError
-    return match_results
+    # Several downloads can be creating the directory at the same time
+    os.makedirs(output_directory, exist_ok=True)
+
+    headers = {}
+    if os.path.exists(output_file) and os.path.exists(validators_filepath(output_file)):
+        with open(validators_filepath(output_file)) as validators_file:
+            validators = json.load(validators_file)
+        if validators.get("etag"):
+            headers["If-None-Match"] = validators["etag"]
+        if validators.get("last_modified"):
+            headers["If-Modified-Since"] = validators["last_modified"]
+
+    if verbosity >= 1:
+        print(f"Downloading {url}")
+    response = (session or requests).get(url, headers=headers, stream=True, timeout=DOWNLOAD_TIMEOUT)
+    with response:
+        if response.status_code == 304:
+            instrumentation.count("downloads not modified")
+            if verbosity >= 2:
+                print(f"{url} has not changed")
+            return output_file
+        response.raise_for_status()
+
+        temporary_file = f"{output_file}.tmp"
+        try:
+            with open(temporary_file, "wb") as results_file:
+                for chunk in response.iter_content(chunk_size=1 << 16):
+                    results_file.write(chunk)
+                    instrumentation.count("bytes downloaded", len(chunk))
+            os.replace(temporary_file, output_file)
+        finally:
+            if os.path.exists(temporary_file):
+                os.remove(temporary_file)
+
+        validators = {
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+        }
+    temporary_file = f"{validators_filepath(output_file)}.tmp"
+    with open(temporary_file, "w") as validators_file:
+        json.dump(validators, validators_file)
+    os.replace(temporary_file, validators_filepath(output_file))
+    return output_file
+
+
+def download_all_match_results(urls: List[str], verbosity: int = 0, workers: int = DOWNLOAD_WORKERS):
+    # Fetches the urls concurrently through one pooled session; failures are reported
+    # per url and leave any previous copy of the file in place
+    if not urls:
+        return
+    workers = max(1, min(workers, len(urls)))
+    with download_session(workers) as session, ThreadPoolExecutor(workers) as executor:
+        futures = {
+            url: executor.submit(download_match_results, url, verbosity, session) for url in urls
+        }
+        for url, future in futures.items():
+            try:
+                future.result()
+            except Exception as e:
+                if verbosity >= 1:
+                    print(f"Could not download {url}: {e}")
+
+
+@instrumentation.timed("load_match_results")
+def load_match_results(results_file_path: str) -> Iterator[List[str]]:
+    # Yields the rows of a results file one at a time, without its header
+    with open(results_file_path, newline="", encoding="utf-8") as results_file:
+        reader = csv.reader(results_file)
+        next(reader, None)
+        yield from reader
+
+
+def _keep_rows(match_results: Iterable[List[str]], keep, stage: str, dropped: Counter):
+    for match_result in match_results:
+        if keep(match_result):
+            yield match_result
+        else:
+            dropped[stage] += 1
+
 
+def is_well_formed(match_result: List[str]) -> bool:
+    return len(match_result) > LOSER_STATS_END and match_result[TOURNEY_DATE].isdigit()
 
-def filter_match_results(match_results):
-    # exclude incomplete/unplayed matches (e.g. "W/O" or "RET" in score]
-    match_results = [k for k in match_results if "W" not in k[23] and "R" not in k[23]]
+
+def is_completed(match_result: List[str]) -> bool:
+    # Walkovers, retirements, defaults and abandoned matches are marked in the score
+    return not INCOMPLETE_SCORE_MARKERS.intersection(match_result[SCORE].split())
+
+
+def has_stats(match_result: List[str]) -> bool:
+    return "" not in [match_result[WINNER_STATS_START], match_result[LOSER_STATS_START]]
+
+
+@instrumentation.timed("filter_match_results", rows=True)
+def filter_match_results(match_results: Iterable[List[str]], dropped: Optional[Counter] = None):
+    # Lazily drops rows at each stage, counting them per stage in dropped
+    dropped = Counter() if dropped is None else dropped
+    match_results = _keep_rows(match_results, is_well_formed, "malformed", dropped)
+    # exclude incomplete/unplayed matches (e.g. "W/O" or "RET" in score)
+    match_results = _keep_rows(match_results, is_completed, "incomplete", dropped)
     # exclude matches without stats
-    match_results = [k for k in match_results if "" not in [k[27], k[36]]]
+    match_results = _keep_rows(match_results, has_stats, "missing_stats", dropped)
     return match_results
 
 
-def list_players(match_min: int = 0) -> List[str]:
-    ## make list of all players with a result
-    players = [k[10] for k in match_results] + [k[18] for k in match_results]
-    ## limit list of players to those with at least match_min match_results
-    players = [k for k, v in Counter(players).items() if v >= match_min]
-    return players
+def _stat_values(stat_cells: List[str]) -> List[int]:
+    return [int(s) if s.isdigit() else 0 for s in stat_cells]
+
+
+def match_stat_values(match_result) -> Tuple[List[int], List[int]]:
+    # Winner and loser stat columns as integers, with cells that are not digits as 0
+    return (
+        _stat_values(match_result[WINNER_STATS_START : WINNER_STATS_END + 1]),
+        _stat_values(match_result[LOSER_STATS_START : LOSER_STATS_END + 1]),
+    )
+
+
+def _sorted_interned(interned: Dict[str, int]) -> Tuple[np.ndarray, np.ndarray]:
+    # The interned strings in sorted order, and the new id of each id handed out
+    values = np.array(list(interned), dtype=str)
+    order = np.argsort(values, kind="stable")
+    remap = np.empty(len(values), dtype=np.int32)
+    remap[order] = np.arange(len(values), dtype=np.int32)
+    return values[order], remap
 
 
-def player_wins(player_name: str, adversary_name: Optional[str] = None):
-    if adversary_name:
-        wins = filter(
-            lambda match_result: adversary_name == match_result[LOSER_NAME],
-            match_results,
+def _merged_interned(tables: List["MatchTable"], field: str) -> Tuple[np.ndarray, List[np.ndarray]]:
+    # The union of the tables' interned strings, and for each table the new id of its ids
+    values = np.unique(np.concatenate([np.array([], dtype=str)] + [getattr(t, field) for t in tables]))
+    return values, [np.searchsorted(values, getattr(t, field)).astype(np.int32) for t in tables]
+
+
+@dataclass
+class MatchTable:
+    """Filtered matches stored column by column.
+
+    Player names, scores, surfaces and tournament levels are interned: the names,
+    scores, surfaces and levels tables are sorted, and the winner, loser, score,
+    surface and level columns hold indices into them. stats holds the winner's stat
+    columns followed by the loser's, with cells that are not digits as 0."""
+
+    names: np.ndarray
+    winner: np.ndarray
+    loser: np.ndarray
+    date: np.ndarray
+    scores: np.ndarray
+    score: np.ndarray
+    surfaces: np.ndarray
+    surface: np.ndarray
+    levels: np.ndarray
+    level: np.ndarray
+    stats: np.ndarray
+
+    def __len__(self):
+        return len(self.date)
+
+    @classmethod
+    @instrumentation.timed("parse_match_results")
+    def from_rows(cls, match_results: Iterable[List[str]]) -> "MatchTable":
+        # Consumes the rows one at a time, appending their projected columns to
+        # compact buffers, so the rows themselves are never held all at once
+        name_ids: Dict[str, int] = {}
+        score_ids: Dict[str, int] = {}
+        surface_ids: Dict[str, int] = {}
+        level_ids: Dict[str, int] = {}
+        winner, loser, date, score = array("i"), array("i"), array("i"), array("i")
+        surface, level = array("b"), array("b")
+        stats = array("h")
+        for k in match_results:
+            winner.append(name_ids.setdefault(k[WINNER_NAME], len(name_ids)))
+            loser.append(name_ids.setdefault(k[LOSER_NAME], len(name_ids)))
+            date.append(int(k[TOURNEY_DATE]))
+            score.append(score_ids.setdefault(k[SCORE], len(score_ids)))
+            surface.append(surface_ids.setdefault(k[SURFACE], len(surface_ids)))
+            level.append(level_ids.setdefault(k[TOURNEY_LEVEL], len(level_ids)))
+            winner_stats, loser_stats = match_stat_values(k)
+            stats.extend(winner_stats)
+            stats.extend(loser_stats)
+
+        names, name_remap = _sorted_interned(name_ids)
+        scores, score_remap = _sorted_interned(score_ids)
+        surfaces, surface_remap = _sorted_interned(surface_ids)
+        levels, level_remap = _sorted_interned(level_ids)
+        return cls(
+            names=names,
+            winner=name_remap[np.array(winner, dtype=np.int32)],
+            loser=name_remap[np.array(loser, dtype=np.int32)],
+            date=np.array(date, dtype=np.int32),
+            scores=scores,
+            score=score_remap[np.array(score, dtype=np.int32)],
+            surfaces=surfaces,
+            surface=surface_remap[np.array(surface, dtype=np.int32)].astype(np.int8),
+            levels=levels,
+            level=level_remap[np.array(level, dtype=np.int32)].astype(np.int8),
+            stats=np.array(stats, dtype=np.int16).reshape(-1, 12),
+        )
+
+    @classmethod
+    def concatenate(cls, tables: List["MatchTable"]) -> "MatchTable":
+        # Merges the intern tables and remaps every table's indices onto them
+        names, name_maps = _merged_interned(tables, "names")
+        scores, score_maps = _merged_interned(tables, "scores")
+        surfaces, surface_maps = _merged_interned(tables, "surfaces")
+        levels, level_maps = _merged_interned(tables, "levels")
+
+        def remapped(field, maps, dtype=np.int32):
+            return np.concatenate(
+                [np.array([], dtype=dtype)] + [m[getattr(t, field)].astype(dtype) for t, m in zip(tables, maps)]
+            )
+
+        return cls(
+            names=names,
+            winner=remapped("winner", name_maps),
+            loser=remapped("loser", name_maps),
+            date=np.concatenate([np.array([], dtype=np.int32)] + [t.date for t in tables]),
+            scores=scores,
+            score=remapped("score", score_maps),
+            surfaces=surfaces,
+            surface=remapped("surface", surface_maps, np.int8),
+            levels=levels,
+            level=remapped("level", level_maps, np.int8),
+            stats=np.concatenate([np.zeros((0, 12), dtype=np.int16)] + [t.stats for t in tables]),
         )
-    else:
-        wins = match_results
-    return filter(lambda match_result: player_name == match_result[WINNER_NAME], wins)
 
 
-def player_losses(player_name: str, adversary_name: Optional[str] = None):
-    if adversary_name:
-        losses = filter(
-            lambda match_result: adversary_name == match_result[WINNER_NAME],
-            match_results,
+def write_match_results_cache(results_file_path: str, table: MatchTable):
+    # Tagged with the source file's mtime and size, so edits to the CSV invalidate it
+    source = os.stat(results_file_path)
+    temporary_path = f"{cache_filepath(results_file_path)}.tmp"
+    with open(temporary_path, "wb") as cache_file:
+        np.savez(
+            cache_file,
+            version=CACHE_VERSION,
+            source_mtime=source.st_mtime_ns,
+            source_size=source.st_size,
+            **{field.name: getattr(table, field.name) for field in fields(MatchTable)},
         )
+    os.replace(temporary_path, cache_filepath(results_file_path))
+
+
+@instrumentation.timed("read_match_results_cache")
+def read_match_results_cache(results_file_path: str) -> Optional[MatchTable]:
+    # None when there is no cache or it is stale
+    try:
+        source = os.stat(results_file_path)
+        with np.load(cache_filepath(results_file_path), allow_pickle=False) as cache:
+            if (
+                int(cache["version"]) != CACHE_VERSION
+                or int(cache["source_mtime"]) != source.st_mtime_ns
+                or int(cache["source_size"]) != source.st_size
+            ):
+                return None
+            return MatchTable(**{field.name: cache[field.name] for field in fields(MatchTable)})
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def format_dropped(dropped: Counter) -> str:
+    return ", ".join(f"{dropped[stage]} {stage.replace('_', ' ')}" for stage in DROP_STAGES)
+
+
+def load_filtered_match_results(
+    results_file_path: str, verbosity: int = 0, dropped: Optional[Counter] = None
+) -> MatchTable:
+    # Rows filtered out while parsing are added to dropped, per filter stage
+    table = read_match_results_cache(results_file_path)
+    instrumentation.count("cache misses" if table is None else "cache hits")
+    if table is None:
+        if verbosity >= 2:
+            print(f"Parsing {results_file_path}")
+        file_dropped = Counter()
+        table = MatchTable.from_rows(filter_match_results(load_match_results(results_file_path), file_dropped))
+        if verbosity >= 2:
+            print(f"Dropped from {results_file_path}: {format_dropped(file_dropped)}")
+        if dropped is not None:
+            dropped.update(file_dropped)
+        try:
+            write_match_results_cache(results_file_path, table)
+        except OSError as e:
+            if verbosity >= 1:
+                print(f"Could not write the cache for {results_file_path}: {e}")
+    return table
+
+
+class Match(NamedTuple):
+    tourney_date: int
+    winner_name: str
+    loser_name: str
+    score: str
+
+
+def _margins(stats: np.ndarray) -> np.ndarray:
+    # spw - (1 - rpw) for rows of aggregated Stats columns, nan without serve/return points
+    with np.errstate(divide="ignore", invalid="ignore"):
+        spw = (stats[..., 4] + stats[..., 5]) / stats[..., 2].astype(float)
+        rpw = (stats[..., 8] - stats[..., 10] - stats[..., 11]) / stats[..., 8].astype(float)
+    return spw - (1 - rpw)
+
+
+@dataclass(frozen=True)
+class Decay:
+    """Exponential time-decay of match weights: a match half_life days older than the
+    reference date (YYYYMMDD, the latest match by default) counts half as much, and
+    matches after the reference date are left out."""
+
+    half_life: float
+    reference_date: Optional[int] = None
+
+    def __post_init__(self):
+        # A zero half-life has no weights, and a negative one would weight older matches more
+        if not self.half_life > 0:
+            raise ValueError("half_life must be a positive number of days")
+
+
+def day_numbers(dates: np.ndarray) -> np.ndarray:
+    # Days since 1970-01-01 of YYYYMMDD dates
+    dates = np.asarray(dates, dtype=np.int64)
+    months = (dates // 10000 - 1970).astype("datetime64[Y]").astype("datetime64[M]") + (dates // 100 % 100 - 1)
+    return (months.astype("datetime64[D]") + (dates % 100 - 1)).astype(np.int64)
+
+
+def num_matches_for(gender: str):
+    if gender == "men":
+        return 5
+    elif gender == "women":
+        return 3
     else:
-        losses = match_results
-    return filter(lambda match_result: player_name == match_result[LOSER_NAME], losses)
+        raise IndexError
 
 
-def player_aggregate_stats(player_name: str, adversary_name: Optional[str]):
-    player_stats = [
-        player_match[WINNER_STATS_START : WINNER_STATS_END + 1]
-        + player_match[LOSER_STATS_START : LOSER_STATS_END + 1]
-        for player_match in player_wins(player_name, adversary_name)
-    ]
-    player_stats.extend(
-        [
-            player_match[LOSER_STATS_START : LOSER_STATS_END + 1]
-            + player_match[WINNER_STATS_START : WINNER_STATS_END + 1]
-            for player_match in player_losses(player_name, adversary_name)
-        ]
-    )
+@instrumentation.timed("P_ABC_batch")
+def P_ABC_batch(deltas, matches, tabulated=False):
+    # matches is 3 or 5 sets of the classic format, answered by M3/M5 (or their tables),
+    # or any MatchFormat, answered by the general engine
+    deltas = np.asarray(deltas, dtype=float)
+    instrumentation.count("P_ABC evaluations", deltas.size)
+    match_format = BEST_OF.get(matches, matches)
+    if match_format == BEST_OF_3:
+        M = M3_table if tabulated else M3_array
+    elif match_format == BEST_OF_5:
+        M = M5_table if tabulated else M5_array
+    elif isinstance(match_format, MatchFormat):
+        M = lambda p, q: match_probability_array(p, q, match_format)
+    else:
+        raise ValueError("matches must be 3, 5 or a MatchFormat")
+    return (M(0.6 + deltas, (1 - 0.6)) + M(0.6, (1 - (0.6 - deltas)))) / 2
 
-    if len(player_stats) == 0:
-        raise NoAdversaryMatches
 
-    aggregate_player_stats = []
-    for stat_column in zip(*player_stats):
-        aggregate_player_stats.append(sum([int(s) for s in stat_column if s.isdigit()]))
+@lru_cache(maxsize=None)
+def P_ABC_curve(matches) -> np.ndarray:
+    return P_ABC_batch(DELTA_GRID, matches)
 
-    return Stats(*aggregate_player_stats)
 
+@instrumentation.timed("bootstrap_interval")
+def bootstrap_interval(
+    delta_samples: np.ndarray, matches, confidence: float, rng: Optional[np.random.Generator] = None
+) -> Tuple[float, float]:
+    """Confidence interval of P from bootstrap replicates of the common adversary
+    deltas (see Dataset.common_adversary_delta_samples): each replicate also resamples
+    the set of common adversaries, then averages P_ABC over them."""
+    if not 0 < confidence < 1:
+        raise ValueError("confidence must be between 0 and 1")
+    rng = rng or np.random.default_rng()
+    samples, adversaries = delta_samples.shape
+    chosen = rng.integers(adversaries, size=(samples, adversaries))
+    deltas = np.take_along_axis(delta_samples, chosen, axis=1)
+    with np.errstate(invalid="ignore"):
+        probabilities = np.interp(deltas, DELTA_GRID, P_ABC_curve(matches)).mean(axis=1)
+    low, high = np.nanquantile(probabilities, [(1 - confidence) / 2, (1 + confidence) / 2])
+    return float(low), float(high)
 
-def spw(player: str, adversary: str):
-    stats = player_aggregate_stats(player, adversary)
-    return (stats.first_won + stats.second_won) / float(stats.service_points)
 
+def _pair_sums(stats: np.ndarray, counts: np.ndarray) -> np.ndarray:
+    # Totals of consecutive runs of counts rows of stats
+    totals = np.zeros((len(counts), stats.shape[1]))
+    matched = counts > 0
+    if matched.any():
+        totals[matched] = np.add.reduceat(stats, (np.cumsum(counts) - counts)[matched], axis=0)
+    return totals
+
+
+def _weighted_sum(stats: np.ndarray, scales: np.ndarray) -> Tuple[np.ndarray, float]:
+    # The sum of rows of stats weighted by 2 ** scales, as a row relative to the largest
+    # weight and the log2 of that weight
+    scale = float(scales.max(initial=-np.inf))
+    scale = scale if np.isfinite(scale) else 0.0
+    return (stats * np.exp2(scales - scale)[:, None]).sum(axis=0, keepdims=True), scale
+
+
+def _pooled_prior(pooled: np.ndarray, pooled_weight: float) -> np.ndarray:
+    # Rows of pooled Stats columns scaled down to pooled_weight serve points and as many
+    # return points, to add as pseudo-matches to filtered stats that may be thin
+    with np.errstate(divide="ignore", invalid="ignore"):
+        serve = pooled[:, :6] * (pooled_weight / pooled[:, 2:3])
+        ret = pooled[:, 6:] * (pooled_weight / pooled[:, 8:9])
+    return np.nan_to_num(np.concatenate([serve, ret], axis=1), posinf=0)
+
+
+def _filtered_ids(values: List[str], value_filter: Filter) -> np.ndarray:
+    # Ids of the interned values a filter selects: all without one, else the named ones
+    if value_filter is None:
+        return np.arange(len(values))
+    selected = {value_filter} if isinstance(value_filter, str) else set(value_filter)
+    return np.array([i for i, value in enumerate(values) if value in selected], dtype=np.int64)
+
+
+def date_bounds(window: Window) -> Tuple[int, int]:
+    # Inclusive (first, last) tourney_date of a window, either end of which may be None
+    if window is None:
+        return 0, DATE_SPAN - 1
+    start_date, end_date = window
+    return start_date or 0, DATE_SPAN - 1 if end_date is None else end_date
 
-def rpw(player: str, adversary: str):
-    stats = player_aggregate_stats(player, adversary)
-    return (
-        stats.adv_service_points - stats.adv_first_won - stats.adv_second_won
-    ) / float(stats.adv_service_points)
 
+def weeks_window(weeks: int, end_date: Optional[int] = None) -> Tuple[int, int]:
+    # The given number of weeks up to and including end_date (YYYYMMDD), today by default
+    end = datetime.strptime(str(end_date), "%Y%m%d") if end_date else datetime.now()
+    start = end - timedelta(weeks=weeks) + timedelta(days=1)
+    return int(start.strftime("%Y%m%d")), int(end.strftime("%Y%m%d"))
 
-def Delta_i_AB(player_A: str, player_B: str, common_adversary: str):
-    return (spw(player_A, common_adversary) - (1 - rpw(player_A, common_adversary))) - (
-        spw(player_B, common_adversary) - (1 - rpw(player_B, common_adversary))
+
+class Dataset:
+    """Filtered match results of one tour together with the indexes built over them.
+
+    Every query takes an optional window, a (start_date, end_date) pair of inclusive
+    YYYYMMDD tourney dates, and only uses the matches played in it. Queries can also be
+    limited to some surfaces and tournament levels; the matches are partitioned by
+    (surface, level) when the Dataset is built, so filtered queries cost about the same
+    as unfiltered ones. Margins can be pulled towards the unfiltered ones with
+    pooled_weight, the number of pooled serve and return points added to the filtered
+    ones, and matches can be weighted by age with a Decay.
+
+    A Dataset is never modified after construction, so several can be kept in memory
+    at once and read from any number of threads."""
+
+    @instrumentation.timed("build_dataset")
+    def __init__(self, table: MatchTable, gender: Optional[str] = None):
+        self.table = table
+        self.gender = gender
+        self.names = table.names.tolist()
+        self.name_ids = {name: i for i, name in enumerate(self.names)}
+        self.surfaces = table.surfaces.tolist()
+        self.levels = table.levels.tolist()
+        players_count = len(self.names)
+        self.partition_count = max(len(self.surfaces) * len(self.levels), 1)
+
+        # Both sides of every match, interleaved so that entry 2i is the winner of match i
+        # and 2i + 1 its loser
+        sides = np.stack([table.winner, table.loser], axis=1).ravel()
+        adversaries = np.stack([table.loser, table.winner], axis=1).ravel()
+        dates = np.repeat(table.date, 2)
+        partitions = np.repeat(table.surface.astype(np.int64) * len(self.levels) + table.level, 2)
+        side_stats = np.stack(
+            [table.stats, np.concatenate([table.stats[:, 6:], table.stats[:, :6]], axis=1)], axis=1
+        ).reshape(-1, 12)
+
+        # Sides sorted by player, adversary, partition and date. The (player, adversary)
+        # pairs are numbered in that order, a player's pairs are
+        # pair_offsets[id]:pair_offsets[id + 1] and a pair's sides
+        # pair_starts[row]:pair_starts[row + 1]
+        keys = sides.astype(np.int64) * players_count + adversaries
+        order = np.lexsort((dates, partitions, keys))
+        pair_keys, starts, counts = np.unique(keys[order], return_index=True, return_counts=True)
+        self.pair_adversary = (pair_keys % max(players_count, 1)).astype(np.int32)
+        self.pair_offsets = np.searchsorted(pair_keys // max(players_count, 1), np.arange(players_count + 1))
+        self.pair_starts = np.append(starts, len(order))
+        # (row * partition_count + partition) * DATE_SPAN + date for every sorted side, to
+        # binary search the sides of a pair in a partition and window
+        self.pair_dates = (
+            np.repeat(np.arange(len(pair_keys), dtype=np.int64), counts) * self.partition_count
+            + partitions[order]
+        ) * DATE_SPAN + dates[order]
+        # Running totals of the sorted sides' stats, so that the stats of the sides i:j
+        # are side_totals[j] - side_totals[i]
+        side_stats = side_stats[order]
+        total = int(side_stats.sum(axis=0, dtype=np.int64).max(initial=0))
+        self.side_totals = np.zeros(
+            (len(side_stats) + 1, 12), dtype=np.int32 if total < 2**31 else np.int64
+        )
+        np.cumsum(side_stats, axis=0, out=self.side_totals[1:])
+        self.last_date = int(table.date.max()) if len(table) else 0
+
+        # Every match each player took part in, sorted by date, and player * DATE_SPAN + date
+        # for each of them
+        order = np.lexsort((dates, sides))
+        self.player_match_ids = (order // 2).astype(np.int32)
+        self.player_match_offsets = np.searchsorted(sides[order], np.arange(players_count + 1))
+        self.player_match_dates = sides[order].astype(np.int64) * DATE_SPAN + dates[order]
+
+    @classmethod
+    def from_rows(cls, match_results, gender: Optional[str] = None) -> "Dataset":
+        return cls(MatchTable.from_rows(match_results), gender)
+
+    @property
+    def match_count(self) -> int:
+        return len(self.table)
+
+    def _player_id(self, player_name: Optional[str]) -> Optional[int]:
+        return self.name_ids.get(player_name) if player_name else None
+
+    def partitions(self, surface: Filter = None, level: Filter = None) -> Optional[np.ndarray]:
+        # The partitions matching the surface and level filters, None without filters
+        if surface is None and level is None:
+            return None
+        surface_ids = _filtered_ids(self.surfaces, surface)
+        level_ids = _filtered_ids(self.levels, level)
+        return (surface_ids[:, None] * len(self.levels) + level_ids).ravel()
+
+    def _pair_rows(self, player_id: Optional[int], window: Window, partitions: Optional[np.ndarray] = None) -> np.ndarray:
+        # Rows of the player's pairs with at least one match in the window and partitions
+        if player_id is None:
+            return np.zeros(0, dtype=np.int64)
+        rows = np.arange(self.pair_offsets[player_id], self.pair_offsets[player_id + 1])
+        if window is None and partitions is None:
+            return rows
+        starts, ends = self._side_bounds(rows, window, partitions)
+        return rows[(ends - starts).sum(axis=1) > 0]
+
+    def _side_bounds(
+        self, rows: np.ndarray, window: Window, partitions: Optional[np.ndarray] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        # The sides of each pair in the window, one start:end column per partition
+        if partitions is None:
+            if window is None:
+                return self.pair_starts[rows, None], self.pair_starts[rows + 1, None]
+            partitions = np.arange(self.partition_count)
+        start_date, end_date = date_bounds(window)
+        keys = (rows.astype(np.int64)[:, None] * self.partition_count + partitions) * DATE_SPAN
+        return (
+            np.searchsorted(self.pair_dates, keys + start_date, "left"),
+            np.searchsorted(self.pair_dates, keys + end_date, "right"),
+        )
+
+    def decay_window(self, window: Window, decay: Optional[Decay]) -> Window:
+        # The window cut off at the decay's reference date
+        if decay is None:
+            return window
+        start_date, end_date = date_bounds(window)
+        return start_date, min(end_date, decay.reference_date or self.last_date)
+
+    def _side_stats(
+        self,
+        rows: np.ndarray,
+        window: Window,
+        partitions: Optional[np.ndarray],
+        decay: Optional[Decay] = None,
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        # The stats of every match of the pairs in the window, one row per match and pair
+        # after pair, the number of matches of each pair, and the log2 of each pair's
+        # weight at the reference date (-inf without matches). With a decay the matches of a pair are weighted
+        # relative to its latest one in the window, so that however far back the window
+        # ends the weights neither vanish nor overflow
+        starts, ends = self._side_bounds(rows, window, partitions)
+        counts = (ends - starts).ravel()
+        sides = np.repeat(starts.ravel() - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+        stats = (self.side_totals[sides + 1] - self.side_totals[sides]).astype(float)
+        pair_counts = (ends - starts).sum(axis=1)
+        scales = np.zeros(len(rows))
+        if decay is not None and len(sides):
+            days = day_numbers(self.pair_dates[sides] % DATE_SPAN)
+            matched = pair_counts > 0
+            latest = np.zeros(len(rows), dtype=np.int64)
+            latest[matched] = np.maximum.reduceat(days, (np.cumsum(pair_counts) - pair_counts)[matched])
+            stats *= np.exp2((days - np.repeat(latest, pair_counts)) / decay.half_life)[:, None]
+            reference_day = day_numbers(decay.reference_date or self.last_date)
+            scales = np.where(matched, (latest - reference_day) / decay.half_life, -np.inf)
+        return stats, pair_counts, scales
+
+    def _pair_stats(
+        self,
+        rows: np.ndarray,
+        window: Window,
+        partitions: Optional[np.ndarray] = None,
+        decay: Optional[Decay] = None,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        # The total stats of each pair in the window and the log2 of their weight at the
+        # reference date, as in _side_stats
+        if decay is None:
+            starts, ends = self._side_bounds(rows, window, partitions)
+            return (self.side_totals[ends] - self.side_totals[starts]).sum(axis=1), np.zeros(len(rows))
+        stats, counts, scales = self._side_stats(rows, window, partitions, decay)
+        return _pair_sums(stats, counts), scales
+
+    def _pair_margins(
+        self,
+        rows: np.ndarray,
+        window: Window,
+        partitions: Optional[np.ndarray],
+        pooled_weight: float,
+        decay: Optional[Decay] = None,
+    ) -> np.ndarray:
+        # A pair's margin is a ratio of its own stats, so only the prior needs their
+        # weight at the reference date
+        stats, scales = self._pair_stats(rows, window, partitions, decay)
+        if pooled_weight and partitions is not None:
+            pooled, _ = self._pair_stats(rows, window, None, decay)
+            stats = stats * np.exp2(scales)[:, None] + _pooled_prior(pooled, pooled_weight)
+        return _margins(stats)
+
+    def _resampled_margins(
+        self,
+        rows: np.ndarray,
+        window: Window,
+        partitions: Optional[np.ndarray],
+        pooled_weight: float,
+        decay: Optional[Decay],
+        samples: int,
+        rng: np.random.Generator,
+    ) -> np.ndarray:
+        # The margins of the pairs recomputed from samples resamples (with replacement) of
+        # each pair's matches, one row per resample. Each resample is counted as the
+        # number of times every match is drawn, so a pair's totals are a product of its
+        # counts and stats rather than a gather of the drawn stats
+        stats, counts, scales = self._side_stats(rows, window, partitions, decay)
+        offsets = np.cumsum(counts) - counts
+        pairs = np.repeat(np.arange(len(rows)), counts)
+        draws = offsets[pairs] + (rng.random((samples, len(pairs))) * counts[pairs]).astype(np.int64)
+        draws += np.arange(samples)[:, None] * len(pairs)
+        drawn = np.bincount(draws.ravel(), minlength=samples * len(pairs)).reshape(samples, len(pairs))
+        totals = np.zeros((samples, len(rows), 12))
+        for pair, (offset, count) in enumerate(zip(offsets.tolist(), counts.tolist())):
+            totals[:, pair] = drawn[:, offset:offset + count] @ stats[offset:offset + count]
+        if pooled_weight and partitions is not None:
+            pooled, _ = self._pair_stats(rows, window, None, decay)
+            totals = totals * np.exp2(scales)[:, None] + _pooled_prior(pooled, pooled_weight)
+        return _margins(totals)
+
+    def _aggregate(
+        self,
+        player_name: str,
+        adversary_name: Optional[str],
+        window: Window,
+        surface: Filter,
+        level: Filter,
+        pooled_weight: float = 0.0,
+        decay: Optional[Decay] = None,
+    ) -> np.ndarray:
+        window = self.decay_window(window, decay)
+        partitions = self.partitions(surface, level)
+        rows = self._pair_rows(self._player_id(player_name), window, partitions)
+        if adversary_name:
+            rows = rows[self.pair_adversary[rows] == self._player_id(adversary_name)]
+        if not len(rows):
+            raise NoAdversaryMatches
+        stats, scale = _weighted_sum(*self._pair_stats(rows, window, partitions, decay))
+        if pooled_weight and partitions is not None:
+            pooled, _ = _weighted_sum(*self._pair_stats(rows, window, None, decay))
+            stats = stats * np.exp2(scale) + _pooled_prior(pooled, pooled_weight)
+        return stats[0]
+
+    def match(self, match_id: int) -> Match:
+        table = self.table
+        return Match(
+            int(table.date[match_id]),
+            self.names[table.winner[match_id]],
+            self.names[table.loser[match_id]],
+            str(table.scores[table.score[match_id]]),
+        )
+
+    def list_players(self, match_min: int = 0, window: Window = None) -> List[str]:
+        ## players in order of first appearance among the winners, then the losers
+        sides = np.concatenate([self.table.winner, self.table.loser])
+        if window is not None:
+            start_date, end_date = date_bounds(window)
+            dates = np.concatenate([self.table.date, self.table.date])
+            sides = sides[(dates >= start_date) & (dates <= end_date)]
+        ids, first_seen, counts = np.unique(sides, return_index=True, return_counts=True)
+        order = np.argsort(first_seen)
+        ## limit list of players to those with at least match_min match_results
+        return [self.names[i] for i in ids[order][counts[order] >= match_min].tolist()]
+
+    def player_matches(
+        self, player_name: str, window: Window = None, surface: Filter = None, level: Filter = None
+    ) -> List[Match]:
+        # The player's matches in date order
+        player_id = self._player_id(player_name)
+        if player_id is None:
+            return []
+        start_date, end_date = date_bounds(window)
+        start = np.searchsorted(self.player_match_dates, player_id * DATE_SPAN + start_date, "left")
+        end = np.searchsorted(self.player_match_dates, player_id * DATE_SPAN + end_date, "right")
+        match_ids = self.player_match_ids[start:end]
+        partitions = self.partitions(surface, level)
+        if partitions is not None:
+            table = self.table
+            match_partitions = table.surface[match_ids].astype(np.int64) * len(self.levels) + table.level[match_ids]
+            match_ids = match_ids[np.isin(match_partitions, partitions)]
+        return [self.match(i) for i in match_ids.tolist()]
+
+    def player_wins(
+        self,
+        player_name: str,
+        adversary_name: Optional[str] = None,
+        window: Window = None,
+        surface: Filter = None,
+        level: Filter = None,
+    ):
+        return (
+            match
+            for match in self.player_matches(player_name, window, surface, level)
+            if match.winner_name == player_name and (not adversary_name or match.loser_name == adversary_name)
+        )
+
+    def player_losses(
+        self,
+        player_name: str,
+        adversary_name: Optional[str] = None,
+        window: Window = None,
+        surface: Filter = None,
+        level: Filter = None,
+    ):
+        return (
+            match
+            for match in self.player_matches(player_name, window, surface, level)
+            if match.loser_name == player_name and (not adversary_name or match.winner_name == adversary_name)
+        )
+
+    def player_opponents(
+        self, player_name: str, window: Window = None, surface: Filter = None, level: Filter = None
+    ) -> Set[str]:
+        rows = self._pair_rows(self._player_id(player_name), window, self.partitions(surface, level))
+        return {self.names[i] for i in self.pair_adversary[rows].tolist()}
+
+    def check_player(self, player_name: str):
+        if player_name not in self.name_ids:
+            raise UnknownPlayer(f"{player_name} has no recorded matches")
+
+    def _common_pair_rows(self, player_A: str, player_B: str, window: Window, partitions: Optional[np.ndarray]):
+        # The common adversaries in name order, and the pair rows of A and B against them
+        id_A, id_B = self._player_id(player_A), self._player_id(player_B)
+        rows_A = self._pair_rows(id_A, window, partitions)
+        rows_B = self._pair_rows(id_B, window, partitions)
+        common, index_A, index_B = np.intersect1d(
+            self.pair_adversary[rows_A], self.pair_adversary[rows_B], assume_unique=True, return_indices=True
+        )
+        keep = (common != id_A) & (common != id_B)
+        return common[keep], rows_A[index_A[keep]], rows_B[index_B[keep]]
+
+    def common_opponents(
+        self, player_A: str, player_B: str, window: Window = None, surface: Filter = None, level: Filter = None
+    ) -> List[str]:
+        # The names table is sorted, so ids come out in name order
+        common, _, _ = self._common_pair_rows(player_A, player_B, window, self.partitions(surface, level))
+        return [self.names[i] for i in common.tolist()]
+
+    @instrumentation.timed("player_aggregate_stats")
+    def player_aggregate_stats(
+        self,
+        player_name: str,
+        adversary_name: Optional[str],
+        window: Window = None,
+        surface: Filter = None,
+        level: Filter = None,
+        decay: Optional[Decay] = None,
+    ):
+        # Decayed stats are weighted sums, so floats rather than counts
+        return Stats(*self._aggregate(player_name, adversary_name, window, surface, level, 0.0, decay).tolist())
+
+    def spw(
+        self,
+        player: str,
+        adversary: str,
+        window: Window = None,
+        surface: Filter = None,
+        level: Filter = None,
+        pooled_weight: float = 0.0,
+        decay: Optional[Decay] = None,
+    ):
+        stats = self._aggregate(player, adversary, window, surface, level, pooled_weight, decay)
+        return (stats[4] + stats[5]) / float(stats[2])
+
+    def rpw(
+        self,
+        player: str,
+        adversary: str,
+        window: Window = None,
+        surface: Filter = None,
+        level: Filter = None,
+        pooled_weight: float = 0.0,
+        decay: Optional[Decay] = None,
+    ):
+        stats = self._aggregate(player, adversary, window, surface, level, pooled_weight, decay)
+        return (stats[8] - stats[10] - stats[11]) / float(stats[8])
+
+    def player_margin(
+        self,
+        player: str,
+        adversary: str,
+        window: Window = None,
+        surface: Filter = None,
+        level: Filter = None,
+        pooled_weight: float = 0.0,
+        decay: Optional[Decay] = None,
+    ):
+        return self.spw(player, adversary, window, surface, level, pooled_weight, decay) - (
+            1 - self.rpw(player, adversary, window, surface, level, pooled_weight, decay)
+        )
+
+    @instrumentation.timed("player_margins")
+    def player_margins(
+        self,
+        player: str,
+        window: Window = None,
+        surface: Filter = None,
+        level: Filter = None,
+        pooled_weight: float = 0.0,
+        decay: Optional[Decay] = None,
+    ) -> Dict[str, float]:
+        window = self.decay_window(window, decay)
+        partitions = self.partitions(surface, level)
+        rows = self._pair_rows(self._player_id(player), window, partitions)
+        return dict(
+            zip(
+                [self.names[i] for i in self.pair_adversary[rows].tolist()],
+                self._pair_margins(rows, window, partitions, pooled_weight, decay).tolist(),
+            )
+        )
+
+    def Delta_i_AB(
+        self,
+        player_A: str,
+        player_B: str,
+        common_adversary: str,
+        window: Window = None,
+        surface: Filter = None,
+        level: Filter = None,
+        pooled_weight: float = 0.0,
+        decay: Optional[Decay] = None,
+    ):
+        return self.player_margin(
+            player_A, common_adversary, window, surface, level, pooled_weight, decay
+        ) - self.player_margin(player_B, common_adversary, window, surface, level, pooled_weight, decay)
+
+    @instrumentation.timed("common_adversary_deltas")
+    def common_adversary_deltas(
+        self,
+        player_A: str,
+        player_B: str,
+        window: Window = None,
+        surface: Filter = None,
+        level: Filter = None,
+        pooled_weight: float = 0.0,
+        decay: Optional[Decay] = None,
+    ) -> Tuple[List[str], np.ndarray]:
+        # Delta_i_AB for every common adversary at once, in name order
+        window = self.decay_window(window, decay)
+        partitions = self.partitions(surface, level)
+        common, rows_A, rows_B = self._common_pair_rows(player_A, player_B, window, partitions)
+        deltas = self._pair_margins(rows_A, window, partitions, pooled_weight, decay) - self._pair_margins(
+            rows_B, window, partitions, pooled_weight, decay
+        )
+        return [self.names[i] for i in common.tolist()], deltas
+
+    @instrumentation.timed("common_adversary_delta_samples")
+    def common_adversary_delta_samples(
+        self,
+        player_A: str,
+        player_B: str,
+        samples: int,
+        window: Window = None,
+        surface: Filter = None,
+        level: Filter = None,
+        pooled_weight: float = 0.0,
+        decay: Optional[Decay] = None,
+        rng: Optional[np.random.Generator] = None,
+    ) -> np.ndarray:
+        """Bootstrap replicates of common_adversary_deltas: row r holds Delta_i_AB of
+        every common adversary, in name order, recomputed after resampling the matches of
+        A and of B against each of them."""
+        rng = rng or np.random.default_rng()
+        window = self.decay_window(window, decay)
+        partitions = self.partitions(surface, level)
+        _, rows_A, rows_B = self._common_pair_rows(player_A, player_B, window, partitions)
+        if not len(rows_A):
+            return np.empty((samples, 0))
+        return self._resampled_margins(
+            rows_A, window, partitions, pooled_weight, decay, samples, rng
+        ) - self._resampled_margins(rows_B, window, partitions, pooled_weight, decay, samples, rng)
+
+    def common_adversary_probabilities(
+        self,
+        player_A: str,
+        player_B: str,
+        tabulated=False,
+        window: Window = None,
+        surface: Filter = None,
+        level: Filter = None,
+        pooled_weight: float = 0.0,
+        decay: Optional[Decay] = None,
+        match_format: Optional[MatchFormat] = None,
+    ) -> Tuple[List[str], np.ndarray]:
+        # The common adversaries of the two players and P_ABC through each of them, in a
+        # match of the dataset's tour unless a format is given
+        self.check_player(player_A)
+        self.check_player(player_B)
+        adversaries, deltas = self.common_adversary_deltas(
+            player_A, player_B, window, surface, level, pooled_weight, decay
+        )
+        instrumentation.count("adversaries evaluated", len(adversaries))
+        return adversaries, P_ABC_batch(deltas, match_format or num_matches_for(self.gender), tabulated)
+
+    @instrumentation.timed("P")
+    def P(
+        self,
+        player_A: str,
+        player_B: str,
+        verbosity=0,
+        tabulated=False,
+        window: Window = None,
+        surface: Filter = None,
+        level: Filter = None,
+        pooled_weight: float = 0.0,
+        decay: Optional[Decay] = None,
+        match_format: Optional[MatchFormat] = None,
+        confidence: Optional[float] = None,
+    ):
+        # The probability of player_A beating player_B and the fair odds of both, None
+        # without common opponents. With a confidence level, the bootstrap interval of the
+        # probability is returned too
+        if confidence is not None and not 0 < confidence < 1:
+            raise ValueError("confidence must be between 0 and 1")
+        adversaries, pABCs = self.common_adversary_probabilities(
+            player_A, player_B, tabulated, window, surface, level, pooled_weight, decay, match_format
+        )
+        if verbosity >= 1:
+            print(f"processed {len(adversaries)} common adversaries")
+        if verbosity >= 2:
+            for common_adversary, pABC in zip(adversaries, pABCs):
+                print(
+                    f"Probability of {player_A} beating {player_B} via {common_adversary}: {pABC};"
+                )
+
+        if len(adversaries) == 0:
+            if verbosity >= 1:
+                print("No common opponents found.")
+            if confidence is not None:
+                return None, None, None, None
+            return None, None, None
+        result = float(pABCs.mean())
+        print(f"The probability of {player_A} beating {player_B} is {result:.2%}")
+
+        odd_a = 1 / result
+        odd_b = 1 / (1 - result)
+        print(f"Real odds for {player_A} winning: " + str(odd_a))
+        print(f"Real odds for {player_B} winning: " + str(odd_b))
+        if confidence is None:
+            return result, odd_a, odd_b
+
+        rng = np.random.default_rng()
+        delta_samples = self.common_adversary_delta_samples(
+            player_A, player_B, BOOTSTRAP_SAMPLES, window, surface, level, pooled_weight, decay, rng
+        )
+        interval = bootstrap_interval(delta_samples, match_format or num_matches_for(self.gender), confidence, rng)
+        print(f"{confidence:.0%} confidence interval: {interval[0]:.2%} to {interval[1]:.2%}")
+        return result, odd_a, odd_b, interval
+
+
+# The dataset read by the module-level functions below, replaced by prepare_match_results
+dataset = Dataset(MatchTable.concatenate([]))
+
+
+def current_dataset() -> Dataset:
+    return dataset
+
+
+def list_players(match_min: int = 0, window: Window = None) -> List[str]:
+    return dataset.list_players(match_min, window)
+
+
+def player_wins(
+    player_name: str,
+    adversary_name: Optional[str] = None,
+    window: Window = None,
+    surface: Filter = None,
+    level: Filter = None,
+):
+    return dataset.player_wins(player_name, adversary_name, window, surface, level)
+
+
+def player_losses(
+    player_name: str,
+    adversary_name: Optional[str] = None,
+    window: Window = None,
+    surface: Filter = None,
+    level: Filter = None,
+):
+    return dataset.player_losses(player_name, adversary_name, window, surface, level)
+
+
+def player_opponents(
+    player_name: str, window: Window = None, surface: Filter = None, level: Filter = None
+) -> Set[str]:
+    return dataset.player_opponents(player_name, window, surface, level)
+
+
+def common_opponents(
+    player_A: str, player_B: str, window: Window = None, surface: Filter = None, level: Filter = None
+) -> List[str]:
+    return dataset.common_opponents(player_A, player_B, window, surface, level)
+
+
+def player_aggregate_stats(
+    player_name: str,
+    adversary_name: Optional[str],
+    window: Window = None,
+    surface: Filter = None,
+    level: Filter = None,
+    decay: Optional[Decay] = None,
+):
+    return dataset.player_aggregate_stats(player_name, adversary_name, window, surface, level, decay)
+
+
+def spw(
+    player: str,
+    adversary: str,
+    window: Window = None,
+    surface: Filter = None,
+    level: Filter = None,
+    pooled_weight: float = 0.0,
+    decay: Optional[Decay] = None,
+):
+    return dataset.spw(player, adversary, window, surface, level, pooled_weight, decay)
+
+
+def rpw(
+    player: str,
+    adversary: str,
+    window: Window = None,
+    surface: Filter = None,
+    level: Filter = None,
+    pooled_weight: float = 0.0,
+    decay: Optional[Decay] = None,
+):
+    return dataset.rpw(player, adversary, window, surface, level, pooled_weight, decay)
+
+
+def player_margin(
+    player: str,
+    adversary: str,
+    window: Window = None,
+    surface: Filter = None,
+    level: Filter = None,
+    pooled_weight: float = 0.0,
+    decay: Optional[Decay] = None,
+):
+    return dataset.player_margin(player, adversary, window, surface, level, pooled_weight, decay)
+
+
+def player_margins(
+    player: str,
+    window: Window = None,
+    surface: Filter = None,
+    level: Filter = None,
+    pooled_weight: float = 0.0,
+    decay: Optional[Decay] = None,
+) -> Dict[str, float]:
+    return dataset.player_margins(player, window, surface, level, pooled_weight, decay)
+
+
+def Delta_i_AB(
+    player_A: str,
+    player_B: str,
+    common_adversary: str,
+    window: Window = None,
+    surface: Filter = None,
+    level: Filter = None,
+    pooled_weight: float = 0.0,
+    decay: Optional[Decay] = None,
+):
+    return dataset.Delta_i_AB(player_A, player_B, common_adversary, window, surface, level, pooled_weight, decay)
+
+
+@instrumentation.timed("load_dataset")
+def load_dataset(
+    year_range: Tuple[int, int],
+    gender: str,
+    verbosity: int = 0,
+    base_url: Optional[str] = None,
+) -> Dataset:
+    results = []
+
+    if gender not in BASE_URLS:
+        raise ValueError("Gender must be one of either 'men' or 'women'")
+    base_url = base_url or BASE_URLS[gender]
+
+    years = range(year_range[0], year_range[1] + 1)
+    current_year = datetime.now().year
+    # The current year is revalidated on every call, other years only downloaded when missing
+    download_all_match_results(
+        [
+            f"{base_url}{year}.csv"
+            for year in years
+            if year == current_year or not os.path.exists(results_filepath(f"{base_url}{year}.csv"))
+        ],
+        verbosity,
     )
 
+    dropped = Counter()
+    for year in years:
+        year_filename = results_filepath(f"{base_url}{year}.csv")
+        # Years are read from the binary cache when it is still fresh, from the CSV otherwise
+        try:
+            results.append(load_filtered_match_results(year_filename, verbosity, dropped))
+        except FileNotFoundError as e:
+            if verbosity >= 1:
+                print(f"File not found: {year_filename} - {str(e)}")
+    if verbosity >= 1 and dropped:
+        print(f"Dropped while parsing: {format_dropped(dropped)}")
+
+    return Dataset(MatchTable.concatenate(results), gender)
+
 
-def prepare_match_results(year_range: Tuple[int, int], gender: str, verbosity: int = 0):  
-    results = []  
-  
-    if gender == "men":  
-        base_url = "https://raw.githubusercontent.com/JeffSackmann/tennis_atp/master/atp_matches_"  
-    elif gender == "women":  
-        base_url = "https://raw.githubusercontent.com/JeffSackmann/tennis_wta/master/wta_matches_"  
-    else:  
-        raise ValueError("Gender must be one of either 'men' or 'women'")  
-  
-    for year in range(year_range[0], year_range[1] + 1):  
-        year_url = f"{base_url}{year}.csv"  
-        year_filename = results_filepath(year_url)  
-        current_year = datetime.now().year  # Get the current year  
-  
-        # If the year is the current year or the file does not exist, download the results  
-        if year == current_year or not os.path.exists(year_filename):  
-            try:  
-                results.extend(download_match_results(year_url, verbosity))  
-            except Exception as e:  
-                if verbosity >= 1:  
-                    print(f"Could not download the file for year {year}: {e}")  
-        else:  
-            try:  
-                results.extend(load_match_results(year_filename))  
-            except FileNotFoundError as e:  
-                if verbosity >= 1:  
-                    print(f"File not found: {year_filename} - {str(e)}")  
-  
-    global match_results  
-    match_results = filter_match_results(results)  
+def prepare_match_results(
+    year_range: Tuple[int, int],
+    gender: str,
+    verbosity: int = 0,
+    base_url: Optional[str] = None,
+) -> Dataset:
+    global dataset
+    dataset = load_dataset(year_range, gender, verbosity, base_url)
+    return dataset
@@ -0,0 +1,284 @@
+# portfolio.py
+import argparse
+import json
+import sys
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+import instrumentation
+from predictor import read_fixtures
+
+# Slates of up to this many bets are evaluated over every combination of outcomes,
+# larger ones over sampled outcomes, and the largest with a quadratic approximation
+EXACT_BETS = 12
+MONTE_CARLO_BETS = 120
+MONTE_CARLO_SCENARIOS = 20000
+METHODS = ("exact", "monte_carlo", "quadratic")
+MAX_ITERATIONS = 2000
+TOLERANCE = 1e-12
+
+
+class Portfolio(NamedTuple):
+    # Shares of the bankroll staked on player A and on player B of each match, and the
+    # expected log-growth of the bankroll they give
+    stakes_A: np.ndarray
+    stakes_B: np.ndarray
+    growth: float
+    method: str
+
+
+def outcome_returns(
+    probabilities: np.ndarray, odds: np.ndarray, method: str, scenarios: int, rng: np.random.Generator
+) -> Tuple[np.ndarray, np.ndarray]:
+    # Return per unit staked of each bet (columns) in each combination of outcomes (rows),
+    # and the probabilities of the rows
+    n = len(probabilities)
+    if method == "exact":
+        won = (np.arange(1 << n)[:, None] >> np.arange(n)) & 1 == 1
+        weights = np.where(won, probabilities, 1 - probabilities).prod(axis=1)
+    else:
+        # The outcome where every bet loses is taken out of the sample and added at its
+        # own probability, which keeps the total stake clear of ruin
+        won = rng.random((scenarios, n)) < probabilities
+        won = won[won.any(axis=1)]
+        ruin = np.prod(1 - probabilities)
+        weights = np.append(np.full(len(won), (1 - ruin) / max(len(won), 1)), ruin)
+        won = np.vstack([won, np.zeros((1, n), dtype=bool)])
+    return np.where(won, odds - 1, -1.0), weights
+
+
+def log_growth(returns: np.ndarray, weights: np.ndarray) -> Tuple[Callable, Callable]:
+    # Expected log of the bankroll after the bets, and its gradient in the stakes
+    def growth(stakes):
+        wealth = 1 + returns @ stakes
+        if wealth.min() <= 0:
+            return -np.inf
+        return float(weights @ np.log(wealth))
+
+    def gradient(stakes):
+        return (weights / (1 + returns @ stakes)) @ returns
+
+    return growth, gradient
+
+
+def quadratic_growth(probabilities: np.ndarray, odds: np.ndarray) -> Tuple[Callable, Callable]:
+    # Second order expansion of the expected log-growth, E[x] - E[x^2] / 2 for the return x
+    # of the slate, whose terms only need each bet's mean and variance since the matches
+    # are independent
+    mean = probabilities * odds - 1
+    variance = probabilities * (1 - probabilities) * odds ** 2
+
+    def growth(stakes):
+        expected = mean @ stakes
+        return float(expected - (expected ** 2 + variance @ stakes ** 2) / 2)
+
+    def gradient(stakes):
+        return mean * (1 - mean @ stakes) - variance * stakes
+
+    return growth, gradient
+
+
+def project(stakes: np.ndarray, cap: float, total: float) -> np.ndarray:
+    # Closest stakes between 0 and cap each and at most total together: the ones over the
+    # total are all lowered by the same amount, found by bisection
+    projected = np.clip(stakes, 0, cap)
+    if projected.sum() <= total:
+        return projected
+    low, high = 0.0, float(stakes.max())
+    for _ in range(60):
+        shift = (low + high) / 2
+        if np.clip(stakes - shift, 0, cap).sum() > total:
+            low = shift
+        else:
+            high = shift
+    return np.clip(stakes - high, 0, cap)
+
+
+def ascend(growth: Callable, gradient: Callable, start: np.ndarray, cap: float, total: float) -> np.ndarray:
+    # Projected gradient ascent, backtracking until a step improves the growth enough. It
+    # starts within half the total, where some bankroll is left whatever the outcomes
+    stakes = project(start, cap, total / 2)
+    value = growth(stakes)
+    step = 1.0
+    for _ in range(MAX_ITERATIONS):
+        slope = gradient(stakes)
+        while True:
+            candidate = project(stakes + step * slope, cap, total)
+            candidate_value = growth(candidate)
+            if candidate_value >= value + 1e-4 * slope @ (candidate - stakes) or step < 1e-12:
+                break
+            step /= 2
+        if candidate_value < value or np.abs(candidate - stakes).max() < TOLERANCE:
+            break
+        stakes, value, step = candidate, candidate_value, step * 2
+    return stakes
+
+
+@instrumentation.timed("simultaneous_kelly")
+def simultaneous_kelly(
+    probabilities,
+    odds,
+    fraction: float = 1.0,
+    cap: float = 1.0,
+    total: float = 1.0,
+    method: Optional[str] = None,
+    scenarios: int = MONTE_CARLO_SCENARIOS,
+    rng: Optional[np.random.Generator] = None,
+) -> Tuple[np.ndarray, float, str]:
+    """Kelly stakes on bets with independent outcomes placed at the same time: the
+    shares of the bankroll, each at most cap and together at most total, maximizing the
+    expected log of the bankroll once every bet is settled. With a fraction below one
+    the full Kelly stakes are scaled down by it, the caps holding for the scaled stakes.
+
+    The method is picked by the number of bets unless given; returns the stakes, their
+    expected log-growth and the method used."""
+    probabilities = np.asarray(probabilities, dtype=float)
+    odds = np.asarray(odds, dtype=float)
+    if method is None:
+        method = (
+            "exact" if len(probabilities) <= EXACT_BETS
+            else "monte_carlo" if len(probabilities) <= MONTE_CARLO_BETS
+            else "quadratic"
+        )
+    if method not in METHODS:
+        raise ValueError(f"method must be one of {', '.join(METHODS)}")
+    if not 0 < fraction <= 1:
+        raise ValueError("fraction must be between 0 and 1")
+    if not len(probabilities):
+        return np.zeros(0), 0.0, method
+
+    if method == "quadratic":
+        growth, gradient = quadratic_growth(probabilities, odds)
+    else:
+        growth, gradient = log_growth(
+            *outcome_returns(probabilities, odds, method, scenarios, rng or np.random.default_rng(0))
+        )
+    # The independent Kelly stakes are the starting point
+    start = np.maximum((probabilities * odds - 1) / (odds - 1), 0)
+    stakes = fraction * ascend(growth, gradient, start, cap / fraction, min(1.0, total / fraction))
+    return stakes, growth(stakes), method
+
+
+def size_slate(
+    probabilities,
+    odds_A,
+    odds_B,
+    fraction: float = 1.0,
+    cap: float = 1.0,
+    total: float = 1.0,
+    method: Optional[str] = None,
+    scenarios: int = MONTE_CARLO_SCENARIOS,
+    rng: Optional[np.random.Generator] = None,
+) -> Portfolio:
+    """Simultaneous Kelly stakes on a slate of matches, from the probability of each
+    player A beating player B and the decimal odds offered on both.
+
+    Only the player with the larger edge of each match is a candidate: with a bookmaker's
+    margin at most one side of a match has a positive expected return."""
+    probabilities = np.asarray(probabilities, dtype=float)
+    odds_A = np.asarray(odds_A, dtype=float)
+    odds_B = np.asarray(odds_B, dtype=float)
+    edge_A = probabilities * odds_A - 1
+    edge_B = (1 - probabilities) * odds_B - 1
+    back_A = edge_A >= edge_B
+    candidates = np.flatnonzero(np.maximum(edge_A, edge_B) > 0)
+
+    stakes, growth, method = simultaneous_kelly(
+        np.where(back_A, probabilities, 1 - probabilities)[candidates],
+        np.where(back_A, odds_A, odds_B)[candidates],
+        fraction,
+        cap,
+        total,
+        method,
+        scenarios,
+        rng,
+    )
+    stakes_A = np.zeros(len(probabilities))
+    stakes_B = np.zeros(len(probabilities))
+    stakes_A[candidates] = np.where(back_A[candidates], stakes, 0)
+    stakes_B[candidates] = np.where(back_A[candidates], 0, stakes)
+    return Portfolio(stakes_A, stakes_B, growth, method)
+
+
+def read_slate(slate_file) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    # The predictions with a probability and both odds, and the rest
+    usable = []
+    skipped = []
+    for prediction in read_fixtures(slate_file):
+        try:
+            prediction["probability"] = float(prediction["probability"])
+            prediction["odds_A"] = float(prediction["odds_A"])
+            prediction["odds_B"] = float(prediction["odds_B"])
+        except (KeyError, TypeError, ValueError):
+            skipped.append(prediction)
+            continue
+        if prediction["odds_A"] <= 1 or prediction["odds_B"] <= 1:
+            skipped.append(prediction)
+            continue
+        usable.append(prediction)
+    return usable, skipped
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Size bets on a slate of matches together with the simultaneous Kelly criterion"
+    )
+    parser.add_argument(
+        "slate",
+        nargs="?",
+        default="-",
+        help="Output of predictor.py batch, or a CSV or JSON lines file with player_A, player_B, probability, "
+        "odds_A and odds_B ('-' or nothing for stdin)",
+    )
+    parser.add_argument("--fraction", type=float, default=1.0, help="Fraction of the full Kelly stakes to bet")
+    parser.add_argument("--cap", type=float, default=1.0, help="Largest share of the bankroll on any one bet")
+    parser.add_argument("--total", type=float, default=1.0, help="Largest share of the bankroll staked in all")
+    parser.add_argument("--method", choices=METHODS, help="Evaluation of the log-growth, by slate size by default")
+    parser.add_argument("--scenarios", type=int, default=MONTE_CARLO_SCENARIOS, help="Sampled outcomes for monte_carlo")
+    parser.add_argument("--bankroll", type=float, help="Also print the stakes as amounts of this bankroll")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    if not 0 < args.fraction <= 1:
+        parser.error("--fraction must be between 0 and 1")
+
+    slate_file = sys.stdin if args.slate == "-" else open(args.slate, newline="")
+    with slate_file:
+        slate, skipped = read_slate(slate_file)
+
+    portfolio = size_slate(
+        [prediction["probability"] for prediction in slate],
+        [prediction["odds_A"] for prediction in slate],
+        [prediction["odds_B"] for prediction in slate],
+        args.fraction,
+        args.cap,
+        args.total,
+        args.method,
+        args.scenarios,
+        np.random.default_rng(args.seed),
+    )
+    for prediction, stake_A, stake_B in zip(slate, portfolio.stakes_A, portfolio.stakes_B):
+        result = {
+            "player_A": prediction.get("player_A"),
+            "player_B": prediction.get("player_B"),
+            "probability": prediction["probability"],
+            "stake_A": float(stake_A),
+            "stake_B": float(stake_B),
+        }
+        if args.bankroll is not None:
+            result["amount_A"] = round(float(stake_A) * args.bankroll, 2)
+            result["amount_B"] = round(float(stake_B) * args.bankroll, 2)
+        print(json.dumps(result))
+    print(
+        json.dumps({
+            "bets": int((portfolio.stakes_A > 0).sum() + (portfolio.stakes_B > 0).sum()),
+            "staked": float(portfolio.stakes_A.sum() + portfolio.stakes_B.sum()),
+            "growth": portfolio.growth,
+            "method": portfolio.method,
+            "skipped": len(skipped),
+        })
+    )
+
+
+if __name__ == "__main__":
+    main()
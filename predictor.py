@@ -1,74 +1,685 @@
 # predictor.py
 import argparse
+import csv
+import itertools
+import json
+import math
+import sys
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 
-from malleys import M3, M5
+import numpy as np
+
+import instrumentation
+from malleys import (
+    BEST_OF,
+    BEST_OF_3,
+    BEST_OF_5,
+    MATCH_FORMATS,
+    M3,
+    M5,
+    MatchFormat,
+    load_tables,
+    match_probability,
+)
 from match_stats import (
+    BOOTSTRAP_SAMPLES,
+    DELTA_GRID,
+    Dataset,
+    Decay,
+    Filter,
+    Window,
+    bootstrap_interval,
+    current_dataset,
+    load_dataset,
+    num_matches_for,
+    P_ABC_batch,
+    P_ABC_curve,
     prepare_match_results,
     list_players,
-    Delta_i_AB,
-    NoAdversaryMatches,
+    UnknownPlayer,
 )
 
+# Draw entries that stand for an empty slot rather than a player
+BYES = ("", "bye", "BYE", "Bye")
+# Current formats of the Grand Slams (tourney_level G) per tour; every other level
+# plays best of 3 sets
+GRAND_SLAM_FORMATS = {
+    "men": MATCH_FORMATS["best_of_5_final_tiebreak_10"],
+    "women": MATCH_FORMATS["best_of_3_final_tiebreak_10"],
+}
+
 
-def P_ABC(player_A, player_B, common_adversary, matches):
-    if matches == 3:
-        return (
-            M3(0.6 + Delta_i_AB(player_A, player_B, common_adversary), (1 - 0.6))
-            + M3(0.6, (1 - (0.6 - Delta_i_AB(player_A, player_B, common_adversary))))
-        ) / 2
-    elif matches == 5:
-        return (
-            M5(0.6 + Delta_i_AB(player_A, player_B, common_adversary), (1 - 0.6))
-            + M5(0.6, (1 - (0.6 - Delta_i_AB(player_A, player_B, common_adversary))))
-        ) / 2
-
-
-def P(player_A: str, player_B: str, gender: str, verbosity=0):
-    players = list_players()
-    players.remove(player_A)
-    players.remove(player_B)
-
-    if gender == "men":
-        num_matches = 5
-    elif gender == "women":
-        num_matches = 3
+@instrumentation.timed("P_ABC")
+def P_ABC(
+    player_A,
+    player_B,
+    common_adversary,
+    matches,
+    tabulated=False,
+    dataset: Optional[Dataset] = None,
+    window: Window = None,
+    surface: Filter = None,
+    level: Filter = None,
+    pooled_weight: float = 0.0,
+    decay: Optional[Decay] = None,
+):
+    Delta_i_AB = (dataset or current_dataset()).Delta_i_AB(
+        player_A, player_B, common_adversary, window, surface, level, pooled_weight, decay
+    )
+    if tabulated:
+        return float(P_ABC_batch([Delta_i_AB], matches, True)[0])
+    match_format = BEST_OF.get(matches, matches)
+    if match_format == BEST_OF_3:
+        M = M3
+    elif match_format == BEST_OF_5:
+        M = M5
+    elif isinstance(match_format, MatchFormat):
+        M = lambda p, q: match_probability(p, q, match_format)
     else:
-        raise IndexError
-
-    sum = 0
-    i = 0
-    common_players = 0
-    for common_adversary in players:
-        i += 1
-        if verbosity >= 1 and (i % 10 == 0):
-            print(f"processed {i} of {len(players)} potential common adversaries")
+        raise ValueError("matches must be 3, 5 or a MatchFormat")
+    return (M(0.6 + Delta_i_AB, (1 - 0.6)) + M(0.6, (1 - (0.6 - Delta_i_AB)))) / 2
+
+
+def match_format_for(gender: str, tourney_level: Optional[str] = None) -> MatchFormat:
+    # The format of a match at a tournament of the given level; without one, best of 5
+    # for men and best of 3 for women, as the model has always assumed
+    if tourney_level is None:
+        return BEST_OF[num_matches_for(gender)]
+    if tourney_level == "G":
+        return GRAND_SLAM_FORMATS[gender]
+    return BEST_OF_3
+
+
+def common_adversary_probabilities(
+    player_A: str,
+    player_B: str,
+    gender: str,
+    tabulated=False,
+    dataset: Optional[Dataset] = None,
+    window: Window = None,
+    surface: Filter = None,
+    level: Filter = None,
+    pooled_weight: float = 0.0,
+    decay: Optional[Decay] = None,
+    match_format: Optional[MatchFormat] = None,
+):
+    # The common adversaries of the two players and P_ABC through each of them
+    return (dataset or current_dataset()).common_adversary_probabilities(
+        player_A,
+        player_B,
+        tabulated,
+        window,
+        surface,
+        level,
+        pooled_weight,
+        decay,
+        match_format or match_format_for(gender),
+    )
+
+
+def P(
+    player_A: str,
+    player_B: str,
+    gender: str,
+    verbosity=0,
+    tabulated=False,
+    dataset: Optional[Dataset] = None,
+    window: Window = None,
+    surface: Filter = None,
+    level: Filter = None,
+    pooled_weight: float = 0.0,
+    decay: Optional[Decay] = None,
+    match_format: Optional[MatchFormat] = None,
+    confidence: Optional[float] = None,
+):
+    # Dataset.P, in a match of the given tour; with a confidence level, the bootstrap
+    # interval of the probability is returned too
+    return (dataset or current_dataset()).P(
+        player_A,
+        player_B,
+        verbosity,
+        tabulated,
+        window,
+        surface,
+        level,
+        pooled_weight,
+        decay,
+        match_format or match_format_for(gender),
+        confidence,
+    )
+
+
+def kelly_fraction(probability, odds):
+    # Share of the bankroll the Kelly criterion stakes on an outcome with the given
+    # probability at the given decimal odds; zero or negative means no bet
+    return (probability * (odds - 1) - (1 - probability)) / (odds - 1)
+
+
+@instrumentation.timed("P_matrix")
+def P_matrix(
+    players: List[str],
+    gender: str,
+    verbosity=0,
+    tabulated=False,
+    dataset: Optional[Dataset] = None,
+    window: Window = None,
+    surface: Filter = None,
+    level: Filter = None,
+    pooled_weight: float = 0.0,
+    decay: Optional[Decay] = None,
+    match_format: Optional[MatchFormat] = None,
+) -> np.ndarray:
+    """P_matrix[i][j] is the probability of players[i] beating players[j], NaN when
+    the pair has no common opponents (or one of them has no recorded matches)."""
+    num_matches = match_format or num_matches_for(gender)
+    dataset = dataset or current_dataset()
+    margins = [dataset.player_margins(player, window, surface, level, pooled_weight, decay) for player in players]
+
+    pairs = []
+    deltas = []
+    offsets = []
+    for i in range(len(players)):
+        for j in range(i + 1, len(players)):
+            adversaries = sorted(
+                (margins[i].keys() & margins[j].keys()) - {players[i], players[j]}
+            )
+            if not adversaries:
+                continue
+            pairs.append((i, j))
+            offsets.append(len(deltas))
+            deltas.extend(margins[i][c] - margins[j][c] for c in adversaries)
+        if verbosity >= 1 and (i + 1) % 10 == 0:
+            print(f"collected common adversaries for {i + 1} of {len(players)} players")
+
+    matrix = np.full((len(players), len(players)), np.nan)
+    if pairs:
+        pABCs = P_ABC_batch(deltas, num_matches, tabulated)
+        counts = np.diff(np.append(offsets, len(deltas)))
+        results = np.add.reduceat(pABCs, offsets) / counts
+        rows, columns = np.array(pairs).T
+        matrix[rows, columns] = results
+        matrix[columns, rows] = 1 - results
+    return matrix
+
+
+def draw_probabilities(matrix: np.ndarray, byes: Optional[List[bool]] = None) -> np.ndarray:
+    """Propagates a P_matrix through a knockout bracket, with players in draw order.
+    Column r holds each player's probability of winning r matches, so the first
+    column is all ones and the last one is the probability of winning the draw.
+    Pairs without a prediction are treated as 50/50 and byes lose to everyone."""
+    size = matrix.shape[0]
+    rounds = size.bit_length() - 1
+    if size != 1 << rounds:
+        raise ValueError("The draw size must be a power of two")
+
+    beats = np.where(np.isnan(matrix), 0.5, matrix)
+    if byes is not None:
+        byes = np.asarray(byes, dtype=bool)
+        beats[:, byes] = 1
+        beats[byes, :] = 0
+        beats[np.ix_(byes, byes)] = 0.5
+
+    reach = np.ones((size, rounds + 1))
+    for r in range(rounds):
+        half = 1 << r
+        for start in range(0, size, 2 * half):
+            top = slice(start, start + half)
+            bottom = slice(start + half, start + 2 * half)
+            reach[top, r + 1] = reach[top, r] * (beats[top, bottom] @ reach[bottom, r])
+            reach[bottom, r + 1] = reach[bottom, r] * (beats[bottom, top] @ reach[top, r])
+    return reach
+
+
+def round_names(size: int) -> List[str]:
+    names = {1: "W", 2: "F", 4: "SF", 8: "QF"}
+    rounds = size.bit_length() - 1
+    return [names.get(size >> r, f"R{size >> r}") for r in range(rounds + 1)]
+
+
+def write_matrix_csv(output, players: List[str], matrix: np.ndarray):
+    writer = csv.writer(output)
+    writer.writerow([""] + players)
+    for player, row in zip(players, matrix):
+        writer.writerow([player] + ["" if np.isnan(p) else f"{p:.6f}" for p in row])
+
+
+def write_draw_csv(output, players: List[str], reach: np.ndarray):
+    # The rounds follow the size of the draw, byes included, not the number of players
+    writer = csv.writer(output)
+    writer.writerow(["player"] + round_names(1 << (reach.shape[1] - 1)))
+    for player, row in zip(players, reach):
+        writer.writerow([player] + [f"{p:.6f}" for p in row])
+
+
+def half_life_days(value: str) -> float:
+    # argparse type of --half-life
+    try:
+        days = float(value)
+    except ValueError:
+        days = math.nan
+    if not days > 0:
+        raise argparse.ArgumentTypeError(f"must be a positive number of days, not {value}")
+    return days
+
+
+def add_common_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument(
+        "--years",
+        type=int,
+        default=[2021, 2023],
+        nargs=2,
+        help="Range of years for which to consider statistics",
+    )
+    parser.add_argument(
+        "--start-date",
+        type=int,
+        help="Only use matches from this tourney_date on (YYYYMMDD)",
+    )
+    parser.add_argument(
+        "--end-date",
+        type=int,
+        help="Only use matches up to this tourney_date (YYYYMMDD)",
+    )
+    parser.add_argument(
+        "--surface",
+        nargs="+",
+        help="Only use matches played on these surfaces (e.g. Hard Clay Grass Carpet)",
+    )
+    parser.add_argument(
+        "--level",
+        nargs="+",
+        help="Only use matches of these tournament levels (e.g. G M A)",
+    )
+    parser.add_argument(
+        "--pooled-weight",
+        type=float,
+        default=0.0,
+        help="Serve and return points of all matches added to the filtered ones, to steady thin samples",
+    )
+    parser.add_argument(
+        "--half-life",
+        type=half_life_days,
+        help="Weight matches by age, halving the weight every this many days before --end-date "
+        "(or the latest match)",
+    )
+    parser.add_argument(
+        "--tourney-level",
+        help="Level of the tournament the match is played at (e.g. G), which sets the match format",
+    )
+    parser.add_argument(
+        "--format",
+        choices=tuple(MATCH_FORMATS),
+        help="Scoring format of the match, overriding the one of --tourney-level",
+    )
+    parser.add_argument(
+        "-v", "--verbosity", action="count", default=0, help="increase output verbosity"
+    )
+    parser.add_argument(
+        "--tabulated",
+        action="store_true",
+        help="Use precomputed M3/M5 lookup tables instead of the exact formulas",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Print the time spent in each stage and the rows, cache hits and adversaries counted to stderr",
+    )
+    parser.add_argument("--profile-json", help="Write the --profile timings and counters as JSON to this file")
+
+
+def arguments_window(args: argparse.Namespace) -> Window:
+    if args.start_date is None and args.end_date is None:
+        return None
+    return args.start_date, args.end_date
+
+
+def arguments_decay(args: argparse.Namespace) -> Optional[Decay]:
+    if args.half_life is None:
+        return None
+    return Decay(args.half_life, args.end_date)
+
+
+def arguments_format(args: argparse.Namespace, gender: str) -> Optional[MatchFormat]:
+    if args.format is not None:
+        return MATCH_FORMATS[args.format]
+    if args.tourney_level is not None:
+        return match_format_for(gender, args.tourney_level)
+    return None
+
+
+def start_profile(args: argparse.Namespace):
+    if args.profile or args.profile_json:
+        instrumentation.reset()
+        instrumentation.enable()
+
+
+def report_profile(args: argparse.Namespace):
+    if not (args.profile or args.profile_json):
+        return
+    report = instrumentation.summary()
+    if args.profile:
+        print(instrumentation.format_summary(report), file=sys.stderr)
+    if args.profile_json:
+        instrumentation.write_summary(args.profile_json, report)
+
+
+def arguments_years(args: argparse.Namespace) -> Tuple[int, int]:
+    # --years, widened to every year the --start-date/--end-date window touches
+    first_year, last_year = args.years
+    if args.start_date is not None:
+        first_year = min(first_year, args.start_date // 10000)
+    if args.end_date is not None:
+        last_year = max(last_year, args.end_date // 10000)
+    return first_year, last_year
+
+
+def draw_main(argv: List[str]):
+    parser = argparse.ArgumentParser(
+        prog="predictor.py draw",
+        description="Probability matrix for every pair of players in a draw",
+    )
+    parser.add_argument(
+        "gender",
+        choices=("men", "women"),
+        help="Specify gender of players so as to select from atp or wta statistics",
+    )
+    parser.add_argument(
+        "draw",
+        help="File with one player per line, in draw order ('-' for stdin). Empty lines or 'bye' mark byes",
+    )
+    parser.add_argument(
+        "--output", help="Write the probability matrix as CSV to this file instead of stdout"
+    )
+    parser.add_argument(
+        "--bracket",
+        help="Write each player's probability of reaching each round as CSV to this file",
+    )
+    add_common_arguments(parser)
+    args = parser.parse_args(argv)
+    start_profile(args)
+
+    draw_file = sys.stdin if args.draw == "-" else open(args.draw)
+    with draw_file:
+        players = [line.strip() for line in draw_file]
+    if args.bracket and len(players) & (len(players) - 1):
+        parser.error(
+            f"--bracket needs a draw of 2, 4, 8, ... entries, byes and empty lines included, not {len(players)}"
+        )
+
+    if args.tabulated:
+        load_tables()
+    dataset = load_dataset(arguments_years(args), args.gender, args.verbosity)
+    matrix = P_matrix(
+        players,
+        args.gender,
+        args.verbosity,
+        args.tabulated,
+        dataset,
+        arguments_window(args),
+        args.surface,
+        args.level,
+        args.pooled_weight,
+        arguments_decay(args),
+        arguments_format(args, args.gender),
+    )
+
+    if args.output:
+        with open(args.output, "w", newline="") as output:
+            write_matrix_csv(output, players, matrix)
+    else:
+        write_matrix_csv(sys.stdout, players, matrix)
+
+    if args.bracket:
+        byes = [player in BYES for player in players]
+        reach = draw_probabilities(matrix, byes)
+        entrants = [i for i, bye in enumerate(byes) if not bye]
+        with open(args.bracket, "w", newline="") as output:
+            write_draw_csv(output, [players[i] for i in entrants], reach[entrants])
+    report_profile(args)
+
+
+def read_fixtures(fixtures_file) -> Iterator[Dict[str, Any]]:
+    # JSON lines when the first line is an object, CSV with a header row otherwise
+    first_line = fixtures_file.readline()
+    lines = itertools.chain([first_line], fixtures_file)
+    if first_line.lstrip().startswith("{"):
+        for line in lines:
+            if not line.strip():
+                continue
+            try:
+                fixture = json.loads(line)
+            except json.JSONDecodeError as e:
+                fixture = {"error": f"Invalid JSON line: {e}"}
+            yield fixture if isinstance(fixture, dict) else {"error": "Fixtures must be JSON objects"}
+    else:
+        yield from csv.DictReader(lines)
+
+
+def is_filter(value) -> bool:
+    # A surface or tournament level, or a list of them
+    return isinstance(value, str) or isinstance(value, list) and all(isinstance(item, str) for item in value)
+
+
+def finite_json(value):
+    # The value with non-finite numbers, which JSON has no token for, replaced by None
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    if isinstance(value, dict):
+        return {key: finite_json(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [finite_json(item) for item in value]
+    return value
+
+
+def score_fixture(
+    fixture: Dict[str, Any],
+    datasets,
+    tabulated=False,
+    window: Window = None,
+    surface: Filter = None,
+    level: Filter = None,
+    pooled_weight: float = 0.0,
+    decay: Optional[Decay] = None,
+    match_format: Optional[MatchFormat] = None,
+    tourney_level: Optional[str] = None,
+) -> Dict[str, Any]:
+    # A fixture's own start_date/end_date, surface, level, pooled_weight, half_life and
+    # format or tourney_level replace the ones given. Bad values are reported in the
+    # result's error rather than raised
+    gender = fixture.get("gender")
+    player_A = fixture.get("player_A")
+    player_B = fixture.get("player_B")
+    result = {"gender": gender, "player_A": player_A, "player_B": player_B}
+    if "error" in fixture:
+        result["error"] = fixture["error"]
+        return result
+    if (
+        gender not in ("men", "women")
+        or not player_A
+        or not player_B
+        or not isinstance(player_A, str)
+        or not isinstance(player_B, str)
+    ):
+        result["error"] = "Fixtures need a gender ('men' or 'women'), player_A and player_B"
+        return result
+    if fixture.get("start_date") or fixture.get("end_date"):
+        try:
+            window = tuple(
+                int(fixture[field]) if fixture.get(field) else None for field in ("start_date", "end_date")
+            )
+        except (TypeError, ValueError):
+            result["error"] = "start_date and end_date must be YYYYMMDD dates"
+            return result
+    if not all(is_filter(fixture[field]) for field in ("surface", "level") if fixture.get(field)):
+        result["error"] = "surface and level must be names or lists of names"
+        return result
+    if not all(isinstance(fixture[field], str) for field in ("tourney_level", "format") if fixture.get(field)):
+        result["error"] = "tourney_level and format must be names"
+        return result
+    surface = fixture.get("surface") or surface
+    level = fixture.get("level") or level
+    if fixture.get("pooled_weight"):
+        try:
+            pooled_weight = float(fixture["pooled_weight"])
+        except (TypeError, ValueError):
+            pooled_weight = math.nan
+        if not 0 <= pooled_weight < math.inf:
+            result["error"] = "pooled_weight must be a number of points, 0 or more"
+            return result
+    if fixture.get("half_life") not in (None, ""):
+        try:
+            decay = Decay(float(fixture["half_life"]))
+        except (TypeError, ValueError):
+            result["error"] = "half_life must be a positive number of days"
+            return result
+    if decay is not None:
+        # Ages are counted back from the end of the fixture's own window
+        decay = Decay(decay.half_life, window[1] if window else None)
+    if fixture.get("format"):
+        match_format = MATCH_FORMATS.get(fixture["format"])
+        if match_format is None:
+            result["error"] = f"format must be one of {', '.join(MATCH_FORMATS)}"
+            return result
+    elif fixture.get("tourney_level") or (match_format is None and tourney_level):
+        match_format = match_format_for(gender, fixture.get("tourney_level") or tourney_level)
+
+    try:
+        adversaries, pABCs = common_adversary_probabilities(
+            player_A,
+            player_B,
+            gender,
+            tabulated,
+            datasets(gender),
+            window,
+            surface,
+            level,
+            pooled_weight,
+            decay,
+            match_format,
+        )
+    except UnknownPlayer as e:
+        result["error"] = str(e)
+        return result
+
+    result["common_opponents"] = len(adversaries)
+    if not adversaries:
+        result["probability"] = None
+        return result
+    probability = float(pABCs.mean())
+    result.update({
+        "probability": probability,
+        "fair_odds_A": 1 / probability if probability else math.inf,
+        "fair_odds_B": 1 / (1 - probability) if probability != 1 else math.inf,
+    })
+
+    try:
+        odds_A = float(fixture["odds_A"])
+        odds_B = float(fixture["odds_B"])
+    except (KeyError, TypeError, ValueError):
+        return result
+    # Decimal odds pay back more than the stake
+    if not (odds_A > 1 and odds_B > 1):
+        return result
+    result.update({
+        "odds_A": odds_A,
+        "odds_B": odds_B,
+        "kelly_A": kelly_fraction(probability, odds_A),
+        "kelly_B": kelly_fraction(1 - probability, odds_B),
+    })
+    return result
+
+
+def ordered_map(function, items, workers: int = 1):
+    # Like map, yielding results in input order as soon as they are ready while
+    # keeping at most a couple of items per worker in flight
+    if workers <= 1:
+        for item in items:
+            yield function(item)
+        return
+    with ThreadPoolExecutor(workers) as executor:
+        pending = deque()
+        for item in items:
+            pending.append(executor.submit(function, item))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def batch_main(argv: List[str]):
+    parser = argparse.ArgumentParser(
+        prog="predictor.py batch",
+        description="Score a file of fixtures, printing one JSON line per fixture",
+    )
+    parser.add_argument(
+        "fixtures",
+        nargs="?",
+        default="-",
+        help="CSV or JSON lines file with gender, player_A, player_B and optionally odds_A, odds_B, "
+        "start_date, end_date, surface, level, pooled_weight, half_life, tourney_level and format "
+        "('-' or nothing for stdin)",
+    )
+    parser.add_argument(
+        "--workers", type=int, default=1, help="Number of fixtures scored at the same time"
+    )
+    add_common_arguments(parser)
+    args = parser.parse_args(argv)
+    start_profile(args)
+
+    if args.tabulated:
+        load_tables()
+
+    # Each tour is loaded once, the first time one of its fixtures comes up
+    loaded = {}
+    lock = threading.Lock()
+
+    def datasets(gender):
+        with lock:
+            if gender not in loaded:
+                loaded[gender] = load_dataset(arguments_years(args), gender, args.verbosity)
+            return loaded[gender]
+
+    def score(fixture):
+        # A fixture that cannot be scored is reported on its own line, the others go on
         try:
-            pABC = P_ABC(player_A, player_B, common_adversary, num_matches)
-            sum += pABC
-            if verbosity >= 2:
-                print(
-                    f"Probability of {player_A} beating {player_B} via {common_adversary}: {pABC};"
-                )
-            common_players += 1
-        except NoAdversaryMatches:
-            pass
-
-    if common_players == 0:  
-        if verbosity >= 1:  
-            print("No common opponents found.")  
-        # Return None or an appropriate value to signify no common opponents  
-        return None, None, None  
-    result = sum / common_players
-    print(f"The probability of {player_A} beating {player_B} is {result:.2%}")
-
-    odd_a = 1 / result
-    odd_b = 1 / (1 - result)
-    print(f"Real odds for {player_A} winning: " + str(odd_a))
-    print(f"Real odds for {player_B} winning: " + str(odd_b))
-    return result, odd_a, odd_b
+            return score_fixture(
+                fixture,
+                datasets,
+                args.tabulated,
+                arguments_window(args),
+                args.surface,
+                args.level,
+                args.pooled_weight,
+                arguments_decay(args),
+                MATCH_FORMATS.get(args.format),
+                args.tourney_level,
+            )
+        except Exception as e:
+            return {
+                "gender": fixture.get("gender"),
+                "player_A": fixture.get("player_A"),
+                "player_B": fixture.get("player_B"),
+                "error": f"Could not score the fixture: {e}",
+            }
+
+    fixtures_file = sys.stdin if args.fixtures == "-" else open(args.fixtures, newline="")
+    with fixtures_file:
+        for result in ordered_map(score, read_fixtures(fixtures_file), args.workers):
+            print(json.dumps(finite_json(result)), flush=True)
+    report_profile(args)
+
+
+COMMANDS = {"draw": draw_main, "batch": batch_main}
 
 
 def main():
+    if len(sys.argv) > 1 and sys.argv[1] in COMMANDS:
+        COMMANDS[sys.argv[1]](sys.argv[2:])
+        return
+
     parser = argparse.ArgumentParser()
 
     parser.add_argument(
@@ -84,19 +695,33 @@ def main():
         "player_B", help="Name of player which is to be beaten [e.g. Novak Djokovic]"
     )
     parser.add_argument(
-        "--years",
-        type=int,
-        default=[2021, 2023],
-        nargs=2,
-        help="Range of years for which to consider statistics",
-    )
-    parser.add_argument(
-        "-v", "--verbosity", action="count", default=0, help="increase output verbosity"
+        "--confidence",
+        type=float,
+        help="Also print a bootstrap confidence interval of the probability at this level (e.g. 0.9)",
     )
+    add_common_arguments(parser)
     args = parser.parse_args()
+    if args.confidence is not None and not 0 < args.confidence < 1:
+        parser.error("--confidence must be between 0 and 1")
+    start_profile(args)
 
-    prepare_match_results(args.years, args.gender, args.verbosity)
-    P(args.player_A, args.player_B, args.gender, args.verbosity)
+    if args.tabulated:
+        load_tables()
+    dataset = load_dataset(arguments_years(args), args.gender, args.verbosity)
+    dataset.P(
+        args.player_A,
+        args.player_B,
+        args.verbosity,
+        args.tabulated,
+        arguments_window(args),
+        args.surface,
+        args.level,
+        args.pooled_weight,
+        arguments_decay(args),
+        arguments_format(args, args.gender),
+        args.confidence,
+    )
+    report_profile(args)
 
 
 if __name__ == "__main__":
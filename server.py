@@ -0,0 +1,237 @@
+# server.py
+import argparse
+import asyncio
+import json
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from http import HTTPStatus
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import parse_qsl, urlsplit
+
+from match_stats import BASE_URLS, Dataset, load_dataset
+from malleys import load_tables
+from predictor import finite_json, score_fixture
+
+GENDERS = tuple(BASE_URLS)
+MAX_BODY_SIZE = 16 << 20
+# The fixture fields a prediction depends on
+FIXTURE_FIELDS = (
+    "gender",
+    "player_A",
+    "player_B",
+    "odds_A",
+    "odds_B",
+    "start_date",
+    "end_date",
+    "surface",
+    "level",
+    "pooled_weight",
+    "half_life",
+    "tourney_level",
+    "format",
+)
+
+
+class PredictionService:
+    """Keeps a Dataset per tour in memory and answers predictions from them.
+
+    Readers take a reference to the current datasets when a request starts, and a
+    reload builds new datasets off the event loop and swaps them in with a single
+    assignment, so requests never wait on a reload."""
+
+    def __init__(self, year_range: Tuple[int, int], workers: int = 4, tabulated: bool = False, verbosity: int = 0):
+        self.year_range = year_range
+        self.tabulated = tabulated
+        self.verbosity = verbosity
+        self.executor = ThreadPoolExecutor(workers)
+        self.datasets: Dict[str, Dataset] = {}
+        self.players: Dict[str, list] = {}
+        self.in_flight: Dict[Any, asyncio.Future] = {}
+        self.reloading: Dict[str, asyncio.Task] = {}
+
+    def _load(self, gender: str):
+        dataset = load_dataset(self.year_range, gender, self.verbosity)
+        return dataset, sorted(dataset.list_players())
+
+    async def load(self, gender: str):
+        loop = asyncio.get_running_loop()
+        dataset, players = await loop.run_in_executor(self.executor, self._load, gender)
+        # Replace the mappings rather than mutating them, so readers holding the old ones
+        # keep a consistent view
+        self.datasets = {**self.datasets, gender: dataset}
+        self.players = {**self.players, gender: players}
+
+    async def start(self):
+        if self.tabulated:
+            await asyncio.get_running_loop().run_in_executor(self.executor, load_tables)
+        await asyncio.gather(*(self.load(gender) for gender in GENDERS))
+
+    def reload(self, gender: str) -> bool:
+        # Refreshes the current year in the background; False when one is already running
+        task = self.reloading.get(gender)
+        if task is not None and not task.done():
+            return False
+
+        def reloaded(task: asyncio.Task):
+            self.reloading.pop(gender, None)
+            # A failed reload keeps serving the previous dataset
+            if not task.cancelled() and task.exception() is not None and self.verbosity >= 1:
+                print(f"Could not reload the {gender} dataset: {task.exception()}")
+
+        task = asyncio.ensure_future(self.load(gender))
+        task.add_done_callback(reloaded)
+        self.reloading[gender] = task
+        return True
+
+    async def predict(self, fixture: Dict[str, Any]) -> Dict[str, Any]:
+        # Identical queries already being computed share the pending result
+        key = tuple(str(fixture.get(field)) for field in FIXTURE_FIELDS)
+        future = self.in_flight.get(key)
+        if future is None:
+            datasets = self.datasets
+            future = asyncio.get_running_loop().run_in_executor(
+                self.executor, score_fixture, fixture, datasets.get, self.tabulated
+            )
+            self.in_flight[key] = future
+            future.add_done_callback(lambda _: self.in_flight.pop(key, None))
+        return await asyncio.shield(future)
+
+    async def dispatch(self, method: str, target: str, body: bytes) -> Tuple[int, Any]:
+        # Bad requests are answered by route; anything else that goes wrong is answered
+        # with a 500 rather than dropping the connection
+        try:
+            return await self.route(method, target, body)
+        except Exception as e:
+            if self.verbosity >= 1:
+                print(f"Could not answer {method} {target}: {e!r}")
+            return HTTPStatus.INTERNAL_SERVER_ERROR, {"error": f"Could not answer the request: {e}"}
+
+    async def route(self, method: str, target: str, body: bytes) -> Tuple[int, Any]:
+        url = urlsplit(target)
+        query = dict(parse_qsl(url.query))
+        if body:
+            try:
+                payload = json.loads(body)
+            except ValueError as e:
+                return HTTPStatus.BAD_REQUEST, {"error": f"Invalid JSON body: {e}"}
+        else:
+            payload = None
+
+        if url.path == "/players" and method == "GET":
+            gender = query.get("gender")
+            if gender not in self.players:
+                return HTTPStatus.BAD_REQUEST, {"error": f"gender must be one of {', '.join(GENDERS)}"}
+            return HTTPStatus.OK, {"gender": gender, "players": self.players[gender]}
+
+        if url.path == "/predict" and method in ("GET", "POST"):
+            fixture = payload if method == "POST" else query
+            if not isinstance(fixture, dict):
+                return HTTPStatus.BAD_REQUEST, {"error": "Expected a JSON object"}
+            result = await self.predict(fixture)
+            return (HTTPStatus.BAD_REQUEST if "error" in result else HTTPStatus.OK), result
+
+        if url.path == "/batch" and method == "POST":
+            fixtures = payload.get("fixtures") if isinstance(payload, dict) else payload
+            if not isinstance(fixtures, list) or not all(isinstance(f, dict) for f in fixtures):
+                return HTTPStatus.BAD_REQUEST, {"error": "Expected a list of fixture objects"}
+            results = await asyncio.gather(*(self.predict(fixture) for fixture in fixtures))
+            return HTTPStatus.OK, {"results": results}
+
+        if url.path == "/reload" and method == "POST":
+            genders = [query["gender"]] if "gender" in query else list(GENDERS)
+            if any(gender not in GENDERS for gender in genders):
+                return HTTPStatus.BAD_REQUEST, {"error": f"gender must be one of {', '.join(GENDERS)}"}
+            return HTTPStatus.ACCEPTED, {gender: self.reload(gender) for gender in genders}
+
+        if url.path in ("/players", "/predict", "/batch", "/reload"):
+            return HTTPStatus.METHOD_NOT_ALLOWED, {"error": f"{method} is not supported on {url.path}"}
+        return HTTPStatus.NOT_FOUND, {"error": f"Unknown endpoint {url.path}"}
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, target, version = request_line.decode("latin-1").split()
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                length = int(headers.get("content-length", 0))
+                if length > MAX_BODY_SIZE:
+                    status, payload = HTTPStatus.REQUEST_ENTITY_TOO_LARGE, {"error": "Request body too large"}
+                    keep_alive = False
+                else:
+                    body = await reader.readexactly(length) if length else b""
+                    status, payload = await self.dispatch(method, target, body)
+                    keep_alive = (
+                        version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+                    )
+
+                content = json.dumps(finite_json(payload)).encode()
+                writer.write(
+                    (
+                        f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+                        "Content-Type: application/json\r\n"
+                        f"Content-Length: {len(content)}\r\n"
+                        f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+                    ).encode("latin-1")
+                    + content
+                )
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+
+async def serve(host: str, port: int, service: PredictionService, ready: Optional[asyncio.Event] = None):
+    await service.start()
+    server = await asyncio.start_server(service.handle, host, port)
+    if service.verbosity >= 1:
+        print(f"Serving predictions on http://{host}:{port}")
+    if ready is not None:
+        ready.set()
+    async with server:
+        await server.serve_forever()
+
+
+def main():
+    current_year = datetime.now().year
+    parser = argparse.ArgumentParser(description="Resident HTTP service for match predictions")
+    parser.add_argument("--host", default="127.0.0.1", help="Address to listen on")
+    parser.add_argument("--port", type=int, default=8000, help="Port to listen on")
+    parser.add_argument(
+        "--years",
+        type=int,
+        default=[current_year - 2, current_year],
+        nargs=2,
+        help="Range of years for which to consider statistics",
+    )
+    parser.add_argument("--workers", type=int, default=4, help="Threads computing predictions")
+    parser.add_argument(
+        "--tabulated",
+        action="store_true",
+        help="Use precomputed M3/M5 lookup tables instead of the exact formulas",
+    )
+    parser.add_argument(
+        "-v", "--verbosity", action="count", default=0, help="increase output verbosity"
+    )
+    args = parser.parse_args()
+
+    service = PredictionService(tuple(args.years), args.workers, args.tabulated, args.verbosity)
+    try:
+        asyncio.run(serve(args.host, args.port, service))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
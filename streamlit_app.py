@@ -1,18 +1,70 @@
 # app.py  
-from detailed_analysis import get_common_opponents, get_match_details, format_match_details, get_summary_statistics
-from predictor import P, prepare_match_results, list_players  
-from datetime import datetime  
-import streamlit as st  
+from datetime import datetime
+
+import streamlit as st
+
+import instrumentation
+from detailed_analysis import analyse_common_opponents, format_match_details
+from match_stats import load_dataset
+from predictor import kelly_fraction
+
+
+# The whole history is loaded once per gender, and the chosen timeframe is a date window
+# over it
+FIRST_YEAR = 1990
+# Level of the bootstrap interval shown with each probability; bets are sized from its
+# conservative end
+CONFIDENCE = 0.9
+
+
+def year_window(start_year):
+    return start_year * 10000 + 101, None
+
+
+@st.cache_resource(show_spinner="Loading match results...")
+def load_match_data(gender):
+    return load_dataset((FIRST_YEAR, datetime.now().year), gender)
+
+
+@st.cache_data(show_spinner="Listing players...")
+def list_players(gender, start_year):
+    return load_match_data(gender).list_players(window=year_window(start_year))
+
+
+@st.cache_data(show_spinner="Calculating probabilities...")
+def predict(gender, start_year, surface, player_A, player_B):
+    return load_match_data(gender).P(
+        player_A, player_B, window=year_window(start_year), surface=surface, confidence=CONFIDENCE
+    )
+
+
+@st.cache_data(show_spinner="Analysing common opponents...")
+def match_analysis(gender, start_year, surface, player_A, player_B):
+    analysis = analyse_common_opponents(
+        player_A, player_B, load_match_data(gender), year_window(start_year), surface
+    )
+    if not analysis['common_opponents']:
+        return None
+    return analysis['summary'], format_match_details(analysis['match_details'])
+
 
 # Initialize the state  
-if 'predict_pressed' not in st.session_state:  
-    st.session_state['predict_pressed'] = False  
+if 'prediction_key' not in st.session_state:  
+    st.session_state['prediction_key'] = None  
   
 if 'start_year' not in st.session_state:  
     st.session_state['start_year'] = 2024  # Default start year  
   
 # Set page layout to wide  
 st.set_page_config(layout="wide")  
+
+# Time the stages each rerun of this session computes. The timings are recorded for the
+# session's own thread, so other sessions neither add to them nor switch them off
+record_timings = st.sidebar.checkbox('Record timings')
+if record_timings:
+    timings = instrumentation.start_recording()
+else:
+    instrumentation.stop_recording()
   
 # Display the title and subtitle  
 st.title('Tennis Match Predictor')  
@@ -27,13 +79,19 @@ with col1:
 
     # Let the user select a start year  
     st.session_state['start_year'] = st.number_input('Select start year for analysis',   
-                                                     min_value=1990,   
+                                                     min_value=FIRST_YEAR,   
                                                      max_value=datetime.now().year,   
                                                      value=st.session_state['start_year'])  
+
+with col2:
+    # Restrict the statistics to one surface, or use all of them
+    surfaces = [s for s in load_match_data(gender).surfaces if s]
+    surface = st.selectbox('Select surface', ['All'] + surfaces)
+    surface = None if surface == 'All' else surface
   
-# Call prepare_match_results with the dynamic start year  
-prepare_match_results((st.session_state['start_year'], datetime.now().year), gender)  
-players = list_players()   
+# The match results are cached per gender and the player lists per timeframe, shared by all sessions
+start_year = st.session_state['start_year']
+players = list_players(gender, start_year)
   
 # Create columns for player selection and odds input  
 col1, col2 = st.columns(2)  
@@ -46,17 +104,20 @@ with col2:
     player_B = st.selectbox('Choose Player B', [p for p in players if p != player_A])  
     odds_B = st.number_input('Enter decimal odds for Player B', min_value=1.01, value=2.00)  
   
-# Center the predict button below the columns  
+# Results stay on screen until the players or timeframe change, so editing the odds only
+# redoes the Kelly arithmetic on the cached prediction
+prediction_key = (gender, start_year, surface, player_A, player_B)
 if st.button('Predict Outcome and Calculate Bet Sizes', key='predict_button'):  
-    st.session_state['predict_pressed'] = True  
+    st.session_state['prediction_key'] = prediction_key
+predict_pressed = st.session_state['prediction_key'] == prediction_key
   
 # Use tabs to separate the main content from the additional information  
 tab1, tab2, tab_theory = st.tabs(["Main Results", "Detailed Analysis", "The Theory"])  
   
 with tab1:    
-    if st.session_state['predict_pressed']:    
+    if predict_pressed:
         # Perform the calculations    
-        probability, real_odds_A, real_odds_B = P(player_A, player_B, gender)    
+        probability, real_odds_A, real_odds_B, interval = predict(*prediction_key)
     
         if probability is None:    
             # Display a message to the user when there are no common opponents    
@@ -66,35 +127,39 @@ with tab1:
             col1, col2 = st.columns(2)    
             with col1:    
                 st.metric(label=f"Probability of {player_A} beating {player_B}", value=f"{probability:.2%}")    
+                st.caption(f"{CONFIDENCE:.0%} confidence interval: {interval[0]:.2%} to {interval[1]:.2%}")
                 st.metric(label=f"Real odds for {player_A} winning", value=f"{real_odds_A:.2f}")    
     
-                # Calculate the Kelly Bet for Player A    
-                kelly_bet_A = (probability * (odds_A - 1) - (1 - probability)) / (odds_A - 1)    
+                # Calculate the Kelly Bet for Player A at the low end of the interval
+                kelly_bet_A = kelly_fraction(interval[0], odds_A)
                 if kelly_bet_A > 0:    
                     st.metric(label=f"Optimal bet size for {player_A}", value=f"{kelly_bet_A:.2%} of your bankroll")    
+                    st.caption(f"Full Kelly on the point estimate: {kelly_fraction(probability, odds_A):.2%}")
+                elif kelly_fraction(probability, odds_A) > 0:
+                    st.write("The edge on this outcome is within the uncertainty of the prediction, so it is not worth a bet.")
                 else:    
                     st.write("The Kelly Criterion suggests not to bet on this outcome.")    
     
             with col2:    
                 st.metric(label=f"Probability of {player_B} beating {player_A}", value=f"{1 - probability:.2%}")    
+                st.caption(f"{CONFIDENCE:.0%} confidence interval: {1 - interval[1]:.2%} to {1 - interval[0]:.2%}")
                 st.metric(label=f"Real odds for {player_B} winning", value=f"{real_odds_B:.2f}")    
     
-                # Calculate the Kelly Bet for Player B    
-                kelly_bet_B = ((1 - probability) * (odds_B - 1) - probability) / (odds_B - 1)    
+                # Calculate the Kelly Bet for Player B at the low end of the interval
+                kelly_bet_B = kelly_fraction(1 - interval[1], odds_B)
                 if kelly_bet_B > 0:    
                     st.metric(label=f"Optimal bet size for {player_B}", value=f"{kelly_bet_B:.2%} of your bankroll")    
+                    st.caption(f"Full Kelly on the point estimate: {kelly_fraction(1 - probability, odds_B):.2%}")
+                elif kelly_fraction(1 - probability, odds_B) > 0:
+                    st.write("The edge on this outcome is within the uncertainty of the prediction, so it is not worth a bet.")
                 else:    
                     st.write("The Kelly Criterion suggests not to bet on this outcome.")  
   
 with tab2:  
-    if st.session_state['predict_pressed']:  
-        common_opponents = get_common_opponents(player_A, player_B)  
-        if common_opponents:  
-            match_details = get_match_details(player_A, player_B, common_opponents)  
-            formatted_details = format_match_details(match_details)  
-              
-            # Get the summary statistics  
-            summary_stats = get_summary_statistics(player_A, player_B, common_opponents)  
+    if predict_pressed:
+        analysis = match_analysis(*prediction_key)
+        if analysis:
+            summary_stats, formatted_details = analysis
               
             # Display the summary statistics  
             st.subheader("Summary Statistics")  
@@ -110,9 +175,6 @@ with tab2:
             st.text(formatted_details)  
         else:  
             st.write("No common opponents found.")  
-              
-        # Reset the predict_pressed flag after displaying the analysis  
-        st.session_state['predict_pressed'] = False    
 
 with tab_theory:  
     st.write("""  
@@ -138,4 +200,13 @@ with tab_theory:
     Department of Computing, Imperial College London, South Kensington Campus, London, SW7 2AZ, United Kingdom.  
   
     [Get the full document on sciencedirect](https://www.sciencedirect.com/science/article/pii/S0898122112002106)  
-    """)  
\ No newline at end of file
+    """)  
+
+if record_timings:
+    instrumentation.stop_recording()
+    with st.expander("Timings"):
+        report = timings.summary()
+        if report["timings"]:
+            st.text(instrumentation.format_summary(report))
+        else:
+            st.write("Nothing was computed on this rerun: every result came from the cache.")
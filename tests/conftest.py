@@ -0,0 +1,18 @@
+# tests/conftest.py
+import os
+import sys
+
+import pytest
+
+# The modules live at the top of the repository rather than in a package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.generator import generate
+from match_stats import Dataset, MatchTable, load_filtered_match_results
+
+
+@pytest.fixture(scope="session")
+def dataset(tmp_path_factory):
+    # Two years of a small generated tour
+    paths = generate(str(tmp_path_factory.mktemp("results")), "men", range(2010, 2012), players=80, tournaments=20)
+    return Dataset(MatchTable.concatenate([load_filtered_match_results(path) for path in paths.values()]), "men")
@@ -0,0 +1,39 @@
+# tests/test_backtest.py
+import contextlib
+import io
+
+import pytest
+
+from backtest import run_backtest
+from predictor import match_format_for
+
+
+@pytest.fixture(scope="module")
+def predictions(dataset):
+    return run_backtest(dataset, "men", workers=1)
+
+
+def test_shards_give_the_single_process_predictions(dataset, predictions):
+    assert predictions
+    assert run_backtest(dataset, "men", workers=3) == predictions
+
+
+def test_predictions_only_use_earlier_matches(dataset, predictions):
+    # Each prediction equals Dataset.P over the matches up to the day before the match,
+    # in the format of the match's tournament level
+    levels = {}
+    for date, winner, loser, level in zip(
+        dataset.table.date.tolist(),
+        dataset.table.winner.tolist(),
+        dataset.table.loser.tolist(),
+        dataset.table.level.tolist(),
+    ):
+        levels[(date, *sorted((dataset.names[winner], dataset.names[loser])))] = dataset.levels[level]
+    assert len(set(levels.values())) > 1
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        for date, player_A, player_B, probability, _, common in predictions[::25]:
+            match_format = match_format_for("men", levels[(date, player_A, player_B)])
+            expected = dataset.P(player_A, player_B, window=(None, date - 1), match_format=match_format)[0]
+            assert probability == pytest.approx(expected, abs=1e-12)
+            assert common == len(dataset.common_opponents(player_A, player_B, window=(None, date - 1)))
@@ -0,0 +1,138 @@
+# tests/test_downloads.py
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+from benchmarks.generator import generate
+from match_stats import download_all_match_results, download_match_results, load_dataset, validators_filepath
+
+
+class StandIn:
+    """Local stand-in for the results host: serves files by path with an ETag, answers
+    304 to a matching If-None-Match, and can cut a response short."""
+
+    def __init__(self):
+        self.files = {}
+        self.truncated = set()
+        self.requests = []
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                stand_in.requests.append((self.path, dict(self.headers)))
+                if self.path not in stand_in.files:
+                    self.send_error(404)
+                    return
+                body, etag = stand_in.files[self.path]
+                if self.headers.get("If-None-Match") == etag:
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header("ETag", etag)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body[: len(body) // 2] if self.path in stand_in.truncated else body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.base_url = f"http://127.0.0.1:{self.server.server_address[1]}/atp_matches_"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def serve(self, year: int, body: bytes, etag: str):
+        self.files[f"/atp_matches_{year}.csv"] = (body, etag)
+
+
+@pytest.fixture
+def stand_in(tmp_path, monkeypatch):
+    # Downloads land in atp/ under the working directory
+    monkeypatch.chdir(tmp_path)
+    server = StandIn()
+    yield server
+    server.server.shutdown()
+    server.server.server_close()
+
+
+def read(path: str) -> bytes:
+    with open(path, "rb") as results_file:
+        return results_file.read()
+
+
+def test_download_revalidates_with_the_etag(stand_in):
+    url = f"{stand_in.base_url}2020.csv"
+    stand_in.serve(2020, b"first\n", '"v1"')
+    assert download_match_results(url) == "atp/2020.csv"
+    assert read("atp/2020.csv") == b"first\n"
+    with open(validators_filepath("atp/2020.csv")) as validators_file:
+        assert json.load(validators_file)["etag"] == '"v1"'
+
+    # Unchanged: the stand-in answers 304 and the file is kept as it is
+    download_match_results(url)
+    assert stand_in.requests[-1][1].get("If-None-Match") == '"v1"'
+    assert read("atp/2020.csv") == b"first\n"
+
+    # Changed: the new version and its ETag replace the old ones
+    stand_in.serve(2020, b"second\n", '"v2"')
+    download_match_results(url)
+    assert read("atp/2020.csv") == b"second\n"
+    with open(validators_filepath("atp/2020.csv")) as validators_file:
+        assert json.load(validators_file)["etag"] == '"v2"'
+    assert sorted(os.listdir("atp")) == ["2020.csv", "2020.csv.http.json"]
+
+
+def test_failed_downloads_keep_the_previous_file(stand_in):
+    url = f"{stand_in.base_url}2020.csv"
+    stand_in.serve(2020, b"first\n", '"v1"')
+    download_match_results(url)
+
+    # A transfer cut short never replaces the file
+    stand_in.serve(2020, b"second version\n", '"v2"')
+    stand_in.truncated.add("/atp_matches_2020.csv")
+    with pytest.raises(requests.RequestException):
+        download_match_results(url)
+    assert read("atp/2020.csv") == b"first\n"
+    assert sorted(os.listdir("atp")) == ["2020.csv", "2020.csv.http.json"]
+
+    # Nor does a missing one, reported per url by download_all_match_results
+    with pytest.raises(requests.HTTPError):
+        download_match_results(f"{stand_in.base_url}2019.csv")
+    download_all_match_results([url, f"{stand_in.base_url}2019.csv"])
+    assert read("atp/2020.csv") == b"first\n"
+    assert not os.path.exists("atp/2019.csv")
+
+
+def test_load_dataset_from_the_stand_in(stand_in, tmp_path):
+    paths = generate(str(tmp_path / "generated"), "men", [2018, 2019], players=40, tournaments=8)
+    for year, path in paths.items():
+        stand_in.serve(year, read(path), f'"{year}"')
+    dataset = load_dataset((2018, 2019), "men", base_url=stand_in.base_url)
+    assert dataset.match_count > 0
+    assert {path for path, _ in stand_in.requests} == {"/atp_matches_2018.csv", "/atp_matches_2019.csv"}
+
+    # Past years already downloaded are not requested again
+    load_dataset((2018, 2019), "men", base_url=stand_in.base_url)
+    assert len(stand_in.requests) == 2
+
+
+def test_concurrent_downloads_into_an_empty_directory(stand_in, monkeypatch):
+    # Slowed down, makedirs lets every download thread find the directory missing first
+    makedirs = os.makedirs
+
+    def slow_makedirs(*args, **kwargs):
+        time.sleep(0.01)
+        makedirs(*args, **kwargs)
+
+    monkeypatch.setattr(os, "makedirs", slow_makedirs)
+    years = range(2010, 2018)
+    for year in years:
+        stand_in.serve(year, f"{year}\n".encode(), f'"{year}"')
+    download_all_match_results([f"{stand_in.base_url}{year}.csv" for year in years])
+    for year in years:
+        assert read(f"atp/{year}.csv") == f"{year}\n".encode()
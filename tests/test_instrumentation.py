@@ -0,0 +1,62 @@
+# tests/test_instrumentation.py
+import threading
+
+import numpy as np
+
+import instrumentation
+from malleys import M3_table, M5_table
+
+
+@instrumentation.timed("work")
+def work():
+    instrumentation.count("work done")
+
+
+def test_recordings_are_kept_per_thread():
+    # One thread records while another keeps switching the process-wide timers off and
+    # clearing them, as another session's rerun would
+    recorded = threading.Event()
+    done = threading.Event()
+    recordings = {}
+
+    def recording_session():
+        recordings["session"] = instrumentation.start_recording()
+        work()
+        recorded.set()
+        done.wait(10)
+        work()
+        instrumentation.stop_recording()
+        work()
+
+    def other_session():
+        recorded.wait(10)
+        instrumentation.enable(False)
+        instrumentation.reset()
+        work()
+        done.set()
+
+    threads = [threading.Thread(target=recording_session), threading.Thread(target=other_session)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    report = recordings["session"].summary()
+    assert report["timings"]["work"]["calls"] == 2
+    assert report["counters"] == {"work done": 2}
+    assert instrumentation.summary() == {"timings": {}, "counters": {}}
+
+
+def test_process_wide_timers():
+    instrumentation.reset()
+    instrumentation.enable()
+    try:
+        work()
+        M3_table(np.array([0.6]), np.array([0.4]))
+        M5_table(np.array([0.6]), np.array([0.4]))
+    finally:
+        instrumentation.enable(False)
+    report = instrumentation.summary()
+    instrumentation.reset()
+    assert report["counters"] == {"work done": 1}
+    assert {"work", "M3_table", "M5_table"} <= set(report["timings"])
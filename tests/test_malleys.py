@@ -0,0 +1,84 @@
+# tests/test_malleys.py
+import numpy as np
+import pytest
+
+import malleys
+from malleys import (
+    BEST_OF_3,
+    BEST_OF_5,
+    M3,
+    M3_array,
+    M3_table,
+    M5,
+    M5_array,
+    M5_table,
+    TABLE_MAX_ERROR,
+    TABLE_SIZE,
+    match_probability,
+    match_probability_array,
+    table_max_error,
+)
+
+# Serve and return point probabilities over the range seen in practice
+GRID = np.linspace(0.3, 0.9, 25)
+
+
+@pytest.mark.parametrize("match_format, closed_form", [(BEST_OF_3, M3_array), (BEST_OF_5, M5_array)])
+def test_engine_matches_closed_forms(match_format, closed_form):
+    p, q = np.meshgrid(GRID, 1 - GRID)
+    np.testing.assert_allclose(match_probability_array(p, q, match_format), closed_form(p, q), rtol=0, atol=1e-12)
+
+
+def test_scalar_engine_matches_closed_forms():
+    for p, q in [(0.62, 0.38), (0.7, 0.35), (0.55, 0.45)]:
+        assert match_probability(p, q, BEST_OF_3) == pytest.approx(M3(p, q), abs=1e-12)
+        assert match_probability(p, q, BEST_OF_5) == pytest.approx(M5(p, q), abs=1e-12)
+
+
+def test_even_players_are_even():
+    assert M3(0.62, 0.38) == pytest.approx(0.5, abs=1e-12)
+    assert M5(0.62, 0.38) == pytest.approx(0.5, abs=1e-12)
+
+
+def test_tables_stay_within_the_documented_error():
+    errors = table_max_error()
+    assert errors["M3"] < TABLE_MAX_ERROR
+    assert errors["M5"] < TABLE_MAX_ERROR
+
+
+def test_smaller_tables_stay_within_the_scaled_error():
+    # Bilinear interpolation error grows with the square of the cell width
+    size = 257
+    bound = TABLE_MAX_ERROR * ((TABLE_SIZE - 1) / (size - 1)) ** 2
+    errors = table_max_error(size)
+    assert errors["M3"] < bound
+    assert errors["M5"] < bound
+
+
+def test_tables_fall_back_to_the_exact_formulas_outside_the_grid(tmp_path, monkeypatch):
+    monkeypatch.setattr(malleys, "TABLE_FILE", str(tmp_path / "tables.npz"))
+    monkeypatch.setattr(malleys, "TABLE_SIZE", 65)
+    p = np.array([0.01, 0.6, 0.97, 0.6, 0.3])
+    q = np.array([0.4, 0.02, 0.4, 0.99, 0.5])
+    np.testing.assert_array_equal(M3_table(p[:4], q[:4]), M3_array(p[:4], q[:4]))
+    np.testing.assert_array_equal(M5_table(p[:4], q[:4]), M5_array(p[:4], q[:4]))
+    # Inside the grid the coarse table is an approximation, stored where TABLE_FILE says
+    assert abs(M3_table(p[4], q[4]) - M3_array(p[4], q[4])) < 1e-2
+    assert (tmp_path / "tables.npz").exists()
+
+
+def test_tables_built_in_chunks_equal_the_whole_grid():
+    # 65 rows take three chunks, the last one partial
+    grid = np.linspace(malleys.TABLE_MIN, malleys.TABLE_MAX, 65)
+    tables = malleys.build_tables(65)
+    np.testing.assert_array_equal(tables["M3"], M3_array(grid[:, None], grid[None, :]).astype(np.float32))
+    np.testing.assert_array_equal(tables["M5"], M5_array(grid[:, None], grid[None, :]).astype(np.float32))
+
+
+def test_tables_are_kept_in_memory_when_they_cannot_be_stored(tmp_path, monkeypatch):
+    # A directory that doesn't exist fails like a read-only one, even for root
+    path = str(tmp_path / "missing" / "tables.npz")
+    tables = malleys.load_tables(path, 33)
+    assert tables["M3"].shape == (33, 33)
+    assert not (tmp_path / "missing").exists()
+    assert malleys.load_tables(path, 33) is tables
@@ -0,0 +1,337 @@
+# tests/test_match_stats.py
+import argparse
+import contextlib
+import io
+import os
+import subprocess
+import sys
+from collections import Counter
+from dataclasses import astuple
+
+import numpy as np
+import pytest
+
+import predictor
+from malleys import BEST_OF_3
+from match_stats import (
+    DROP_STAGES,
+    LOSER_STATS_END,
+    SCORE,
+    TOURNEY_DATE,
+    WINNER_STATS_START,
+    Decay,
+    NoAdversaryMatches,
+    P_ABC_batch,
+    bootstrap_interval,
+    date_bounds,
+    day_numbers,
+    filter_match_results,
+    is_completed,
+)
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def decayed_spw(dataset, player, decay):
+    # Serve points won by the player, each match weighted by its age, summed match by match
+    table = dataset.table
+    player_id = dataset.name_ids[player]
+    reference_date = decay.reference_date or dataset.last_date
+    won, lost = table.winner == player_id, table.loser == player_id
+    played = (won | lost) & (table.date <= reference_date)
+    weights = np.exp2((day_numbers(table.date[played]) - day_numbers(reference_date)) / decay.half_life)
+    stats = np.where(won[played][:, None], table.stats[played][:, :6], table.stats[played][:, 6:]).astype(float)
+    return ((stats[:, 4] + stats[:, 5]) * weights).sum() / (stats[:, 2] * weights).sum()
+
+
+@pytest.mark.parametrize("half_life", [0.5, 2, 30, 365])
+@pytest.mark.parametrize("reference_date", [20100601, 20110301, None])
+def test_decayed_probability_is_never_nan(dataset, half_life, reference_date):
+    # Short half-lives with early reference dates put most matches hundreds of half-lives
+    # away from each other
+    players = dataset.list_players(match_min=20)
+    decay = Decay(half_life, reference_date)
+    with contextlib.redirect_stdout(io.StringIO()):
+        for player_A, player_B in zip(players[:10], players[10:20]):
+            for kwargs in ({}, {"surface": "Hard", "pooled_weight": 100}):
+                probability = dataset.P(player_A, player_B, decay=decay, **kwargs)[0]
+                assert probability is None or 0 <= probability <= 1
+
+
+@pytest.mark.parametrize("half_life", [0.5, 7, 180])
+def test_decayed_spw_matches_weighted_sum(dataset, half_life):
+    decay = Decay(half_life, 20110301)
+    for player in dataset.list_players(match_min=20)[:10]:
+        assert dataset.spw(player, None, decay=decay) == pytest.approx(decayed_spw(dataset, player, decay), rel=1e-12)
+
+
+def test_P_is_a_method_of_the_dataset():
+    # Run without predictor imported, which Dataset.P does not need
+    script = (
+        "import sys, tempfile\n"
+        "from benchmarks.generator import generate\n"
+        "from match_stats import Dataset, MatchTable, load_filtered_match_results\n"
+        "paths = generate(tempfile.mkdtemp(), 'men', [2010], players=40, tournaments=10)\n"
+        "dataset = Dataset(MatchTable.concatenate([load_filtered_match_results(p) for p in paths.values()]), 'men')\n"
+        "player_A, player_B = dataset.list_players(match_min=10)[:2]\n"
+        "assert 0 < dataset.P(player_A, player_B)[0] < 1\n"
+        "assert 'predictor' not in sys.modules\n"
+    )
+    subprocess.run([sys.executable, "-c", script], cwd=ROOT, check=True)
+
+
+def test_predictor_P_delegates_to_the_dataset(dataset):
+    player_A, player_B = dataset.list_players(match_min=20)[:2]
+    with contextlib.redirect_stdout(io.StringIO()):
+        assert predictor.P(player_A, player_B, "men", dataset=dataset) == dataset.P(player_A, player_B)
+        assert predictor.P(player_A, player_B, "women", dataset=dataset) == dataset.P(
+            player_A, player_B, match_format=BEST_OF_3
+        )
+
+
+@pytest.mark.parametrize("half_life", [0, -30, float("nan")])
+def test_decay_needs_a_positive_half_life(half_life):
+    with pytest.raises(ValueError):
+        Decay(half_life)
+
+
+@pytest.mark.parametrize("half_life", ["0", "-30", "nan", "soon"])
+def test_half_life_argument_must_be_positive(half_life, capsys):
+    parser = argparse.ArgumentParser()
+    predictor.add_common_arguments(parser)
+    with pytest.raises(SystemExit):
+        parser.parse_args(["--half-life", half_life])
+    assert "--half-life" in capsys.readouterr().err
+
+
+def pair_sides(dataset, player, adversary):
+    # The player's stats in each match against the adversary, ordered by partition, date
+    # and match as the dataset orders them, found by going through every match
+    table = dataset.table
+    player_id, adversary_id = dataset.name_ids[player], dataset.name_ids[adversary]
+    sides = []
+    for i in range(len(table)):
+        if (table.winner[i], table.loser[i]) == (player_id, adversary_id):
+            stats = table.stats[i]
+        elif (table.loser[i], table.winner[i]) == (player_id, adversary_id):
+            stats = np.concatenate([table.stats[i, 6:], table.stats[i, :6]])
+        else:
+            continue
+        partition = int(table.surface[i]) * len(dataset.levels) + int(table.level[i])
+        sides.append(((partition, int(table.date[i]), i), stats.astype(float)))
+    return [stats for _, stats in sorted(sides, key=lambda side: side[0])]
+
+
+def naive_margins(dataset, player, adversaries, samples, rng):
+    # Margins against each adversary recomputed replicate by replicate, each drawing as
+    # many of the pair's matches as it has, uniformly with replacement
+    pairs = [pair_sides(dataset, player, adversary) for adversary in adversaries]
+    uniforms = rng.random((samples, sum(len(sides) for sides in pairs)))
+    margins = np.empty((samples, len(pairs)))
+    for r in range(samples):
+        column = 0
+        for k, sides in enumerate(pairs):
+            total = np.zeros(12)
+            for _ in sides:
+                total += sides[int(uniforms[r, column] * len(sides))]
+                column += 1
+            spw = (total[4] + total[5]) / total[2]
+            rpw = (total[8] - total[10] - total[11]) / total[8]
+            margins[r, k] = spw - (1 - rpw)
+    return margins
+
+
+def test_bootstrap_reproduces_a_naive_recomputation(dataset):
+    player_A, player_B = dataset.list_players(match_min=20)[:2]
+    adversaries = dataset.common_opponents(player_A, player_B)
+    samples = 40
+    rng, naive_rng = np.random.default_rng(7), np.random.default_rng(7)
+
+    delta_samples = dataset.common_adversary_delta_samples(player_A, player_B, samples, rng=rng)
+    naive_deltas = naive_margins(dataset, player_A, adversaries, samples, naive_rng) - naive_margins(
+        dataset, player_B, adversaries, samples, naive_rng
+    )
+    np.testing.assert_allclose(delta_samples, naive_deltas, rtol=0, atol=1e-12)
+
+    # Then the common adversaries themselves are resampled, and P averaged over them
+    low, high = bootstrap_interval(delta_samples, 5, 0.8, rng)
+    chosen = naive_rng.integers(len(adversaries), size=(samples, len(adversaries)))
+    probabilities = [P_ABC_batch(naive_deltas[r, chosen[r]], 5).mean() for r in range(samples)]
+    naive_low, naive_high = np.quantile(probabilities, [0.1, 0.9])
+    assert low == pytest.approx(naive_low, abs=1e-6)
+    assert high == pytest.approx(naive_high, abs=1e-6)
+
+
+def test_interval_brackets_the_probability(dataset):
+    players = dataset.list_players(match_min=20)
+    for player_A, player_B in zip(players[:8], players[8:16]):
+        rng = np.random.default_rng(0)
+        _, deltas = dataset.common_adversary_deltas(player_A, player_B)
+        probability = P_ABC_batch(deltas, 5).mean()
+        samples = dataset.common_adversary_delta_samples(player_A, player_B, 500, rng=rng)
+        low, high = bootstrap_interval(samples, 5, 0.9, rng)
+        assert low < probability < high
+
+
+def test_fewer_common_opponents_give_wider_intervals(dataset):
+    # The same pairs over their first four months, with a handful of common opponents,
+    # and over both years, with a few dozen
+    players = dataset.list_players(match_min=20)
+    widths = {None: [], (20100101, 20100430): []}
+    for player_A, player_B in zip(players[:10], players[10:20]):
+        for window, pair_widths in widths.items():
+            rng = np.random.default_rng(0)
+            samples = dataset.common_adversary_delta_samples(player_A, player_B, 500, window, rng=rng)
+            if samples.shape[1] >= 2:
+                low, high = bootstrap_interval(samples, 5, 0.9, rng)
+                pair_widths.append(high - low)
+    assert len(widths[(20100101, 20100430)]) >= 5
+    assert np.mean(widths[(20100101, 20100430)]) > 1.5 * np.mean(widths[None])
+
+
+@pytest.mark.parametrize("confidence", [0, 1, 1.5, -0.9])
+def test_confidence_must_be_between_0_and_1(dataset, confidence):
+    player_A, player_B = dataset.list_players(match_min=20)[:2]
+    with pytest.raises(ValueError):
+        dataset.P(player_A, player_B, confidence=confidence)
+    with pytest.raises(ValueError):
+        bootstrap_interval(np.zeros((10, 3)), 5, confidence)
+
+
+def result_row(score: str = "6-4 6-3", date: str = "20100104", stats: bool = True):
+    # A results row with only the columns the filters read filled in
+    row = ["10"] * (LOSER_STATS_END + 1)
+    row[TOURNEY_DATE], row[SCORE] = date, score
+    if not stats:
+        row[WINNER_STATS_START] = ""
+    return row
+
+
+@pytest.mark.parametrize(
+    "score", ["W/O", "6-4 2-1 RET", "6-3 3-0 DEF", "6-2 Def.", "4-4 ABD", "Walkover", "6-4 3-3 unfinished"]
+)
+def test_incomplete_scores_are_dropped(score):
+    assert not is_completed(result_row(score))
+
+
+@pytest.mark.parametrize("score", ["6-4 6-3", "7-6(5) 6-7(3) 7-6(10)", "6-4 RW", "6-4 Retired?", "W/O2", "DEFAULT"])
+def test_scores_merely_containing_a_marker_are_kept(score):
+    assert is_completed(result_row(score))
+
+
+def test_filter_counts_the_rows_dropped_at_each_stage():
+    rows = (
+        [result_row()] * 5
+        + [result_row()[:LOSER_STATS_END], result_row(date="")]
+        + [result_row("W/O"), result_row("6-4 1-0 RET"), result_row("6-4 Def.")]
+        + [result_row(stats=False)] * 4
+        # Dropped at the first stage it fails only
+        + [result_row("W/O", stats=False), result_row("ABD", date="2010-01-04")]
+    )
+    dropped = Counter()
+    kept = list(filter_match_results(rows, dropped))
+    assert kept == [result_row()] * 5
+    assert dropped == {"malformed": 3, "incomplete": 4, "missing_stats": 4}
+    assert set(dropped) <= set(DROP_STAGES)
+
+
+def row_by_row_stats(dataset, player_id, adversary_id, keep):
+    # The player's stats then the adversary's, summed over the kept rows one at a time
+    table = dataset.table
+    total = np.zeros(12)
+    for i in np.flatnonzero(keep).tolist():
+        if table.winner[i] == player_id and adversary_id in (None, table.loser[i]):
+            total += np.concatenate([table.stats[i, :6], table.stats[i, 6:]])
+        elif table.loser[i] == player_id and adversary_id in (None, table.winner[i]):
+            total += np.concatenate([table.stats[i, 6:], table.stats[i, :6]])
+    return total
+
+
+def random_queries(dataset, count, seed=3):
+    # Random windows, open-ended on either side or not at all, with random surface and level filters
+    rng = np.random.default_rng(seed)
+    dates = np.unique(dataset.table.date)
+    for _ in range(count):
+        start_date, end_date = sorted(rng.choice(dates, 2).tolist())
+        window = [None, (start_date, end_date), (None, end_date), (start_date, None)][rng.integers(4)]
+        surface = rng.choice(dataset.surfaces, rng.integers(1, len(dataset.surfaces) + 1), replace=False).tolist()
+        level = rng.choice(dataset.levels, rng.integers(1, len(dataset.levels) + 1), replace=False).tolist()
+        yield window, [None, surface][rng.integers(2)], [None, level][rng.integers(2)]
+
+
+def kept_rows(dataset, window, surface, level):
+    table = dataset.table
+    start_date, end_date = date_bounds(window)
+    keep = (table.date >= start_date) & (table.date <= end_date)
+    if surface is not None:
+        keep &= np.isin(table.surfaces[table.surface], surface)
+    if level is not None:
+        keep &= np.isin(table.levels[table.level], level)
+    return keep
+
+
+def test_aggregate_stats_match_a_row_by_row_sum(dataset):
+    players = dataset.list_players(match_min=20)
+    rng = np.random.default_rng(5)
+    checked = 0
+    for window, surface, level in random_queries(dataset, 30):
+        keep = kept_rows(dataset, window, surface, level)
+        player = players[rng.integers(len(players))]
+        player_id = dataset.name_ids[player]
+        opponents = dataset.player_opponents(player, window, surface, level)
+        for adversary in [None] + sorted(opponents)[:3]:
+            adversary_id = None if adversary is None else dataset.name_ids[adversary]
+            expected = row_by_row_stats(dataset, player_id, adversary_id, keep)
+            if not expected.any():
+                with pytest.raises(NoAdversaryMatches):
+                    dataset.player_aggregate_stats(player, adversary, window, surface, level)
+                continue
+            stats = dataset.player_aggregate_stats(player, adversary, window, surface, level)
+            np.testing.assert_array_equal(np.array(astuple(stats)), expected)
+            checked += 1
+    assert checked >= 30
+
+
+def test_common_adversary_deltas_match_a_row_by_row_sum(dataset):
+    players = dataset.list_players(match_min=20)
+    rng = np.random.default_rng(6)
+    checked = 0
+    for window, surface, level in random_queries(dataset, 30):
+        keep = kept_rows(dataset, window, surface, level)
+        player_A, player_B = rng.choice(players, 2, replace=False).tolist()
+        id_A, id_B = dataset.name_ids[player_A], dataset.name_ids[player_B]
+        table = dataset.table
+        opponents = [
+            set(table.loser[keep & (table.winner == player_id)].tolist())
+            | set(table.winner[keep & (table.loser == player_id)].tolist())
+            for player_id in (id_A, id_B)
+        ]
+        common = sorted((opponents[0] & opponents[1]) - {id_A, id_B}, key=lambda i: dataset.names[i])
+
+        expected = []
+        for adversary_id in common:
+            margins = []
+            for player_id in (id_A, id_B):
+                total = row_by_row_stats(dataset, player_id, adversary_id, keep)
+                spw = (total[4] + total[5]) / total[2]
+                rpw = (total[8] - total[10] - total[11]) / total[8]
+                margins.append(spw - (1 - rpw))
+            expected.append(margins[0] - margins[1])
+
+        names, deltas = dataset.common_adversary_deltas(player_A, player_B, window, surface, level)
+        assert names == [dataset.names[i] for i in common]
+        np.testing.assert_allclose(deltas, expected, rtol=0, atol=1e-12)
+        checked += len(common)
+    assert checked >= 30
+
+
+def test_players_in_a_window_match_a_row_by_row_count(dataset):
+    table = dataset.table
+    for window, _, _ in random_queries(dataset, 20):
+        keep = kept_rows(dataset, window, None, None)
+        counts = {}
+        for player_id in table.winner[keep].tolist() + table.loser[keep].tolist():
+            counts[player_id] = counts.get(player_id, 0) + 1
+        for match_min in (0, 5):
+            expected = [dataset.names[i] for i, count in counts.items() if count >= match_min]
+            assert dataset.list_players(match_min, window) == expected
@@ -0,0 +1,69 @@
+# tests/test_portfolio.py
+import numpy as np
+import pytest
+
+from portfolio import simultaneous_kelly, size_slate
+
+# A small slate of independent bets, each with a positive edge
+PROBABILITIES = np.array([0.6, 0.55, 0.3, 0.7, 0.45, 0.52])
+ODDS = np.array([2.0, 2.1, 4.0, 1.6, 2.5, 2.05])
+
+
+@pytest.mark.parametrize("method", ["exact", "monte_carlo", "quadratic"])
+def test_single_bet_is_the_classic_kelly_fraction(method):
+    stakes, _, _ = simultaneous_kelly([0.6], [2.0], method=method)
+    # The quadratic approximation of the log-growth is only close
+    assert stakes[0] == pytest.approx(0.2, abs=1e-6 if method != "quadratic" else 0.05)
+
+
+def test_fraction_scales_the_stakes():
+    full, _, _ = simultaneous_kelly(PROBABILITIES, ODDS, method="exact")
+    half, _, _ = simultaneous_kelly(PROBABILITIES, ODDS, fraction=0.5, method="exact")
+    np.testing.assert_allclose(half, full / 2, atol=1e-6)
+
+
+@pytest.mark.parametrize("method", ["exact", "monte_carlo", "quadratic"])
+def test_cap_and_total_are_respected(method):
+    stakes, growth, _ = simultaneous_kelly(PROBABILITIES, ODDS, cap=0.05, total=0.2, method=method)
+    assert stakes.min() >= 0
+    assert stakes.max() <= 0.05 + 1e-9
+    assert stakes.sum() <= 0.2 + 1e-9
+    assert growth > 0
+
+    stakes, _, _ = simultaneous_kelly(PROBABILITIES, ODDS, fraction=0.5, cap=0.05, total=0.2, method=method)
+    assert stakes.max() <= 0.05 + 1e-9
+    assert stakes.sum() <= 0.2 + 1e-9
+
+
+def test_methods_agree_on_a_small_slate():
+    exact, exact_growth, method = simultaneous_kelly(PROBABILITIES, ODDS)
+    assert method == "exact"
+    sampled, _, _ = simultaneous_kelly(
+        PROBABILITIES, ODDS, method="monte_carlo", scenarios=200000, rng=np.random.default_rng(1)
+    )
+    quadratic, _, _ = simultaneous_kelly(PROBABILITIES, ODDS, method="quadratic")
+    np.testing.assert_allclose(sampled, exact, atol=0.015)
+    np.testing.assert_allclose(quadratic, exact, atol=0.03)
+    # Betting together stakes less than the independent Kelly fractions
+    assert exact.sum() < ((PROBABILITIES * ODDS - 1) / (ODDS - 1)).sum()
+    assert exact_growth > 0
+
+
+def test_bets_without_an_edge_are_not_backed():
+    stakes, _, _ = simultaneous_kelly([0.6, 0.4], [2.0, 2.0], method="exact")
+    assert stakes[0] > 0 and stakes[1] == 0
+
+
+def test_size_slate_backs_the_side_with_the_larger_edge():
+    # A has the edge in the first match, B in the second, neither in the third
+    portfolio = size_slate([0.6, 0.3, 0.5], [2.0, 2.5, 1.9], [2.1, 1.6, 1.9])
+    assert portfolio.stakes_A[0] > 0 and portfolio.stakes_B[0] == 0
+    assert portfolio.stakes_A[1] == 0 and portfolio.stakes_B[1] > 0
+    assert portfolio.stakes_A[2] == 0 and portfolio.stakes_B[2] == 0
+    assert portfolio.method == "exact"
+
+
+@pytest.mark.parametrize("fraction", [0, 1.5])
+def test_fraction_must_be_within_one(fraction):
+    with pytest.raises(ValueError):
+        simultaneous_kelly([0.6], [2.0], fraction=fraction)
@@ -0,0 +1,112 @@
+# tests/test_predictor.py
+import contextlib
+import csv
+import io
+import json
+import math
+
+import numpy as np
+import pytest
+
+import predictor
+from predictor import draw_probabilities, finite_json, score_fixture, write_draw_csv
+
+
+def test_draw_csv_with_a_bye_names_every_round():
+    matrix = np.full((4, 4), 0.5)
+    byes = [False, True, False, False]
+    reach = draw_probabilities(matrix, byes)
+    entrants = [i for i, bye in enumerate(byes) if not bye]
+    output = io.StringIO()
+    write_draw_csv(output, ["A", "C", "D"], reach[entrants])
+    rows = list(csv.reader(io.StringIO(output.getvalue())))
+    assert rows[0] == ["player", "SF", "F", "W"]
+    assert all(len(row) == len(rows[0]) for row in rows)
+    assert rows[1][1:] == ["1.000000", "1.000000", "0.500000"]
+
+
+def read_strict_json(line: str):
+    # json.loads accepts the NaN and Infinity tokens, which are not JSON
+    def reject(token):
+        raise ValueError(f"{token} is not JSON")
+
+    return json.loads(line, parse_constant=reject)
+
+
+def test_score_fixture_reports_bad_values(dataset):
+    player_A, player_B = dataset.list_players(match_min=20)[:2]
+    fixture = {"gender": "men", "player_A": player_A, "player_B": player_B}
+    for bad in (
+        {"surface": 5},
+        {"level": {"G": 1}},
+        {"player_A": [player_A]},
+        {"format": ["best_of_3"]},
+        {"tourney_level": 1},
+        {"pooled_weight": "nan"},
+        {"pooled_weight": -10},
+        {"start_date": "yesterday"},
+        {"half_life": "0"},
+        {"half_life": 0},
+        {"half_life": -30},
+        {"half_life": "nan"},
+    ):
+        result = score_fixture({**fixture, **bad}, lambda gender: dataset)
+        assert "error" in result, bad
+        assert "probability" not in result
+
+
+def test_batch_reports_bad_rows_on_their_own(dataset, tmp_path, monkeypatch, capsys):
+    monkeypatch.setattr(predictor, "load_dataset", lambda *args: dataset)
+    player_A, player_B = dataset.list_players(match_min=20)[:2]
+    fixture = {"gender": "men", "player_A": player_A, "player_B": player_B}
+    rows = [
+        fixture,
+        {**fixture, "surface": 5},
+        {**fixture, "player_B": [player_B]},
+        {**fixture, "half_life": "0"},
+        {**fixture, "odds_A": 1.0, "odds_B": 3.0},
+        fixture,
+    ]
+    fixtures = tmp_path / "fixtures.jsonl"
+    fixtures.write_text("".join(json.dumps(row) + "\n" for row in rows))
+    predictor.batch_main([str(fixtures)])
+
+    results = [read_strict_json(line) for line in capsys.readouterr().out.splitlines()]
+    assert len(results) == len(rows)
+    assert results[0] == results[-1] and results[0]["probability"] is not None
+    assert "error" in results[1] and "error" in results[2]
+    assert "half_life" in results[3]["error"]
+    assert "kelly_A" not in results[4]
+
+
+def test_finite_json_writes_null_for_non_finite_numbers():
+    assert finite_json({"p": math.nan, "odds": [math.inf, 2.0], "name": "A"}) == {
+        "p": None,
+        "odds": [None, 2.0],
+        "name": "A",
+    }
+
+
+def test_P_matrix_is_consistent_with_P(dataset):
+    players = dataset.list_players(match_min=20)[:6] + ["Nobody"]
+    matrix = predictor.P_matrix(players, "men", dataset=dataset)
+    known = ~np.isnan(matrix)
+    np.testing.assert_allclose(matrix[known], (1 - matrix.T)[known], rtol=0, atol=1e-12)
+    assert np.isnan(matrix[-1]).all() and np.isnan(matrix[:, -1]).all()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for i in range(6):
+            for j in range(6):
+                if i != j:
+                    assert matrix[i, j] == pytest.approx(dataset.P(players[i], players[j])[0], abs=1e-12)
+
+
+def test_bracket_needs_a_power_of_two_draw(tmp_path, monkeypatch, capsys):
+    def load_dataset(*args):
+        raise AssertionError("The draw size is checked before loading")
+
+    monkeypatch.setattr(predictor, "load_dataset", load_dataset)
+    draw = tmp_path / "draw.txt"
+    draw.write_text("A\nB\nC\nD\n\n")
+    with pytest.raises(SystemExit):
+        predictor.draw_main(["men", str(draw), "--bracket", str(tmp_path / "rounds.csv")])
+    assert "--bracket" in capsys.readouterr().err
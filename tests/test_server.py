@@ -0,0 +1,174 @@
+# tests/test_server.py
+import asyncio
+import json
+import threading
+from http import HTTPStatus
+
+import pytest
+
+import server
+from server import PredictionService
+
+
+@pytest.fixture
+def service(dataset):
+    # A service serving the generated dataset for both tours, without downloading anything
+    service = PredictionService((2010, 2011), workers=4)
+    service.datasets = {"men": dataset, "women": dataset}
+    service.players = {"men": sorted(dataset.list_players()), "women": sorted(dataset.list_players())}
+    yield service
+    service.executor.shutdown()
+
+
+@pytest.fixture
+def players(dataset):
+    return dataset.list_players(match_min=20)[:4]
+
+
+def request(service, method: str, target: str, payload=None):
+    body = json.dumps(payload).encode() if payload is not None else b""
+    return asyncio.run(service.dispatch(method, target, body))
+
+
+async def exchange(service, raw_request: bytes) -> bytes:
+    # One request through the HTTP handler, over a real connection
+    listener = await asyncio.start_server(service.handle, "127.0.0.1", 0)
+    async with listener:
+        reader, writer = await asyncio.open_connection(*listener.sockets[0].getsockname()[:2])
+        writer.write(raw_request)
+        await writer.drain()
+        response = await asyncio.wait_for(reader.read(), 10)
+        writer.close()
+        return response
+
+
+def post(service, target: str, payload) -> bytes:
+    body = json.dumps(payload).encode()
+    head = f"POST {target} HTTP/1.1\r\nConnection: close\r\nContent-Length: {len(body)}\r\n\r\n"
+    return asyncio.run(exchange(service, head.encode() + body))
+
+
+def test_predict(service, players):
+    player_A, player_B = players[:2]
+    status, result = request(service, "POST", "/predict", {"gender": "men", "player_A": player_A, "player_B": player_B})
+    assert status == HTTPStatus.OK
+    assert 0 <= result["probability"] <= 1
+    assert result["common_opponents"] > 0
+
+    status, same = request(service, "GET", f"/predict?gender=men&player_A={player_A}&player_B={player_B}")
+    assert status == HTTPStatus.OK and same == result
+
+    status, result = request(service, "POST", "/predict", {"gender": "men", "player_A": player_A, "player_B": "Nobody"})
+    assert status == HTTPStatus.BAD_REQUEST and "error" in result
+
+
+@pytest.mark.parametrize(
+    "fixture",
+    [{"surface": 5}, {"player_A": ["x"]}, {"level": [1]}, {"format": ["best_of_3"]}, {"half_life": "0"}],
+)
+def test_predict_answers_bad_values_with_a_400(service, players, fixture):
+    response = post(service, "/predict", {"gender": "men", "player_A": players[0], "player_B": players[1], **fixture})
+    head, _, content = response.partition(b"\r\n\r\n")
+    assert head.startswith(b"HTTP/1.1 400 ")
+    assert "error" in json.loads(content)
+
+
+def test_unexpected_errors_are_answered_with_a_500(service, players, monkeypatch):
+    def broken(*args):
+        raise RuntimeError("broken")
+
+    monkeypatch.setattr(server, "score_fixture", broken)
+    response = post(service, "/predict", {"gender": "men", "player_A": players[0], "player_B": players[1]})
+    assert response.startswith(b"HTTP/1.1 500 ")
+    assert "broken" in json.loads(response.partition(b"\r\n\r\n")[2])["error"]
+
+
+def test_batch(service, players):
+    fixtures = [
+        {"gender": "men", "player_A": players[0], "player_B": players[1]},
+        {"gender": "men", "player_A": players[2], "player_B": "Nobody"},
+        {"gender": "men", "player_A": players[2], "player_B": players[3], "surface": 5},
+    ]
+    status, payload = request(service, "POST", "/batch", {"fixtures": fixtures})
+    assert status == HTTPStatus.OK
+    results = payload["results"]
+    assert len(results) == 3
+    assert results[0]["probability"] is not None
+    assert "error" in results[1] and "error" in results[2]
+
+    status, _ = request(service, "POST", "/batch", {"fixtures": [1, 2]})
+    assert status == HTTPStatus.BAD_REQUEST
+
+
+def test_players(service, dataset):
+    status, payload = request(service, "GET", "/players?gender=women")
+    assert status == HTTPStatus.OK
+    assert payload["players"] == sorted(dataset.list_players())
+    status, _ = request(service, "GET", "/players?gender=mixed")
+    assert status == HTTPStatus.BAD_REQUEST
+    status, _ = request(service, "POST", "/players?gender=men")
+    assert status == HTTPStatus.METHOD_NOT_ALLOWED
+
+
+def test_identical_requests_share_one_computation(service, players, monkeypatch):
+    calls = []
+    release = threading.Event()
+    score_fixture = server.score_fixture
+
+    def counted(*args):
+        calls.append(args[0])
+        release.wait(10)
+        return score_fixture(*args)
+
+    monkeypatch.setattr(server, "score_fixture", counted)
+    fixture = {"gender": "men", "player_A": players[0], "player_B": players[1]}
+
+    async def concurrent_predictions():
+        pending = [asyncio.ensure_future(service.predict(dict(fixture))) for _ in range(5)]
+        other = asyncio.ensure_future(service.predict({**fixture, "player_B": players[2]}))
+        await asyncio.sleep(0.1)
+        release.set()
+        return await asyncio.gather(*pending), await other
+
+    results, other = asyncio.run(concurrent_predictions())
+    assert len(calls) == 2
+    assert all(result == results[0] for result in results)
+    assert other != results[0]
+    assert not service.in_flight
+
+
+def test_reload_swaps_the_dataset_in(service, dataset, players, monkeypatch, tmp_path):
+    from benchmarks.generator import generate
+    from match_stats import Dataset, MatchTable, load_filtered_match_results
+
+    paths = generate(str(tmp_path), "women", [2015], players=30, tournaments=6)
+    reloaded = Dataset(MatchTable.concatenate([load_filtered_match_results(path) for path in paths.values()]), "women")
+    loading = threading.Event()
+    release = threading.Event()
+
+    def load(gender):
+        loading.set()
+        release.wait(10)
+        return reloaded, sorted(reloaded.list_players())
+
+    monkeypatch.setattr(service, "_load", load)
+
+    async def reload_while_predicting():
+        status, started = await service.dispatch("POST", "/reload?gender=women", b"")
+        assert status == HTTPStatus.ACCEPTED and started == {"women": True}
+        # A second reload of the same tour is refused while the first one runs
+        assert (await service.dispatch("POST", "/reload?gender=women", b""))[1] == {"women": False}
+        while not loading.is_set():
+            await asyncio.sleep(0.01)
+        # Requests keep being answered from the previous dataset during the reload
+        status, payload = await service.dispatch("GET", "/players?gender=women", b"")
+        assert payload["players"] == sorted(dataset.list_players())
+        release.set()
+        await service.reloading["women"]
+        await asyncio.sleep(0)
+
+    asyncio.run(reload_while_predicting())
+    assert service.datasets["women"] is reloaded
+    assert service.datasets["men"] is dataset
+    assert service.players["women"] == sorted(reloaded.list_players())
+    assert not service.reloading